@@ -0,0 +1,90 @@
+"""
+Compares the vectorized free energy transform of FreeEnergyCalculator with the original loop over bins.
+
+Run from the root of the repository with
+    python benchmarks/bench_free_energy.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from stringmethod.postprocessing import FreeEnergyCalculator
+
+
+def legacy_free_energy(probability_distribution, kB, T):
+    """The loop over rows and columns used before vectorization, kept as a reference. Only works in 2D"""
+    fe = np.empty(probability_distribution.shape)
+    for row_idx, p_row in enumerate(probability_distribution):
+        for col_idx, p in enumerate(p_row):
+            if p is None or np.isnan(p):
+                fe[row_idx, col_idx] = sys.float_info.max
+            else:
+                fe[row_idx, col_idx] = -kB * T * np.log(p)
+    fe -= fe.min()
+    return fe
+
+
+def create_probability_distribution(n_dim, n_grid_points, seed=0):
+    """A random distribution where a tenth of the bins were never reached"""
+    rng = np.random.default_rng(seed)
+    prob = rng.random((n_grid_points,) * n_dim)
+    prob[rng.random(prob.shape) < 0.1] = 0
+    return prob / prob.sum()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--grids",
+        type=str,
+        nargs="+",
+        default=["2x300", "3x60", "4x25"],
+        help="grids as <number of dimensions>x<number of grid points>",
+    )
+    args = parser.parse_args()
+    print(
+        "{:>6} {:>10} {:>12} {:>12} {:>12} {:>9} {:>10}".format(
+            "grid", "bins", "legacy", "float64", "float32", "speedup", "MB float32"
+        )
+    )
+    for grid in args.grids:
+        n_dim, n_grid_points = (int(v) for v in grid.split("x"))
+        prob = create_probability_distribution(n_dim, n_grid_points)
+        timings = {}
+        for dtype in ["float64", "float32"]:
+            fc = FreeEnergyCalculator(
+                postprocessing_dir=None,
+                transition_count=np.zeros((0, 0)),
+                probability_distribution=prob,
+                unreached_bins="inf",
+                dtype=dtype,
+            )
+            start = time.perf_counter()
+            fe = fc.compute_free_energy()
+            timings[dtype] = time.perf_counter() - start
+        # The legacy loop only handles 2D arrays, so higher dimensional grids are flattened to 2D
+        start = time.perf_counter()
+        with np.errstate(divide="ignore"):
+            legacy_free_energy(prob.reshape((-1, n_grid_points)), kB=fc.kB, T=fc.T)
+        t_legacy = time.perf_counter() - start
+        print(
+            "{:>6} {:>10} {:>11.3f}s {:>11.4f}s {:>11.4f}s {:>8.0f}x {:>10.1f}".format(
+                grid,
+                prob.size,
+                t_legacy,
+                timings["float64"],
+                timings["float32"],
+                t_legacy / timings["float64"],
+                fe.nbytes / 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Compares the speed of the string reparametrization methods on long, high dimensional strings.
+
+Run from the root of the repository with
+    python benchmarks/bench_reparametrization.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from stringmethod.utils import string_reparametrization as sr
+
+
+def _legacy_linear_reparametrization(path, epsilon, arclength_weight):
+    """The point by point reparametrization used before the vectorized engine, kept as a reference"""
+    arc_count = len(path) - 1
+    L = sum(np.linalg.norm(path[i + 1] - path[i]) for i in range(arc_count))
+    new_path = np.empty(path.shape)
+    new_path[0] = path[0]
+    new_path[arc_count] = path[arc_count]
+    dl = 0
+    next_old_point_idx, new_point_idx = 1, 1
+    current_point = path[0]
+    while new_point_idx < len(path) - 1:
+        displacement = L * arclength_weight[new_point_idx - 1] - dl
+        next_point = path[next_old_point_idx]
+        vector = next_point - current_point
+        veclength = np.linalg.norm(vector)
+        if displacement > veclength + epsilon:
+            dl += veclength
+            current_point = next_point
+            next_old_point_idx += 1
+        else:
+            current_point = current_point + vector / veclength * displacement
+            new_path[new_point_idx] = current_point
+            new_point_idx += 1
+            dl = 0
+    return new_path
+
+
+def legacy_reparametrize_path_iter(
+    path, epsilon=1e-5, max_iterations=999, convergence=1e-2
+):
+    arclength_weight = np.zeros((len(path) - 1,)) + 1 / (len(path) - 1)
+    previous_path = path
+    new_path = path
+    for _ in range(max_iterations):
+        new_path = _legacy_linear_reparametrization(
+            previous_path, epsilon, arclength_weight
+        )
+        dist = np.linalg.norm(new_path - previous_path) / np.linalg.norm(previous_path)
+        if dist <= convergence:
+            break
+        previous_path = new_path
+    return new_path
+
+
+def create_string(n_beads, n_cvs, seed=0):
+    """A random walk with unevenly spaced beads, scaled to [0, 1] like the strings in the simulations"""
+    rng = np.random.default_rng(seed)
+    string = np.cumsum(rng.random((n_beads, n_cvs)) * rng.random((n_beads, 1)), axis=0)
+    string -= string.min(axis=0)
+    return string / string.max(axis=0)
+
+
+def timeit(func, *args, repeats=3, **kwargs):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--beads", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--cvs", type=int, nargs="+", default=[2, 100, 400])
+    parser.add_argument(
+        "--grid_resolution",
+        type=int,
+        default=300,
+        help="resolution of reparametrize_path_grid. Its default of 30000 takes long for large strings",
+    )
+    args = parser.parse_args()
+    print(
+        "{:>6} {:>5} {:>14} {:>14} {:>14} {:>14} {:>10}".format(
+            "beads", "cvs", "legacy iter", "iter", "arclength", "grid", "max diff"
+        )
+    )
+    for n_beads in args.beads:
+        for n_cvs in args.cvs:
+            string = create_string(n_beads, n_cvs)
+            t_legacy, legacy = timeit(legacy_reparametrize_path_iter, string)
+            t_iter, new = timeit(sr.reparametrize_path_iter, string)
+            t_arclength, _ = timeit(sr.reparametrize_path_arclength, string)
+            try:
+                t_grid, _ = timeit(
+                    sr.reparametrize_path_grid,
+                    string,
+                    resolution=args.grid_resolution,
+                    repeats=1,
+                )
+            except Exception:
+                # The grid method loses points when the resolution is too low for the string
+                t_grid = np.nan
+            print(
+                "{:>6} {:>5} {:>13.4f}s {:>13.4f}s {:>13.4f}s {:>13.4f}s {:>10.1e}".format(
+                    n_beads,
+                    n_cvs,
+                    t_legacy,
+                    t_iter,
+                    t_arclength,
+                    t_grid,
+                    np.abs(legacy - new).max(),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Compares the vectorized binning of TransitionCountCalculator with the original point by point binning.
+
+Run from the root of the repository with
+    python benchmarks/bench_transition_count.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from stringmethod.postprocessing import TransitionCountCalculator
+from stringmethod.postprocessing.index_conversion import IndexConverter
+
+
+def legacy_bin_indices(cv_values, grid):
+    """The per point argmin binning used before vectorization, kept as a reference"""
+    converter = IndexConverter(n_dim=grid.shape[1], n_grid_points=grid.shape[0])
+    bins = np.empty((len(cv_values),), dtype=int)
+    for idx, point in enumerate(cv_values):
+        grid_idx = np.array(
+            [
+                (np.abs(point[cv_idx] - grid[:, cv_idx])).argmin()
+                for cv_idx in range(grid.shape[1])
+            ]
+        )
+        bins[idx] = converter.convert_to_bin_idx(grid_idx)
+    return bins
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transitions", type=int, default=10**6)
+    parser.add_argument("--cvs", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--n_grid_points", type=int, default=30)
+    parser.add_argument(
+        "--legacy_transitions",
+        type=int,
+        default=10**4,
+        help="the legacy binning is timed on this many transitions and extrapolated",
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    print(
+        "{:>4} {:>12} {:>16} {:>12} {:>9}".format(
+            "cvs", "transitions", "legacy (extrap.)", "vectorized", "speedup"
+        )
+    )
+    for n_cvs in args.cvs:
+        start = rng.normal(size=(args.transitions, n_cvs))
+        cv_coordinates = np.stack(
+            [start, start + 0.1 * rng.normal(size=start.shape)], axis=1
+        )
+        tc = TransitionCountCalculator(
+            postprocessing_dir=None,
+            cv_coordinates=cv_coordinates,
+            n_grid_points=args.n_grid_points,
+        )
+        t0 = time.perf_counter()
+        tc.run()
+        t_vectorized = time.perf_counter() - t0
+
+        n_legacy = min(args.legacy_transitions, args.transitions)
+        t0 = time.perf_counter()
+        legacy_start = legacy_bin_indices(cv_coordinates[:n_legacy, 0], tc.grid)
+        legacy_end = legacy_bin_indices(cv_coordinates[:n_legacy, 1], tc.grid)
+        # Both start and end points were binned
+        t_legacy = (time.perf_counter() - t0) * args.transitions / n_legacy
+        vectorized_start = tc._find_bin_indices(cv_coordinates[:n_legacy, 0])
+        vectorized_end = tc._find_bin_indices(cv_coordinates[:n_legacy, 1])
+        if not (
+            np.array_equal(legacy_start, vectorized_start)
+            and np.array_equal(legacy_end, vectorized_end)
+        ):
+            print("WARNING: vectorized bins differ from the legacy bins")
+        print(
+            "{:>4} {:>12} {:>15.2f}s {:>11.3f}s {:>8.0f}x".format(
+                n_cvs,
+                args.transitions,
+                t_legacy,
+                t_vectorized,
+                t_legacy / t_vectorized,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -40,7 +40,8 @@ def handle_periodicity(
 ) -> np.array:
     """
     (Optional method)
-    Handle periodic boundary conditions by taking modules 2pi or performing dihedral-PCA
+    Handle periodic boundary conditions by taking modules 2pi or performing dihedral-PCA.
+    Not needed when cv_periods is set in the config, since the transitions are then binned periodically
     :param dpca: if True, perform dPCA onto the input and convert it into two components
     :param cv_coordinates:
     :return:
@@ -91,6 +92,7 @@ def compute():
         # It sets the resolution. Its optimal value depends on your swarm trajectory length and sample size
         n_grid_points=13,
         cv_coordinates=cv_coordinates,
+        cv_periods=config.cv_periods,
     )
     tc.run()
     tc.persist()
@@ -44,11 +44,111 @@ class Config(object):
     mdrun_options_restrained: Optional[tuple] = None
     # """Number of gpus per node (if using GPU cluster)."""
     # gpus_per_node: Optional[int] = None
+    """
+    Period of every CV, e.g. 360 for a dihedral angle in degrees, or null for CVs which are not periodic.
+    Periodic CVs are wrapped to [-period/2, period/2). No CV is periodic by default
+    """
+    cv_periods: Optional[tuple] = None
     """Use a function to combine cvs"""
     use_function: Optional[bool] = False
     """Use Plumed instead of Gromacs' pull code for defining cvs"""
     use_plumed: Optional[bool] = False
     """
+    Overlap the restrained and swarm simulations of different beads.
+    The swarms of a bead start as soon as its restrained simulation is done and there are free cores.
+    """
+    pipelined: Optional[bool] = False
+    """Number of cores given to every simulation when running pipelined"""
+    pipeline_cores_per_simulation: Optional[int] = 1
+    """
+    Run grompp once per bead instead of once per swarm. Every swarm gets a copy of the bead's tpr file
+    with its own ld-seed, so it is only used with a stochastic integrator (sd or bd) and without gen-vel
+    """
+    shared_swarm_tpr: Optional[bool] = False
+    """Number of threads reading the swarms' output files in parallel when computing the drift"""
+    io_workers: Optional[int] = 16
+    """
+    Update a free energy estimate with the swarms' transitions after every string iteration.
+    The estimate is written to the online directory in postprocessing_dir
+    """
+    online_free_energy: Optional[bool] = False
+    """Number of grid points per CV of the online free energy estimate"""
+    online_n_grid_points: Optional[int] = 30
+    """
+    Number of resamples of the swarm trajectories used to estimate the error of the free energy in postprocessing.
+    0 disables the error estimate
+    """
+    uncertainty_resamples: Optional[int] = 0
+    """
+    How the swarm trajectories are resampled: 'bootstrap' draws single trajectories,
+    'block' whole string iterations
+    """
+    uncertainty_resampling: Optional[str] = "bootstrap"
+    """
+    Where simulations are launched: 'slurm' runs them with srun in the current allocation,
+    'local' runs them directly on this machine and 'auto' picks slurm if inside an allocation.
+    """
+    executor: Optional[str] = "auto"
+    """
+    Minimum number of MPI ranks of every simulation in a -multidir job of the slurm executor.
+    Ranks which would be left idle are given to the simulations
+    """
+    slurm_min_ranks_per_simulation: Optional[int] = 1
+    """Number of cores used by the local executor. All available cores by default"""
+    local_cores: Optional[int] = None
+    """Number of OpenMP threads of every simulation launched by the local executor"""
+    local_threads_per_simulation: Optional[int] = 1
+    """Pin every simulation launched by the local executor to its own cores"""
+    local_pin_cores: Optional[bool] = True
+    """
+    Seconds without any growth of a simulation's output files after which it is stopped as a straggler
+    and relaunched with a new random seed. Only swarm simulations are stopped and relaunched,
+    other simulations are only reported. null disables the check
+    """
+    straggler_timeout: Optional[float] = None
+    """
+    Stop and relaunch a swarm simulation which progresses this many times slower than the others of the step.
+    null disables the check
+    """
+    straggler_slowdown: Optional[float] = None
+    """Number of times a straggling swarm simulation is relaunched"""
+    straggler_max_relaunches: Optional[int] = 1
+    """
+    Fraction of the swarms of every bead which have to finish for the drift to be computed.
+    The drift is then computed from the finished swarms, and the others are recorded as excluded.
+    1 requires all swarms to finish
+    """
+    swarm_quorum: Optional[float] = 1.0
+    """
+    Target standard error of the drift of every bead, relative to the range of the CVs along the string
+    (or their period for periodic CVs). If set, swarm_size swarms are run for every bead first,
+    and swarms are added to the beads above the target. null runs swarm_size swarms for every bead
+    """
+    swarm_drift_error: Optional[float] = None
+    """Maximum number of swarms of a bead when adding swarms. null for 4 times swarm_size"""
+    max_swarm_size: Optional[int] = None
+    """
+    Stop iterating once the running average of the last convergence_window strings changed less than this
+    in convergence_patience consecutive iterations. null runs all max_iterations iterations
+    """
+    convergence_threshold: Optional[float] = None
+    """Number of strings in the running average used to decide convergence"""
+    convergence_window: Optional[int] = 5
+    """Number of consecutive iterations the convergence criterion has to hold"""
+    convergence_patience: Optional[int] = 3
+    """
+    What to do once the string has converged: 'stop' the simulation,
+    or continue with 'sampling' iterations which keep the string fixed
+    """
+    convergence_action: Optional[str] = "stop"
+    """Number of iterations run with start_mode sampling, or after the string has converged"""
+    sampling_iterations: Optional[int] = 10
+    """
+    Largest distance between a bead and a structure of the previous sampling iteration, relative to the range of the CVs
+    along the string, for the bead's swarms to start from it instead of running a restrained simulation
+    """
+    sampling_tolerance: Optional[float] = 0.05
+    """
     Version of the software code, defined as stringmethod.version.
     Might be used in the future to ensure backwards compatibility.
     """
@@ -69,6 +169,64 @@ class Config(object):
         """
         if self.swarm_size is None or self.swarm_size < 0:
             raise ConfigError("swarm_size must be >= 0")
+        if (
+            self.pipeline_cores_per_simulation is None
+            or self.pipeline_cores_per_simulation < 1
+        ):
+            raise ConfigError("pipeline_cores_per_simulation must be >= 1")
+        if self.io_workers is None or self.io_workers < 1:
+            raise ConfigError("io_workers must be >= 1")
+        if self.cv_periods is not None and any(
+            p is not None and not p > 0 for p in self.cv_periods
+        ):
+            raise ConfigError("cv_periods must be null or > 0")
+        if self.online_n_grid_points is None or self.online_n_grid_points < 2:
+            raise ConfigError("online_n_grid_points must be >= 2")
+        if self.uncertainty_resamples is None or self.uncertainty_resamples < 0:
+            raise ConfigError("uncertainty_resamples must be >= 0")
+        if self.uncertainty_resampling not in ["bootstrap", "block"]:
+            raise ConfigError(
+                "uncertainty_resampling must be one of bootstrap or block"
+            )
+        if self.executor not in ["auto", "slurm", "local"]:
+            raise ConfigError("executor must be one of auto, slurm or local")
+        if (
+            self.slurm_min_ranks_per_simulation is None
+            or self.slurm_min_ranks_per_simulation < 1
+        ):
+            raise ConfigError("slurm_min_ranks_per_simulation must be >= 1")
+        if (
+            self.local_threads_per_simulation is None
+            or self.local_threads_per_simulation < 1
+        ):
+            raise ConfigError("local_threads_per_simulation must be >= 1")
+        if self.straggler_timeout is not None and not self.straggler_timeout > 0:
+            raise ConfigError("straggler_timeout must be null or > 0")
+        if self.straggler_slowdown is not None and not self.straggler_slowdown > 1:
+            raise ConfigError("straggler_slowdown must be null or > 1")
+        if self.straggler_max_relaunches is None or self.straggler_max_relaunches < 0:
+            raise ConfigError("straggler_max_relaunches must be >= 0")
+        if self.swarm_quorum is None or not 0 < self.swarm_quorum <= 1:
+            raise ConfigError("swarm_quorum must be > 0 and <= 1")
+        if self.swarm_drift_error is not None and not self.swarm_drift_error > 0:
+            raise ConfigError("swarm_drift_error must be null or > 0")
+        if self.max_swarm_size is not None and self.max_swarm_size < self.swarm_size:
+            raise ConfigError("max_swarm_size must be null or >= swarm_size")
+        if (
+            self.convergence_threshold is not None
+            and not self.convergence_threshold > 0
+        ):
+            raise ConfigError("convergence_threshold must be null or > 0")
+        if self.convergence_window is None or self.convergence_window < 1:
+            raise ConfigError("convergence_window must be >= 1")
+        if self.convergence_patience is None or self.convergence_patience < 1:
+            raise ConfigError("convergence_patience must be >= 1")
+        if self.convergence_action not in ["stop", "sampling"]:
+            raise ConfigError("convergence_action must be one of stop or sampling")
+        if self.sampling_iterations is None or self.sampling_iterations < 1:
+            raise ConfigError("sampling_iterations must be >= 1")
+        if self.sampling_tolerance is None or self.sampling_tolerance < 0:
+            raise ConfigError("sampling_tolerance must be >= 0")
 
 
 def load_config(config_file: str) -> Config:
@@ -78,7 +236,15 @@ def load_config(config_file: str) -> Config:
         with open(config_file) as json_file:
             data = json.load(json_file)
             c = Config(**data)
-    for prop in ["use_plumed", "use_function", "fixed_endpoints"]:
+    for prop in [
+        "use_plumed",
+        "use_function",
+        "fixed_endpoints",
+        "pipelined",
+        "shared_swarm_tpr",
+        "online_free_energy",
+        "local_pin_cores",
+    ]:
         attr = c.__getattribute__(prop)
         if not isinstance(attr, bool):
             if attr.lower() == "true":
@@ -1,6 +1,7 @@
 import argparse
 
-from simulations import steeredmd, stringmd
+from simulations import samplingmd, steeredmd, stringmd
+from simulations.gmx_jobs import executors, gmx_jobs
 from stringmethod import *
 
 
@@ -21,7 +22,7 @@ def parse_args():
     parser.add_argument(
         "--start_mode",
         type=str,
-        help="starting_step (steered|string|postprocessing)",
+        help="starting_step (steered|string|sampling|postprocessing)",
         default="string",
     )
     return parser.parse_args()
@@ -29,12 +30,22 @@ def parse_args():
 
 def run(conf: config.Config, start_mode, iteration=1) -> None:
     logger.debug("Using config %s", conf)
+    if start_mode in ["string", "steered", "sampling"]:
+        gmx_jobs.set_executor(executors.create_executor(conf))
     if start_mode == "string":
         r = stringmd.StringIterationRunner.from_config(
             config=conf, iteration=iteration, append=start_mode == "auto"
         )
         r.run()
+        if r.converged and conf.convergence_action == "sampling":
+            logger.info("Continuing with sampling iterations")
+            return run(conf, start_mode="sampling", iteration=r.iteration)
         # return run(conf, start_mode='postprocessing')
+    elif start_mode == "sampling":
+        r = samplingmd.SamplingRunner.from_config(
+            config=conf, iteration=iteration, append=False
+        )
+        r.run()
     elif start_mode == "steered":
         r = steeredmd.SteeredRunner.from_config(config=conf)
         r.run()
@@ -1,8 +1,11 @@
 from stringmethod.config import Config
 
+from .cv_store import CvStore
 from .cv_value_extraction import CvValueExtractor
 from .free_energy_calculation import FreeEnergyCalculator
+from .online_estimation import OnlineFreeEnergyEstimator
 from .transition_count_calculation import TransitionCountCalculator
+from .uncertainty import UncertaintyEstimator
 
 
 def run(config: Config):
@@ -12,7 +15,9 @@ def run(config: Config):
     ce.run()
     ce.persist()
     tc = TransitionCountCalculator.from_config(
-        config=config, cv_coordinates=ce.cv_coordinates
+        config=config,
+        cv_coordinates=ce.cv_coordinates,
+        cv_periods=config.cv_periods,
     )
     tc.run()
     tc.persist()
@@ -21,11 +26,25 @@ def run(config: Config):
     )
     fc.run()
     fc.persist()
+    if config.uncertainty_resamples > 0:
+        ue = UncertaintyEstimator.from_config(
+            config=config,
+            cv_coordinates=ce.cv_coordinates,
+            iteration_numbers=ce.iteration_numbers,
+            resampling=config.uncertainty_resampling,
+            n_resamples=config.uncertainty_resamples,
+            cv_periods=config.cv_periods,
+        )
+        ue.run()
+        ue.persist()
 
 
 __all__ = [
+    "CvStore",
     "CvValueExtractor",
     "FreeEnergyCalculator",
+    "OnlineFreeEnergyEstimator",
     "TransitionCountCalculator",
+    "UncertaintyEstimator",
     "run",
 ]
@@ -0,0 +1,163 @@
+import json
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from stringmethod import logger
+
+
+class CvStore(object):
+    """
+    Append-only store of the swarms' start and end CV coordinates, one block of transitions per iteration.
+
+    The coordinates of all iterations are kept in a single raw binary file, so that any range of
+    consecutive iterations can be memory mapped without copying. A json manifest records
+    which iterations and files have been processed and where their transitions are in the data file.
+    """
+
+    dtype = np.float64
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self._data_file = "{}/cv_coordinates.dat".format(store_dir)
+        self._manifest_file = "{}/manifest.json".format(store_dir)
+        self.n_cvs = None
+        # Location of the transitions of every stored iteration, ordered by iteration number
+        self.iterations = []
+        if os.path.isfile(self._manifest_file):
+            with open(self._manifest_file) as f:
+                manifest = json.load(f)
+            self.n_cvs = manifest["n_cvs"]
+            self.iterations = manifest["iterations"]
+        # Remove data which was appended without being recorded in the manifest, e.g. after a crash
+        if (
+            os.path.isfile(self._data_file)
+            and os.path.getsize(self._data_file) > self._n_bytes()
+        ):
+            os.truncate(self._data_file, self._n_bytes())
+
+    @property
+    def first_iteration(self) -> Optional[int]:
+        return self.iterations[0]["iteration"] if len(self.iterations) > 0 else None
+
+    @property
+    def last_iteration(self) -> Optional[int]:
+        return self.iterations[-1]["iteration"] if len(self.iterations) > 0 else None
+
+    @property
+    def n_transitions(self) -> int:
+        if len(self.iterations) == 0:
+            return 0
+        return self.iterations[-1]["offset"] + self.iterations[-1]["count"]
+
+    def _n_bytes(self) -> int:
+        if self.n_cvs is None:
+            return 0
+        return self.n_transitions * 2 * self.n_cvs * np.dtype(self.dtype).itemsize
+
+    def get_files(self, iteration: int) -> Optional[List[str]]:
+        """The files the transitions of an iteration were read from, or None if the iteration is not stored"""
+        for it in self.iterations:
+            if it["iteration"] == iteration:
+                return it["files"]
+        return None
+
+    def append(self, iteration: int, values: np.array, files: List[str] = None):
+        """
+        :param iteration: has to be larger than the last stored iteration
+        :param values: array of shape (n_transitions, 2, n_cvs)
+        :param files: the files the values were read from
+        """
+        if self.last_iteration is not None and iteration <= self.last_iteration:
+            raise ValueError(
+                "Cannot append iteration {} after iteration {}".format(
+                    iteration, self.last_iteration
+                )
+            )
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        if self.n_cvs is not None and values.shape[1:] != (2, self.n_cvs):
+            raise ValueError(
+                "Expected transitions of shape {}, got {}".format(
+                    (2, self.n_cvs), values.shape[1:]
+                )
+            )
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+        with open(self._data_file, "ab") as f:
+            f.write(values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.n_cvs = values.shape[2]
+        self.iterations.append(
+            dict(
+                iteration=iteration,
+                offset=self.n_transitions,
+                count=len(values),
+                files=list(files or []),
+            )
+        )
+        self._write_manifest()
+
+    def truncate(self, iteration: int):
+        """Removes this and all following iterations from the store"""
+        self.iterations = [it for it in self.iterations if it["iteration"] < iteration]
+        if len(self.iterations) == 0:
+            self.n_cvs = None
+        if os.path.isfile(self._data_file):
+            os.truncate(self._data_file, self._n_bytes())
+        self._write_manifest()
+
+    def _write_manifest(self):
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+        tmp_file = self._manifest_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(dict(n_cvs=self.n_cvs, iterations=self.iterations), f)
+        os.replace(tmp_file, self._manifest_file)
+
+    def get_cv_coordinates(
+        self, first_iteration: int = None, last_iteration: int = None
+    ) -> Optional[np.array]:
+        """
+        :return: a read-only memory mapped view of shape (n_transitions, 2, n_cvs)
+        of the transitions in the range of iterations, or None if there are none
+        """
+        selected = self._select(first_iteration, last_iteration)
+        if len(selected) == 0 or self.n_transitions == 0:
+            return None
+        data = np.memmap(
+            self._data_file,
+            dtype=self.dtype,
+            mode="r",
+            shape=(self.n_transitions, 2, self.n_cvs),
+        )
+        start = selected[0]["offset"]
+        end = selected[-1]["offset"] + selected[-1]["count"]
+        logger.debug(
+            "Using %s transitions from iterations %s-%s in the CV store",
+            end - start,
+            selected[0]["iteration"],
+            selected[-1]["iteration"],
+        )
+        return data[start:end]
+
+    def get_iteration_numbers(
+        self, first_iteration: int = None, last_iteration: int = None
+    ) -> np.array:
+        """
+        :return: the iteration of every transition returned by get_cv_coordinates for the same range
+        """
+        selected = self._select(first_iteration, last_iteration)
+        return np.repeat(
+            [it["iteration"] for it in selected],
+            [it["count"] for it in selected],
+        ).astype(int)
+
+    def _select(self, first_iteration: int = None, last_iteration: int = None):
+        return [
+            it
+            for it in self.iterations
+            if (first_iteration is None or it["iteration"] >= first_iteration)
+            and (last_iteration is None or it["iteration"] <= last_iteration)
+        ]
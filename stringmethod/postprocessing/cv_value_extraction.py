@@ -3,7 +3,7 @@ import os
 import re
 import sys
 from dataclasses import dataclass
-from typing import Optional
+from typing import List, Optional
 
 import numpy as np
 import stringmethod.simulations.mdtools as mdtools
@@ -11,6 +11,7 @@ from stringmethod import logger
 from stringmethod.config import Config
 
 from .base import AbstractPostprocessor
+from .cv_store import CvStore
 
 
 @dataclass
@@ -25,8 +26,11 @@ class CvValueExtractor(AbstractPostprocessor):
     First index corresponds to a trajectory.
     Second index sets the frame in that trajectory.
     Third index sets the CV values in that frame.
+    A read-only memory mapped view of the CV store in the postprocessing directory.
     """
     cv_coordinates: Optional[np.array] = None
+    """The string iteration of every trajectory in cv_coordinates"""
+    iteration_numbers: Optional[np.array] = None
     use_plumed: Optional[bool] = False
 
     def __post_init__(self):
@@ -39,46 +43,87 @@ class CvValueExtractor(AbstractPostprocessor):
 
     def _do_run(self) -> bool:
         self.cv_coordinates = self.compute_cv_coordinates()
+        self.iteration_numbers = CvStore(self._get_store_dir()).get_iteration_numbers(
+            self.first_iteration, self.last_iteration
+        )
         return True
 
     def compute_cv_coordinates(self) -> np.array:
+        """
+        Appends the iterations which are not in the CV store yet and returns a memory mapped view of the store
+        """
         logger.info("Remember to remove unfinished strings")
         if not os.path.isdir(self._get_out_dir()):
             os.mkdir(self._get_out_dir())
-        cv_coordinates = None
-        for it in range(self.first_iteration, self.last_iteration + 1):
+        store = CvStore(self._get_store_dir())
+        if store.first_iteration is not None and not (
+            store.first_iteration <= self.first_iteration <= store.last_iteration + 1
+        ):
+            logger.info(
+                "CV store with iterations %s-%s does not cover iteration %s. Recreating it",
+                store.first_iteration,
+                store.last_iteration,
+                self.first_iteration,
+            )
+            store.truncate(store.first_iteration)
+        if (
+            store.last_iteration is not None
+            and self.first_iteration <= store.last_iteration <= self.last_iteration
+        ):
+            # The last stored iteration may not have been finished when it was stored
+            last_files = self._find_output_files(store.last_iteration)
+            if last_files != store.get_files(store.last_iteration):
+                logger.info(
+                    "Output files of iteration %s changed. Processing it again",
+                    store.last_iteration,
+                )
+                store.truncate(store.last_iteration)
+        it = (
+            self.first_iteration
+            if store.last_iteration is None
+            else store.last_iteration + 1
+        )
+        while it <= self.last_iteration:
+            xvg_files = self._find_output_files(it)
+            if len(xvg_files) == 0:
+                logger.info(
+                    "No output files found for iteration %s. Not looking further",
+                    it,
+                )
+                break
             logger.info("Processing iteration {}".format(it))
-            iter_data = "{}/cv_iter{}.npy".format(self._get_out_dir(), it)
-            if os.path.isfile(iter_data):
-                values = np.load(iter_data)
-            else:
-                if not self.use_plumed:
-                    iteration_md_dir = "{}/{}/*/s*/*xvg".format(self.md_dir, it)
-                else:
-                    iteration_md_dir = "{}/{}/*/s*/colvar".format(self.md_dir, it)
-                xvg_files = self._natural_sort(glob.glob(iteration_md_dir))
-                if len(xvg_files) == 0:
-                    logger.info(
-                        "No output files found for iteration %s. Not looking further",
-                        it,
-                    )
-                    return cv_coordinates
-                values = None
-                for file_idx, xf in enumerate(xvg_files):
-                    data = mdtools.load_xvg(file_name=xf)
-                    # Skip first column which contains the time and include only first and last frame
-                    data = data[[0, -1], 1:]
-                    if values is None:
-                        n_cvs = data.shape[1]
-                        values = np.empty((len(xvg_files), 2, n_cvs))
-                    values[file_idx, :, :] = data
-                if it < self.last_iteration:
-                    np.save(iter_data, values)
-            if cv_coordinates is None:
-                cv_coordinates = values
-            else:
-                cv_coordinates = np.append(cv_coordinates, values, axis=0)
-        return cv_coordinates
+            store.append(it, self._load_values(it, xvg_files), files=xvg_files)
+            it += 1
+        return store.get_cv_coordinates(self.first_iteration, self.last_iteration)
+
+    def _get_store_dir(self) -> str:
+        return "{}/cv_store".format(self._get_out_dir())
+
+    def _find_output_files(self, iteration: int) -> List[str]:
+        if not self.use_plumed:
+            iteration_md_dir = "{}/{}/*/s*/*xvg".format(self.md_dir, iteration)
+        else:
+            iteration_md_dir = "{}/{}/*/s*/colvar".format(self.md_dir, iteration)
+        return self._natural_sort(glob.glob(iteration_md_dir))
+
+    def _load_values(self, iteration: int, xvg_files: List[str]) -> np.array:
+        # Transitions cached per iteration by earlier versions
+        iter_data = "{}/cv_iter{}.npy".format(self._get_out_dir(), iteration)
+        if os.path.isfile(iter_data):
+            values = np.load(iter_data)
+            if len(values) == len(xvg_files):
+                return values
+        values = None
+        for file_idx, xf in enumerate(xvg_files):
+            # Only read the first and last frame
+            data = mdtools.load_xvg_endpoints(file_name=xf)
+            # Skip first column which contains the time
+            data = data[:, 1:]
+            if values is None:
+                n_cvs = data.shape[1]
+                values = np.empty((len(xvg_files), 2, n_cvs))
+            values[file_idx, :, :] = data
+        return values
 
     def _do_persist(self):
         np.save(
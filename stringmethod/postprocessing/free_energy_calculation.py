@@ -1,8 +1,12 @@
-import sys
+import time
+import warnings
 from dataclasses import dataclass
 from typing import Optional
 
 import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
 
 from stringmethod import logger
 
@@ -16,11 +20,17 @@ class FreeEnergyCalculator(AbstractPostprocessor):
     Takes the transition count between bins and computes the probability distribution and free energy
     """
 
-    """Input from previous step"""
-    transition_count: np.array
+    """Input from previous step. A dense array is converted to a sparse matrix"""
+    transition_count: scipy.sparse.csr_matrix
     """Input from previous step"""
     grid: Optional[np.array] = None
-    """detailed_balance regularizes the transition matrix while computing the stationary distribution"""
+    """
+    How the stationary distribution is computed.
+    detailed_balance regularizes the transition matrix while computing the stationary distribution.
+    power_iteration and linear_solve compute the same distribution with sparse linear algebra,
+    by repeated multiplication with the transition matrix or by directly solving the balance equations.
+    Any other value uses the eigenvectors of the transition matrix.
+    """
     method: Optional[str] = "detailed_balance"
     """
     Boltzmann's constant. The default value is in kcal/(mol*K)
@@ -34,11 +44,43 @@ class FreeEnergyCalculator(AbstractPostprocessor):
     Convergence cutoff for FES algorithm.
     """
     convergence_cutoff: Optional[float] = 1.0e-10
+    """
+    Maximum number of iterations for the power_iteration method
+    """
+    max_iterations: Optional[int] = 100000
+    """
+    Starting guess for the power_iteration method, e.g. the solution for a previous set of transitions.
+    Any shape with one value per bin. All accessible states are equally likely by default
+    """
+    initial_distribution: Optional[np.array] = None
+    """
+    Eigensolver for the eigenvector method. 'dense' computes all eigenpairs of the transition matrix,
+    'sparse' only the n_eigenpairs with the largest real part using an iterative solver (ARPACK)
+    """
+    eigensolver: Optional[str] = "dense"
+    """
+    Number of eigenpairs computed by the sparse eigensolver
+    """
+    n_eigenpairs: Optional[int] = 6
+    """
+    Free energy of bins which were never reached, i.e. with zero or undefined probability.
+    'inf' sets it to infinity, 'max' to the largest value of the floating point type
+    and 'mask' returns a masked array. Masked bins are persisted as NaN
+    """
+    unreached_bins: Optional[str] = "inf"
+    """
+    Floating point precision of the free energy and of the persisted probability distribution.
+    'float32' halves the memory and disk usage
+    """
+    dtype: Optional[str] = "float64"
     probability_distribution: Optional[np.array] = None
     free_energy: Optional[np.array] = None
     _index_converter: Optional[IndexConverter] = None
 
     def __post_init__(self):
+        self.transition_count = scipy.sparse.csr_matrix(
+            self.transition_count, dtype=float
+        )
         if self.grid is not None:
             if len(self.grid.shape) == 1:
                 self.grid = self.grid[:, np.newaxis]
@@ -55,13 +97,20 @@ class FreeEnergyCalculator(AbstractPostprocessor):
     def _do_persist(self):
         np.save(
             "{}/probability_distribution".format(self._get_out_dir()),
-            self.probability_distribution,
+            np.asarray(self.probability_distribution, dtype=self.dtype),
         )
-        np.save("{}/free_energy".format(self._get_out_dir()), self.free_energy)
+        free_energy = self.free_energy
+        if np.ma.isMaskedArray(free_energy):
+            free_energy = free_energy.filled(np.nan)
+        np.save("{}/free_energy".format(self._get_out_dir()), free_energy)
 
     def compute_probability_distribution(self) -> np.array:
         if self.method == "detailed_balance":
             prob = self._compute_probability_distribution_detailed_balance()
+        elif self.method == "power_iteration":
+            prob = self._compute_probability_distribution_power_iteration()
+        elif self.method == "linear_solve":
+            prob = self._compute_probability_distribution_linear_solve()
         else:
             prob = self._compute_probability_distribution_eigenvector()
         prob = prob.squeeze()
@@ -72,15 +121,23 @@ class FreeEnergyCalculator(AbstractPostprocessor):
             return prob[:, np.newaxis] if len(prob.shape) == 1 else prob
 
     def compute_free_energy(self):
-        fe = np.empty(self.probability_distribution.shape)
-        for row_idx, p_row in enumerate(self.probability_distribution):
-            for col_idx, p in enumerate(p_row):
-                if p is None or np.isnan(p):  # or p <= 1e-7:
-                    fe[row_idx, col_idx] = sys.float_info.max  # np.nan
-                else:
-                    fe[row_idx, col_idx] = -self.kB * self.T * np.log(p)
+        """
+        -kB*T*log(p) for every bin of the probability distribution, on grids of any dimension.
+        The minimum of the free energy is set to zero.
+        """
+        prob = np.asarray(self.probability_distribution, dtype=self.dtype)
+        unreached = ~(prob > 0)  # also true for NaN
+        fe = np.ma.masked_array(
+            -self.kB * self.T * np.log(np.where(unreached, 1, prob)),
+            mask=unreached,
+        )
         fe -= fe.min()
-        return fe
+        if self.unreached_bins == "mask":
+            return fe
+        elif self.unreached_bins == "max":
+            return fe.filled(np.finfo(fe.dtype).max)
+        else:
+            return fe.filled(np.inf)
 
     def _compute_probability_distribution_eigenvector(self):
         """
@@ -88,16 +145,11 @@ class FreeEnergyCalculator(AbstractPostprocessor):
         :param transition_count:
         :return:
         """
-        transition_probability = np.zeros(self.transition_count.shape)
         transition_count = self._remove_transitions_to_isolated_bins(
             self.transition_count
         )
-        for rowidx, row in enumerate(transition_count):
-            # transition_probability[rowidx, rowidx] = 0
-            rowsum = np.sum(row)
-            if rowsum > 0:
-                transition_probability[rowidx] = row / rowsum
-        eigenvalues, eigenvectors = np.linalg.eig(transition_probability.T)
+        transition_probability = self._normalize_rows(transition_count)
+        eigenvalues, eigenvectors = self._compute_eigenpairs(transition_probability.T)
         stationary_solution = None
         unit_eigenval = None  # The eigenvalue closest to 1
         for idx, eigenval in enumerate(eigenvalues):
@@ -127,6 +179,15 @@ class FreeEnergyCalculator(AbstractPostprocessor):
             if eigenval < 1 and eigenval != unit_eigenval:
                 if relaxation_eigenval is None or eigenval > relaxation_eigenval:
                     relaxation_eigenval = eigenval
+        if (
+            stationary_solution is None
+            and np.count_nonzero(np.isclose(1.0, eigenvalues, rtol=1e-8)) > 1
+        ):
+            # Iterative solvers return arbitrary combinations of degenerate eigenvectors, which can have mixed signs
+            raise Exception(
+                "Multiple stationary solutions found. Perhaps there were no transitions between states. Eigenvalues:\n%s"
+                % eigenvalues
+            )
         if stationary_solution is None:
             raise Exception(
                 "No stationary solution found. Eigenvalues:\n%s", eigenvalues
@@ -139,112 +200,209 @@ class FreeEnergyCalculator(AbstractPostprocessor):
             )
         return stationary_solution
 
+    def _compute_eigenpairs(self, matrix: scipy.sparse.spmatrix):
+        """
+        Eigenvalues and eigenvectors (as columns) of a sparse matrix
+        """
+        start_time = time.perf_counter()
+        n_states = matrix.shape[0]
+        # ARPACK can compute at most n_states - 2 eigenpairs
+        if self.eigensolver == "sparse" and self.n_eigenpairs < n_states - 1:
+            eigenvalues, eigenvectors = scipy.sparse.linalg.eigs(
+                matrix.tocsr(),
+                k=self.n_eigenpairs,
+                which="LR",
+                tol=self.convergence_cutoff,
+            )
+            # Remove the numerical noise of the iterative solver, which would otherwise show up as negative entries
+            noise = np.abs(eigenvectors) < self.convergence_cutoff * np.abs(
+                eigenvectors
+            ).max(axis=0)
+            eigenvectors[noise] = 0
+        else:
+            eigenvalues, eigenvectors = np.linalg.eig(matrix.toarray())
+        logger.info(
+            "Computed %s eigenpairs of a %sx%s matrix in %.3f seconds",
+            len(eigenvalues),
+            n_states,
+            n_states,
+            time.perf_counter() - start_time,
+        )
+        return eigenvalues, eigenvectors
+
     def _compute_probability_distribution_detailed_balance(self):
-        nbins = self.transition_count.shape[0]
-        transition_probability = np.zeros(self.transition_count.shape)
-        rho = np.zeros((nbins,))
-        inaccessible_states, nonstarting_states = 0, 0
+        start_time = time.perf_counter()
         transition_count = self._remove_transitions_to_isolated_bins(
             self.transition_count
         )
-        for rowidx, row in enumerate(transition_count):
-            # transition_probability[rowidx, rowidx] = 0
-            rowsum = np.sum(row)
-            if rowsum > 0:
-                # transition_probability[rowidx, rowidx] = 0
-                transition_probability[rowidx] = row / rowsum
-                # transition_probability[rowidx, rowidx] = -rowsum
-            else:
-                rho[rowidx] = np.nan
-
-        if inaccessible_states > 0 or nonstarting_states > 0:
-            logger.warning(
-                "Found %s inaccessible states and %s states with no starting points.",
-                inaccessible_states,
-                nonstarting_states,
-            )
+        transition_probability = self._normalize_rows(transition_count)
         # Set up starting guess for distribution: all accessible states equal
-        for i, rhoi in enumerate(rho):
-            if np.isnan(rhoi):
-                rho[i] = 0
-            else:
-                rho[i] = 1
+        rho = (np.asarray(transition_count.sum(axis=1)).ravel() > 0).astype(float)
         rho = rho / np.sum(rho)
+        # Work on the columns of the sparse matrix directly, i.e. the transitions into every bin
+        columns = transition_probability.tocsc()
+        indptr, indices, data = columns.indptr, columns.indices, columns.data
+        probability_rowsum = np.asarray(transition_probability.sum(axis=1)).ravel()
         convergences = []
         convergence = 100
         while convergence > self.convergence_cutoff:
             last = rho  # np.copy(rho)
-            for k, rhok in enumerate(rho):
+            for k in np.flatnonzero(rho):
+                rhok = rho[k]
                 if rhok == 0:
                     continue
-                crossterm = np.dot(rho, transition_probability[:, k]) - np.sum(
-                    rhok * transition_probability[k, :]
+                column = slice(indptr[k], indptr[k + 1])
+                crossterm = (
+                    np.dot(rho[indices[column]], data[column])
+                    - rhok * probability_rowsum[k]
                 )
-                # crossterm = 0
-                # for l, rhol in enumerate(rho):
-                #     if l != k:
-                #         crossterm += rhol * transition_probability[l, k] - rhok * transition_probability[k, l]
-                if rhok == 0 and crossterm > 0:
-                    logger.warning(
-                        "NOOOO for index %s. Crossterm %s rhok %s",
-                        k,
-                        crossterm,
-                        rhok,
-                    )
                 rho[k] = rhok + crossterm
             rho = rho / np.sum(rho)
             if last is not None:
                 convergence = np.linalg.norm(rho - last)
                 convergences.append(convergence)
-        logger.debug(
-            "Converged with master equation after %s iterations",
+        logger.info(
+            "Converged with master equation after %s iterations in %.3f seconds",
             len(convergences),
+            time.perf_counter() - start_time,
         )
-        # plt.plot(convergences, label="Convergence")
-        # plt.show()
-        if len(rho[rho == 0]) < inaccessible_states:
-            raise Exception(
-                "Something went wrong. Number inaccessible states differ %s vs. %s"
-                % (len(rho[rho == 0]), inaccessible_states)
+        return rho
+
+    def _compute_probability_distribution_power_iteration(self):
+        """
+        Stationary distribution by repeatedly propagating the distribution with the transition matrix.
+        Half of the probability stays put every step, which does not change the stationary distribution
+        but guarantees convergence also for periodic transition matrices.
+        """
+        start_time = time.perf_counter()
+        transition_count = self._remove_transitions_to_isolated_bins(
+            self.transition_count
+        )
+        transition_probability_transposed = self._normalize_rows(
+            transition_count
+        ).T.tocsr()
+        # Start with all accessible states equal
+        rho = (np.asarray(transition_count.sum(axis=1)).ravel() > 0).astype(float)
+        if self.initial_distribution is not None:
+            initial_rho = rho * np.nan_to_num(
+                np.ravel(self.initial_distribution).clip(0, None)
             )
+            if initial_rho.sum() > 0:
+                # Accessible states which were not in the initial distribution should still get some probability
+                rho = initial_rho + rho * initial_rho.sum() * 1e-3 / rho.sum()
+        rho = rho / np.sum(rho)
+        convergence = np.inf
+        iteration = 0
+        while convergence > self.convergence_cutoff:
+            if iteration >= self.max_iterations:
+                logger.warning(
+                    "Power iteration did not converge after %s iterations. Last change %s",
+                    iteration,
+                    convergence,
+                )
+                break
+            last = rho
+            rho = 0.5 * (rho + transition_probability_transposed @ rho)
+            rho = rho / np.sum(rho)
+            convergence = np.linalg.norm(rho - last)
+            iteration += 1
+        logger.info(
+            "Converged with power iteration after %s iterations in %.3f seconds",
+            iteration,
+            time.perf_counter() - start_time,
+        )
         return rho
 
+    def _compute_probability_distribution_linear_solve(self):
+        """
+        Stationary distribution by solving rho*P=rho, sum(rho)=1 with a sparse direct solver.
+        Only the accessible states are included. If the equations have no unique solution,
+        e.g. because there are no transitions between parts of the state space, falls back to power iteration.
+        """
+        start_time = time.perf_counter()
+        transition_count = self._remove_transitions_to_isolated_bins(
+            self.transition_count
+        )
+        accessible = np.asarray(transition_count.sum(axis=1)).ravel() > 0
+        transition_probability = self._normalize_rows(transition_count)[accessible][
+            :, accessible
+        ]
+        n_states = transition_probability.shape[0]
+        if self._count_closed_classes(transition_probability) != 1:
+            logger.warning(
+                "The transition matrix has several closed sets of states. Falling back to power iteration"
+            )
+            return self._compute_probability_distribution_power_iteration()
+        # One of the balance equations is redundant. Replace it by the normalization
+        balance = (
+            transition_probability.T - scipy.sparse.identity(n_states, format="csr")
+        ).tocsr()[:-1]
+        equations = scipy.sparse.vstack([balance, np.ones((1, n_states))], format="csc")
+        rhs = np.zeros((n_states,))
+        rhs[-1] = 1
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", scipy.sparse.linalg.MatrixRankWarning)
+            try:
+                solution = scipy.sparse.linalg.spsolve(equations, rhs)
+            except (scipy.sparse.linalg.MatrixRankWarning, RuntimeError):
+                solution = None
+        if (
+            solution is None
+            or not np.all(np.isfinite(solution))
+            or np.any(solution < -self.convergence_cutoff)
+        ):
+            logger.warning(
+                "The balance equations have no unique solution. Falling back to power iteration"
+            )
+            return self._compute_probability_distribution_power_iteration()
+        rho = np.zeros((transition_count.shape[0],))
+        rho[accessible] = np.clip(solution, 0, None)
+        logger.info(
+            "Solved the balance equations for %s states in %.3f seconds",
+            n_states,
+            time.perf_counter() - start_time,
+        )
+        return rho / np.sum(rho)
+
+    @staticmethod
+    def _count_closed_classes(transition_probability) -> int:
+        """Number of sets of states which are connected to each other but never transition out of the set"""
+        n_components, labels = scipy.sparse.csgraph.connected_components(
+            transition_probability, directed=True, connection="strong"
+        )
+        transitions = transition_probability.tocoo()
+        leaving = labels[transitions.row] != labels[transitions.col]
+        open_components = np.unique(labels[transitions.row[leaving]])
+        return n_components - len(open_components)
+
+    @staticmethod
+    def _normalize_rows(transition_count) -> scipy.sparse.csr_matrix:
+        """Transition probabilities from the transition counts. Rows without transitions stay zero"""
+        rowsum = np.asarray(transition_count.sum(axis=1)).ravel()
+        scale = np.divide(1.0, rowsum, out=np.zeros(rowsum.shape), where=rowsum > 0)
+        return scipy.sparse.csr_matrix(scipy.sparse.diags(scale) @ transition_count)
+
     def _remove_transitions_to_isolated_bins(self, transition_count):
         """Remove all transitions which moves from a bin with no starting points"""
-        last_inaccessible_states, last_nonstarting_states = -1, -1
-        inaccessible_states, nonstarting_states = 1, 1
-        while (
-            inaccessible_states != last_inaccessible_states
-            or nonstarting_states != last_nonstarting_states
+        transition_count = scipy.sparse.csr_matrix(transition_count, copy=True)
+        incoming = np.asarray(transition_count.sum(axis=0)).ravel() > 0
+        nonstarting, last_nonstarting = None, None
+        while last_nonstarting is None or not np.array_equal(
+            nonstarting, last_nonstarting
         ):
-            last_inaccessible_states, last_nonstarting_states = (
-                inaccessible_states,
-                nonstarting_states,
-            )
-            inaccessible_states, nonstarting_states, accessible_states = (
-                0,
-                0,
-                0,
+            last_nonstarting = nonstarting
+            nonstarting = np.asarray(transition_count.sum(axis=1)).ravel() == 0
+            # TODO see if this makes sense: to set all transition into this state to zero to completely isolate it!
+            transition_count = scipy.sparse.csr_matrix(
+                transition_count @ scipy.sparse.diags((~nonstarting).astype(float))
             )
-            for rowidx, row in enumerate(transition_count):
-                rowsum = np.sum(row)
-                if rowsum == 0:
-                    # transition_probability[rowidx] = 0
-                    if np.sum(transition_count[:, rowidx]) == 0:
-                        # logger.warning("Found inaccessible state at index %s ", rowidx)
-                        inaccessible_states += 1
-                        # rho[rowidx] = np.nan
-                    else:
-                        # logger.warning("Found non-starting states")
-                        nonstarting_states += 1
-                    # TODO see if this makes sense: to set all transition into this state to zero to completely isolate it!
-                    transition_count[:, rowidx] = 0
-                else:
-                    accessible_states += 1
+        transition_count.eliminate_zeros()
+        inaccessible_states = np.count_nonzero(nonstarting & ~incoming)
+        nonstarting_states = np.count_nonzero(nonstarting & incoming)
         if inaccessible_states > 0 or nonstarting_states > 0:
             logger.warning(
                 "Found %s accessible states, %s inaccessible states and %s states with no starting points.",
-                accessible_states,
+                np.count_nonzero(~nonstarting),
                 inaccessible_states,
                 nonstarting_states,
             )
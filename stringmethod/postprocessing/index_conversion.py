@@ -8,6 +8,8 @@ class IndexConverterException(Exception):
 class IndexConverter(object):
     """
     Helper class to convert grid indicies to bin indices for constructing the transition matrix.
+    Bins are numbered in row-major (C) order, i.e. the last grid dimension varies fastest.
+    All conversions accept arrays of indices.
 
     Written a long, long time ago.
     """
@@ -15,55 +17,66 @@ class IndexConverter(object):
     def __init__(self, n_dim: int, n_grid_points: int):
         self.n_dim = n_dim
         self.n_grid_points = n_grid_points
-        self._modulus = [
-            n_grid_points ** (n_dim - j - 1) for j in range(n_dim)
-        ]
-        self._zero_dim = np.zeros((self.n_dim,))
+        self.grid_shape = (n_grid_points,) * n_dim
         self.n_bins = n_grid_points ** n_dim
 
     def convert_to_vector(self, grid):
-        if grid.shape[0] != self.n_grid_points:
+        """
+        :param grid: array of shape (n_grid_points,)*n_dim
+        :return: the grid values as a vector of length n_bins
+        """
+        grid = np.asarray(grid)
+        if grid.shape != self.grid_shape:
             raise IndexConverterException(
-                "Wrong dimension of grid. Expect length of %s got %s"
-                % (self.n_grid_points, grid.shape[0])
+                "Wrong dimension of grid. Expect shape %s got %s"
+                % (self.grid_shape, grid.shape)
             )
-        vector = np.empty((self.n_bins,))
-        for bin_idx in range(self.n_bins):
-            vector[bin_idx] = grid[tuple(self.convert_to_grid_idx(bin_idx))]
-        return vector
+        return grid.astype(float).reshape((self.n_bins,))
 
     def convert_to_grid(self, vector):
-        grid_shape = tuple(
-            np.zeros(self.n_dim).astype(int) + self.n_grid_points
-        )
-        if len(vector.shape) > 1:
-            grids = np.empty((len(vector),) + grid_shape)
-            for idx, v in enumerate(vector):
-                grids[idx] = self.convert_to_grid(v)
-            return grids
-        else:
-            grid = np.zeros(grid_shape)
-            for idx in range(len(vector)):
-                grid[tuple(self.convert_to_grid_idx(idx))] = vector[idx]
-            return grid
+        """
+        :param vector: array of shape (n_bins,) or (n_vectors, n_bins). Missing trailing bins are set to zero
+        :return: array of shape (n_grid_points,)*n_dim or (n_vectors,) + (n_grid_points,)*n_dim
+        """
+        vector = np.asarray(vector)
+        n_values = vector.shape[-1]
+        if n_values > self.n_bins:
+            raise IndexConverterException(
+                "Invalid index %s. You are probably outside the grid..."
+                % (n_values - 1)
+            )
+        leading_shape = vector.shape[:-1]
+        grid = np.zeros(leading_shape + (self.n_bins,))
+        grid[..., :n_values] = vector
+        return grid.reshape(leading_shape + self.grid_shape)
 
     def convert_to_grid_idx(self, bin_idx):
-        if bin_idx >= self.n_bins or bin_idx < 0:
-            print(self.n_bins, self.n_dim, self.n_bins ** self.n_dim)
+        """
+        :param bin_idx: a bin index or an array of bin indices
+        :return: the grid indices as an array of shape (n_dim,) or (n_indices, n_dim)
+        """
+        bin_idx = np.asarray(bin_idx)
+        if np.any(bin_idx >= self.n_bins) or np.any(bin_idx < 0):
             raise IndexConverterException(
                 "Invalid index %s. You are probably outside the grid..."
                 % bin_idx
             )
-        grid_idx = (
-            (self._zero_dim + bin_idx) / self._modulus
-        ) % self.n_grid_points
-        return grid_idx.astype(int)
+        return np.stack(
+            np.unravel_index(bin_idx.astype(int), self.grid_shape), axis=-1
+        )
 
     def convert_to_bin_idx(self, grid_idx):
-        bin_idx = int(np.rint(np.sum(grid_idx * self._modulus)))
-        if bin_idx >= self.n_bins or bin_idx < 0:
+        """
+        :param grid_idx: grid indices as an array of shape (n_dim,) or (n_indices, n_dim)
+        :return: the bin index as an int, or an array of bin indices
+        """
+        grid_idx = np.rint(grid_idx).astype(int)
+        if np.any(grid_idx >= self.n_grid_points) or np.any(grid_idx < 0):
             raise IndexConverterException(
-                "Invalid bin index %s. You are probably outside the grid. Size:%s"
-                % (bin_idx, self.n_bins)
+                "Invalid grid index %s. You are probably outside the grid. Size:%s"
+                % (grid_idx, self.grid_shape)
             )
-        return bin_idx
+        bin_idx = np.ravel_multi_index(
+            np.moveaxis(grid_idx, -1, 0), self.grid_shape
+        )
+        return int(bin_idx) if grid_idx.ndim == 1 else bin_idx
@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import scipy.sparse
+
+from stringmethod import logger
+from stringmethod.utils import periodicity
+
+from .base import AbstractPostprocessor
+from .cv_store import CvStore
+from .free_energy_calculation import FreeEnergyCalculator
+from .transition_count_calculation import TransitionCountCalculator
+
+
+@dataclass
+class OnlineFreeEnergyEstimator(AbstractPostprocessor):
+    """
+    Updates a free energy estimate with the swarms' transitions of every string iteration.
+
+    The transitions are counted in a running sparse transition count and the stationary distribution
+    is computed with power iteration, starting from the solution of the previous iteration.
+    The transitions themselves are kept in a CV store in the output directory, so that the estimate
+    survives restarts and the grid can be rebuilt when new transitions fall outside of it.
+    """
+
+    n_grid_points: Optional[int] = 30
+    """
+    Fraction of the sampled CV range added on both sides of the grid,
+    so that it does not have to be rebuilt every time the sampled region grows slightly
+    """
+    grid_margin: Optional[float] = 0.1
+    """Largest number of bins of the grid, i.e. n_grid_points**(number of CVs)"""
+    max_bins: Optional[int] = 10**7
+    """Period of every CV, None for non-periodic CVs. See TransitionCountCalculator"""
+    cv_periods: Optional[tuple] = None
+    grid: Optional[np.array] = None
+    transition_count: Optional[scipy.sparse.csr_matrix] = None
+    probability_distribution: Optional[np.array] = None
+    free_energy: Optional[np.array] = None
+    _store: Optional[CvStore] = None
+
+    def __post_init__(self):
+        self._store = CvStore("{}/cv_store".format(self._get_out_dir()))
+
+    def _get_out_dir(self) -> str:
+        return "{}/online".format(self.postprocessing_dir)
+
+    def add_transitions(self, iteration: int, cv_coordinates: np.array):
+        """
+        :param iteration: the string iteration the transitions were sampled in
+        :param cv_coordinates: array of shape (n_transitions, 2, n_cvs). Transitions with NaN are ignored
+        """
+        n_bins = self.n_grid_points ** cv_coordinates.shape[2]
+        if n_bins > self.max_bins:
+            raise ValueError(
+                "A grid with {} points per CV has {} bins, more than the maximum of {}".format(
+                    self.n_grid_points, n_bins, self.max_bins
+                )
+            )
+        cv_coordinates = cv_coordinates[
+            np.all(np.isfinite(cv_coordinates), axis=(1, 2))
+        ]
+        if (
+            self._store.last_iteration is not None
+            and iteration <= self._store.last_iteration
+        ):
+            # The iteration was run again, e.g. after a restart
+            self._store.truncate(iteration)
+            self.grid = None
+        self._store.append(iteration, cv_coordinates)
+        # The grid of periodic CVs always covers all values
+        bounded = ~np.isfinite(self._get_periods(cv_coordinates.shape[2]))
+        if (
+            self.grid is None
+            or np.any(cv_coordinates[..., bounded] < self.grid[0, bounded])
+            or np.any(cv_coordinates[..., bounded] > self.grid[-1, bounded])
+        ):
+            self._rebuild_grid()
+        else:
+            self.transition_count = self.transition_count + self._count_transitions(
+                cv_coordinates
+            )
+
+    def _rebuild_grid(self):
+        """Sets up a grid covering all stored transitions and bins them again"""
+        cv_coordinates = self._store.get_cv_coordinates()
+        if cv_coordinates is None or len(cv_coordinates) == 0:
+            return
+        min_values = cv_coordinates.min(axis=(0, 1))
+        max_values = cv_coordinates.max(axis=(0, 1))
+        margin = self.grid_margin * (max_values - min_values)
+        grid = np.linspace(min_values - margin, max_values + margin, self.n_grid_points)
+        periodic = np.isfinite(self._get_periods(cv_coordinates.shape[2]))
+        if np.any(periodic):
+            tc = self._create_transition_count_calculator(cv_coordinates[:1])
+            grid[:, periodic] = tc.setup_grid()[:, periodic]
+        self.grid = grid
+        self.transition_count = self._count_transitions(cv_coordinates)
+        # The previous solution belongs to other bins and cannot be used as a starting guess
+        self.probability_distribution = None
+        logger.info(
+            "Binned %s transitions on a new grid for the online free energy estimate",
+            len(cv_coordinates),
+        )
+
+    def _count_transitions(self, cv_coordinates: np.array) -> scipy.sparse.csr_matrix:
+        tc = self._create_transition_count_calculator(cv_coordinates)
+        tc.grid = self.grid
+        return tc.compute_transition_count()
+
+    def _create_transition_count_calculator(
+        self, cv_coordinates: np.array
+    ) -> TransitionCountCalculator:
+        return TransitionCountCalculator(
+            postprocessing_dir=self.postprocessing_dir,
+            cv_coordinates=np.asarray(cv_coordinates),
+            n_grid_points=self.n_grid_points,
+            cv_periods=self.cv_periods,
+        )
+
+    def _get_periods(self, n_cvs: int) -> np.array:
+        periods = periodicity.get_periods(self.cv_periods, n_cvs)
+        return np.full((n_cvs,), np.nan) if periods is None else periods
+
+    def _do_run(self) -> bool:
+        if self.transition_count is None:
+            self._rebuild_grid()
+        if self.transition_count is None or self.transition_count.nnz == 0:
+            logger.info("No transitions for an online free energy estimate yet")
+            return False
+        fc = FreeEnergyCalculator(
+            postprocessing_dir=self.postprocessing_dir,
+            transition_count=self.transition_count,
+            grid=self.grid,
+            method="power_iteration",
+            initial_distribution=self.probability_distribution,
+        )
+        fc.run()
+        self.probability_distribution = fc.probability_distribution
+        self.free_energy = fc.free_energy
+        return True
+
+    def _do_persist(self):
+        if self.free_energy is None:
+            return
+        scipy.sparse.save_npz(
+            "{}/transition_count".format(self._get_out_dir()), self.transition_count
+        )
+        np.save("{}/grid".format(self._get_out_dir()), self.grid)
+        np.save(
+            "{}/probability_distribution".format(self._get_out_dir()),
+            self.probability_distribution,
+        )
+        np.save("{}/free_energy".format(self._get_out_dir()), self.free_energy)
@@ -2,8 +2,10 @@ from dataclasses import dataclass
 from typing import Optional
 
 import numpy as np
+import scipy.sparse
 
 from stringmethod import logger
+from stringmethod.utils import periodicity
 
 from .base import AbstractPostprocessor
 from .index_conversion import IndexConverter
@@ -24,14 +26,24 @@ class TransitionCountCalculator(AbstractPostprocessor):
     cv_coordinates: np.array
     method: Optional[str] = "detailed_balance"
     n_grid_points: Optional[int] = 30
-    transition_count: Optional[np.array] = None
+    """Sparse (CSR) matrix with the number of transitions from the bin of the row to the bin of the column"""
+    transition_count: Optional[scipy.sparse.csr_matrix] = None
     grid: Optional[np.array] = None
+    """
+    Period of every CV, None for non-periodic CVs.
+    The grid of a periodic CV covers one period and its first and last bins are neighbors
+    """
+    cv_periods: Optional[tuple] = None
+    _periods: Optional[np.array] = None
     _index_converter: Optional[IndexConverter] = None
 
     def __post_init__(self):
         if len(self.cv_coordinates.shape) < 3:
             # A single CV, just add an extra dimension
             self.cv_coordinates = self.cv_coordinates[:, :, np.newaxis]
+        self._periods = periodicity.get_periods(
+            self.cv_periods, self.cv_coordinates.shape[2]
+        )
         self._index_converter = IndexConverter(
             n_dim=self.cv_coordinates.shape[2],
             n_grid_points=self.n_grid_points,
@@ -43,7 +55,7 @@ class TransitionCountCalculator(AbstractPostprocessor):
         return True
 
     def _do_persist(self):
-        np.save(
+        scipy.sparse.save_npz(
             "{}/transition_count".format(self._get_out_dir()),
             self.transition_count,
         )
@@ -53,31 +65,80 @@ class TransitionCountCalculator(AbstractPostprocessor):
         n_cvs = self.cv_coordinates.shape[2]
         grid = np.empty((self.n_grid_points, n_cvs))
         for cv in range(n_cvs):
+            if self._is_periodic(cv):
+                # Bin centers, spread evenly over [-period/2, period/2)
+                period = self._periods[cv]
+                centers = (np.arange(self.n_grid_points) + 0.5) / self.n_grid_points
+                grid[:, cv] = period * centers - period / 2
+                continue
             vals = self.cv_coordinates[:, :, cv]
+            # NaN and Inf transitions are ignored, so they should not affect the grid either
+            vals = vals[np.isfinite(vals)]
             grid[:, cv] = np.linspace(
                 vals.min(), vals.max(), self.n_grid_points
             )
         return grid
 
-    def compute_transition_count(self) -> np.array:
+    def compute_transition_count(self) -> scipy.sparse.csr_matrix:
         n_cvs = self.cv_coordinates.shape[2]
         nbins = self.n_grid_points ** n_cvs
-        transition_count = np.zeros((nbins, nbins))  # Transition per bin
-        for t in self.cv_coordinates:
-            if np.any(np.isnan(t) | np.isinf(t)):
-                logger.warning("Found NaN or Inf transition. Ignoring it.")
-                continue
-            start_grid = self._find_grid_coordinates(t[0])
-            end_grid = self._find_grid_coordinates(t[-1])
-            start_bin = self._index_converter.convert_to_bin_idx(start_grid)
-            end_bin = self._index_converter.convert_to_bin_idx(end_grid)
-            transition_count[start_bin, end_bin] += 1
-        return transition_count
-
-    def _find_grid_coordinates(self, cv_values: np.array):
-        return np.array(
-            [
-                (np.abs(cv_values[cv_idx] - self.grid[:, cv_idx])).argmin()
-                for cv_idx in range(self.grid.shape[1])
-            ]
+        valid = np.all(np.isfinite(self.cv_coordinates), axis=(1, 2))
+        if not np.all(valid):
+            logger.warning(
+                "Found %s NaN or Inf transitions. Ignoring them.",
+                np.count_nonzero(~valid),
+            )
+        start_bins = self._find_bin_indices(self.cv_coordinates[valid, 0])
+        end_bins = self._find_bin_indices(self.cv_coordinates[valid, -1])
+        # Duplicate entries are summed up, which gives the number of transitions per pair of bins
+        transition_count = scipy.sparse.coo_matrix(
+            (np.ones((len(start_bins),)), (start_bins, end_bins)),
+            shape=(nbins, nbins),
         )
+        return transition_count.tocsr()
+
+    def _find_bin_indices(self, cv_values: np.array) -> np.array:
+        """
+        :param cv_values: array of shape (n_points, n_cvs)
+        :return: the bin index of every point
+        """
+        grid_coordinates = self._find_grid_coordinates(cv_values)
+        return self._index_converter.convert_to_bin_idx(grid_coordinates)
+
+    def _find_grid_coordinates(self, cv_values: np.array) -> np.array:
+        """
+        Finds the closest grid point along every CV.
+        :param cv_values: array of shape (n_cvs,) for a single point or (n_points, n_cvs)
+        :return: integer array of the same shape with the grid indices
+        """
+        cv_values = np.asarray(cv_values)
+        grid_coordinates = np.empty(cv_values.shape, dtype=int)
+        for cv_idx in range(self.grid.shape[1]):
+            if self._is_periodic(cv_idx):
+                period = self._periods[cv_idx]
+                wrapped = periodicity.wrap(cv_values[..., cv_idx], period)
+                idx = np.floor((wrapped + period / 2) / period * self.n_grid_points)
+                grid_coordinates[..., cv_idx] = idx.astype(int) % self.n_grid_points
+            else:
+                grid_coordinates[..., cv_idx] = _find_closest_grid_point(
+                    self.grid[:, cv_idx], cv_values[..., cv_idx]
+                )
+        return grid_coordinates
+
+    def _is_periodic(self, cv_idx: int) -> bool:
+        return self._periods is not None and np.isfinite(self._periods[cv_idx])
+
+
+def _find_closest_grid_point(grid_values: np.array, values: np.array) -> np.array:
+    """
+    Index of the closest grid value for every value. Ties go to the lower index, like np.argmin.
+    Values outside the grid end up in the first or last grid point.
+    """
+    spacing = np.diff(grid_values)
+    if len(spacing) > 0 and spacing[0] > 0 and np.allclose(spacing, spacing[0]):
+        # Uniform grid, compute the index directly
+        idx = np.ceil((values - grid_values[0]) / spacing[0] - 0.5)
+    else:
+        midpoints = (grid_values[1:] + grid_values[:-1]) / 2
+        idx = np.searchsorted(midpoints, values, side="left")
+    return np.clip(idx, 0, len(grid_values) - 1).astype(int)
@@ -0,0 +1,218 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import scipy.sparse
+
+from stringmethod import logger
+
+from .base import AbstractPostprocessor
+from .free_energy_calculation import FreeEnergyCalculator
+from .transition_count_calculation import TransitionCountCalculator
+
+# State shared by all resamples solved in a process, set by _init_worker
+_worker_state = {}
+
+
+def _init_worker(
+    pair_starts,
+    pair_ends,
+    pair_indices,
+    block_indices,
+    n_bins,
+    grid,
+    initial_distribution,
+    calculator_kwargs,
+    resampling,
+):
+    # Every resample logs the same warnings as the full estimate. Only the parent process reports
+    logger.setLevel(logging.ERROR)
+    _worker_state.update(
+        pair_starts=pair_starts,
+        pair_ends=pair_ends,
+        pair_indices=pair_indices,
+        block_indices=block_indices,
+        n_bins=n_bins,
+        grid=grid,
+        initial_distribution=initial_distribution,
+        calculator_kwargs=calculator_kwargs,
+        resampling=resampling,
+    )
+
+
+def _solve_resample(seed: np.random.SeedSequence):
+    """
+    Draws one resample of the transitions and computes its free energy.
+    The transitions are only reweighted, their bins are never computed again.
+    :return: the free energy with NaN for unreached bins
+    """
+    state = _worker_state
+    rng = np.random.default_rng(seed)
+    n_transitions = len(state["pair_indices"])
+    if state["resampling"] == "block":
+        n_blocks = state["block_indices"].max() + 1
+        block_weights = np.bincount(
+            rng.integers(n_blocks, size=n_blocks), minlength=n_blocks
+        )
+        transition_weights = block_weights[state["block_indices"]]
+    else:
+        transition_weights = np.bincount(
+            rng.integers(n_transitions, size=n_transitions),
+            minlength=n_transitions,
+        )
+    pair_weights = np.bincount(
+        state["pair_indices"],
+        weights=transition_weights,
+        minlength=len(state["pair_starts"]),
+    )
+    transition_count = scipy.sparse.csr_matrix(
+        (pair_weights, (state["pair_starts"], state["pair_ends"])),
+        shape=(state["n_bins"], state["n_bins"]),
+    )
+    fc = FreeEnergyCalculator(
+        postprocessing_dir=None,
+        transition_count=transition_count,
+        grid=state["grid"],
+        initial_distribution=state["initial_distribution"],
+        unreached_bins="mask",
+        **state["calculator_kwargs"]
+    )
+    fc.run()
+    return fc.free_energy.filled(np.nan)
+
+
+@dataclass
+class UncertaintyEstimator(AbstractPostprocessor):
+    """
+    Estimates the statistical error of the free energy by resampling the swarm trajectories.
+
+    The trajectories are binned once. Every resample only reweights the precomputed pairs of start and end bins
+    to build its transition count, and its stationary distribution is computed starting from the full estimate.
+    """
+
+    """Input from previous step"""
+    cv_coordinates: np.array
+    """
+    The string iteration of every trajectory in cv_coordinates. Required for block resampling
+    """
+    iteration_numbers: Optional[np.array] = None
+    """
+    'bootstrap' resamples single trajectories.
+    'block' resamples whole string iterations, which accounts for correlations between the swarms of an iteration
+    """
+    resampling: Optional[str] = "bootstrap"
+    n_resamples: Optional[int] = 100
+    n_grid_points: Optional[int] = 30
+    """Period of every CV, None for non-periodic CVs. See TransitionCountCalculator"""
+    cv_periods: Optional[tuple] = None
+    """How the stationary distribution of every resample is computed. See FreeEnergyCalculator"""
+    method: Optional[str] = "power_iteration"
+    """Number of processes solving resamples in parallel. All cores by default"""
+    n_workers: Optional[int] = None
+    seed: Optional[int] = None
+    grid: Optional[np.array] = None
+    """Free energy of the full set of trajectories"""
+    free_energy: Optional[np.array] = None
+    """Mean and standard deviation over the resamples. NaN for bins which were never reached"""
+    free_energy_mean: Optional[np.array] = None
+    free_energy_std: Optional[np.array] = None
+
+    def _do_run(self) -> bool:
+        start_time = time.perf_counter()
+        tc = TransitionCountCalculator(
+            postprocessing_dir=self.postprocessing_dir,
+            cv_coordinates=self.cv_coordinates,
+            n_grid_points=self.n_grid_points,
+            cv_periods=self.cv_periods,
+        )
+        tc.run()
+        self.grid = tc.grid
+        calculator_kwargs = dict(method=self.method)
+        fc = FreeEnergyCalculator(
+            postprocessing_dir=self.postprocessing_dir,
+            transition_count=tc.transition_count,
+            grid=self.grid,
+            unreached_bins="mask",
+            **calculator_kwargs
+        )
+        fc.run()
+        self.free_energy = fc.free_energy.filled(np.nan)
+
+        valid = np.all(np.isfinite(tc.cv_coordinates), axis=(1, 2))
+        start_bins = tc._find_bin_indices(tc.cv_coordinates[valid, 0])
+        end_bins = tc._find_bin_indices(tc.cv_coordinates[valid, -1])
+        n_bins = tc.transition_count.shape[0]
+        # Transitions between the same pair of bins are interchangeable when building a transition count
+        pairs, pair_indices = np.unique(
+            start_bins * n_bins + end_bins, return_inverse=True
+        )
+        block_indices = None
+        if self.resampling == "block":
+            if self.iteration_numbers is None:
+                raise ValueError("Block resampling requires the iteration numbers")
+            _, block_indices = np.unique(
+                np.asarray(self.iteration_numbers)[valid], return_inverse=True
+            )
+        init_args = (
+            pairs // n_bins,
+            pairs % n_bins,
+            pair_indices.ravel(),
+            None if block_indices is None else block_indices.ravel(),
+            n_bins,
+            self.grid,
+            fc.probability_distribution,
+            calculator_kwargs,
+            self.resampling,
+        )
+        seeds = np.random.SeedSequence(self.seed).spawn(self.n_resamples)
+        fe_sum = np.zeros(self.free_energy.shape)
+        fe_squared_sum = np.zeros(self.free_energy.shape)
+        fe_count = np.zeros(self.free_energy.shape)
+
+        def accumulate(fe):
+            reached = np.isfinite(fe)
+            fe_sum[reached] += fe[reached]
+            fe_squared_sum[reached] += fe[reached] ** 2
+            fe_count[reached] += 1
+
+        if self.n_workers == 1:
+            level = logger.level
+            try:
+                _init_worker(*init_args)
+                for seed in seeds:
+                    accumulate(_solve_resample(seed))
+            finally:
+                logger.setLevel(level)
+        else:
+            # ProcessPoolExecutor's default
+            n_workers = self.n_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=_init_worker,
+                initargs=init_args,
+            ) as pool:
+                chunksize = max(1, self.n_resamples // (4 * n_workers))
+                for fe in pool.map(_solve_resample, seeds, chunksize=chunksize):
+                    accumulate(fe)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.free_energy_mean = fe_sum / fe_count
+            variance = fe_squared_sum / fe_count - self.free_energy_mean**2
+            self.free_energy_std = np.sqrt(np.clip(variance, 0, None))
+        logger.info(
+            "Computed %s %s resamples of %s transitions in %.3f seconds",
+            self.n_resamples,
+            self.resampling,
+            len(pair_indices),
+            time.perf_counter() - start_time,
+        )
+        return True
+
+    def _do_persist(self):
+        np.save(
+            "{}/free_energy_mean".format(self._get_out_dir()), self.free_energy_mean
+        )
+        np.save("{}/free_energy_std".format(self._get_out_dir()), self.free_energy_std)
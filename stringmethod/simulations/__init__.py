@@ -2,6 +2,7 @@ import os
 import sys
 
 __all__ = [
+    "samplingmd",
     "steeredmd",
     "stringmd",
 ]
@@ -0,0 +1,181 @@
+"""
+Convergence of the string between iterations.
+
+Every iteration adds its convergence metrics to a compact time series in the string directory,
+so that convergence can be followed, plotted and acted on across restarts.
+Strings of the swarms method fluctuate around the converged path, so convergence is best judged
+on the running average of the last strings rather than on two consecutive strings.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+from stringmethod import logger
+from stringmethod.utils import periodicity
+from stringmethod.utils.scaling import MinMaxScaler
+
+CONVERGENCE_FILE = "convergence.npz"
+
+
+def compare_strings(
+    current_string: np.array,
+    new_string: np.array,
+    scaler: MinMaxScaler,
+    periods: Optional[np.array] = None,
+) -> Tuple[float, np.array]:
+    """
+    :param current_string:
+    :param new_string: unwrapped, see periodicity.unwrap_path
+    :param scaler: scales the CVs, so that displacements along all CVs count the same
+    :param periods:
+    :return: the norm of the difference between the scaled strings relative to their mean norm,
+    and the scaled displacement of every bead
+    """
+    if periods is not None:
+        # Compare with the periodic images of the current string closest to the new string
+        current_string = new_string + periodicity.minimum_image(
+            current_string - new_string, periods
+        )
+    scaled_new_string = scaler.transform(new_string)
+    scaled_current_string = scaler.transform(current_string)
+    mean_norm = (
+        np.linalg.norm(scaled_new_string) + np.linalg.norm(scaled_current_string)
+    ) / 2
+    difference = scaled_new_string - scaled_current_string
+    return np.linalg.norm(difference) / mean_norm, np.linalg.norm(difference, axis=1)
+
+
+@dataclass
+class ConvergenceMonitor(object):
+    """
+    Keeps the time series of the convergence metrics in CONVERGENCE_FILE in the string directory:
+    the iteration numbers, the convergence between consecutive strings, the convergence between
+    the running averages of consecutive windows of strings and the displacement of every bead.
+    """
+
+    string_dir: Optional[str] = "strings"
+    """Number of strings in the running average"""
+    window: Optional[int] = 5
+    """The string is converged when the running average changes less than this. None to never stop"""
+    threshold: Optional[float] = None
+    """Number of consecutive iterations the running average has to change less than the threshold"""
+    patience: Optional[int] = 3
+    """Period of every CV, None for non-periodic CVs"""
+    cv_periods: Optional[tuple] = None
+    iterations: Optional[np.array] = None
+    convergence: Optional[np.array] = None
+    average_convergence: Optional[np.array] = None
+    """Scaled displacement of every bead, with shape (iterations, beads)"""
+    displacements: Optional[np.array] = None
+
+    def __post_init__(self):
+        if os.path.isfile(self._get_file()):
+            with np.load(self._get_file()) as data:
+                self.iterations = data["iterations"]
+                self.convergence = data["convergence"]
+                self.average_convergence = data["average_convergence"]
+                self.displacements = data["displacements"]
+
+    def add(self, iteration: int, convergence: float, displacements: np.array):
+        """
+        Records the metrics of an iteration, replacing those of later iterations if it was run again
+        :param iteration: the iteration which produced the new string
+        :param convergence: between the string of this iteration and the previous one, see compare_strings
+        :param displacements: of every bead, see compare_strings
+        """
+        average_convergence = self._get_average_convergence(iteration)
+        if self.iterations is not None and self.displacements.shape[1] != len(
+            displacements
+        ):
+            logger.warning(
+                "The number of beads changed. Starting a new convergence time series"
+            )
+            self.iterations = None
+        if self.iterations is None:
+            self.iterations = np.empty(0, dtype=int)
+            self.convergence = np.empty(0)
+            self.average_convergence = np.empty(0)
+            self.displacements = np.empty((0, len(displacements)))
+        keep = self.iterations < iteration
+        self.iterations = np.append(self.iterations[keep], iteration)
+        self.convergence = np.append(self.convergence[keep], convergence)
+        self.average_convergence = np.append(
+            self.average_convergence[keep], average_convergence
+        )
+        self.displacements = np.vstack([self.displacements[keep], displacements])
+        logger.info(
+            "Convergence of the average of the last %s strings in iteration %s: %s",
+            self.window,
+            iteration,
+            average_convergence,
+        )
+        self.persist()
+
+    def is_converged(self) -> bool:
+        """
+        :return: True if the running average changed less than the threshold
+        in each of the last patience iterations
+        """
+        if (
+            self.threshold is None
+            or self.iterations is None
+            or len(self.iterations) < self.patience
+        ):
+            return False
+        last_iterations = self.iterations[-self.patience :]
+        return bool(
+            np.all(np.diff(last_iterations) == 1)
+            and np.all(self.average_convergence[-self.patience :] < self.threshold)
+        )
+
+    def persist(self):
+        tmp_file = self._get_file() + ".tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(
+                f,
+                iterations=self.iterations,
+                convergence=self.convergence,
+                average_convergence=self.average_convergence,
+                displacements=self.displacements,
+            )
+        # Never leave a partially written time series behind
+        os.replace(tmp_file, self._get_file())
+
+    def _get_average_convergence(self, iteration: int) -> float:
+        periods = self._get_periods()
+        average_string = periodicity.unwrap_path(
+            self._get_average_string(iteration), periods
+        )
+        scaler = MinMaxScaler(periods=periods)
+        scaler.fit(average_string)
+        return compare_strings(
+            self._get_average_string(iteration - 1), average_string, scaler, periods
+        )[0]
+
+    def _get_average_string(self, last_iteration: int) -> np.array:
+        """The mean of the strings of the window ending with last_iteration"""
+        last_string = np.loadtxt(self._get_string_file(last_iteration))
+        strings = [
+            np.loadtxt(self._get_string_file(i))
+            for i in range(max(last_iteration - self.window + 1, 0), last_iteration)
+        ]
+        periods = self._get_periods()
+        # Average the periodic images closest to the last string
+        strings = [
+            last_string + periodicity.minimum_image(s - last_string, periods)
+            for s in strings
+        ]
+        return np.mean(strings + [last_string], axis=0)
+
+    def _get_periods(self) -> Optional[np.array]:
+        if self.cv_periods is None:
+            return None
+        return periodicity.get_periods(self.cv_periods, len(self.cv_periods))
+
+    def _get_string_file(self, iteration: int) -> str:
+        return "{}/string{}.txt".format(self.string_dir, iteration)
+
+    def _get_file(self) -> str:
+        return "{}/{}".format(self.string_dir, CONVERGENCE_FILE)
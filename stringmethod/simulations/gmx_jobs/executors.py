@@ -0,0 +1,217 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import simulations.mdtools as mdtools
+from simulations.stragglers import StragglerDetector
+from stringmethod import logger
+from stringmethod.config import Config
+
+
+class ExecutorError(Exception):
+    pass
+
+
+class AbstractExecutor(object):
+    """
+    Decides where and how the gmx commands of a step are launched
+    """
+
+    def __init__(
+        self,
+        straggler_timeout: Optional[float] = None,
+        straggler_slowdown: Optional[float] = None,
+        max_relaunches: Optional[int] = 1,
+    ):
+        """
+        :param straggler_timeout: seconds without progress after which a simulation is stopped. None to disable
+        :param straggler_slowdown: a simulation this many times slower than the others is stopped. None to disable
+        :param max_relaunches: number of times a stopped simulation is relaunched with a new seed
+        """
+        self.straggler_timeout = straggler_timeout
+        self.straggler_slowdown = straggler_slowdown
+        self.max_relaunches = max_relaunches
+
+    def create_straggler_detector(self) -> Optional[StragglerDetector]:
+        """A detector for the simulations of one step, or None if straggler detection is disabled"""
+        if self.straggler_timeout is None and self.straggler_slowdown is None:
+            return None
+        return StragglerDetector(
+            stall_timeout=self.straggler_timeout, slowdown=self.straggler_slowdown
+        )
+
+    @property
+    def n_cores(self) -> int:
+        """Number of cores simulations can be distributed over"""
+        raise NotImplementedError()
+
+    def run_grompps(self, task_list: List[dict]):
+        raise NotImplementedError()
+
+    def run_mdruns(self, task_list: List[dict]):
+        raise NotImplementedError()
+
+
+class SlurmExecutor(AbstractExecutor):
+    """
+    Launches simulations with srun inside a slurm allocation.
+    Several simulations are run as one `gmx_mpi mdrun -multidir` job.
+    """
+
+    def __init__(self, min_ranks_per_simulation: Optional[int] = 1, **kwargs):
+        """
+        :param min_ranks_per_simulation: ranks of every simulation in a -multidir job.
+        Simulations get more ranks when there are fewer simulations than ranks
+        :param kwargs: straggler options, see AbstractExecutor
+        """
+        super().__init__(**kwargs)
+        if "SLURM_NPROCS" not in os.environ:
+            raise ExecutorError(
+                "The slurm executor has to run inside a slurm allocation. SLURM_NPROCS is not set"
+            )
+        self._n_cores = int(os.environ["SLURM_NPROCS"])
+        self.min_ranks_per_simulation = min_ranks_per_simulation
+
+    @property
+    def n_cores(self) -> int:
+        return self._n_cores
+
+    def run_grompps(self, task_list: List[dict]):
+        mdtools.grompp_all(task_list)
+
+    def run_mdruns(self, task_list: List[dict]):
+        detector = self.create_straggler_detector()
+        if len(task_list) > 1:
+            mdtools.mdrun_all(
+                task_list,
+                min_ranks_per_simulation=self.min_ranks_per_simulation,
+                straggler_detector=detector,
+                max_relaunches=self.max_relaunches,
+            )
+        else:
+            mdtools.mdrun_one(
+                task_list[0],
+                straggler_detector=detector,
+                max_relaunches=self.max_relaunches,
+            )
+
+
+class _CorePool(object):
+    """Thread safe bookkeeping of which cores are free"""
+
+    def __init__(self, cores: List[int]):
+        self._free = list(cores)
+        self._condition = threading.Condition()
+
+    def acquire(self, n: int) -> List[int]:
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._free) >= n)
+            # Prefer the lowest free cores to keep simulations on neighbouring cores
+            self._free.sort()
+            cores, self._free = self._free[:n], self._free[n:]
+            return cores
+
+    def release(self, cores: List[int]) -> None:
+        with self._condition:
+            self._free += cores
+            self._condition.notify_all()
+
+
+class LocalExecutor(AbstractExecutor):
+    """
+    Runs simulations as independent single rank mdruns on the local machine.
+    As many simulations as fit on the available cores run at the same time,
+    each one optionally pinned to its own set of cores.
+    """
+
+    def __init__(
+        self,
+        n_cores: Optional[int] = None,
+        threads_per_simulation: Optional[int] = 1,
+        pin: Optional[bool] = True,
+        **kwargs,
+    ):
+        """
+        :param kwargs: straggler options, see AbstractExecutor
+        """
+        super().__init__(**kwargs)
+        cores = sorted(os.sched_getaffinity(0))
+        if n_cores is not None:
+            if n_cores > len(cores):
+                logger.warning(
+                    "Requested %s cores but only %s are available", n_cores, len(cores)
+                )
+            cores = cores[:n_cores]
+        self._cores = _CorePool(cores)
+        self._n_cores = len(cores)
+        self.threads_per_simulation = min(threads_per_simulation, self._n_cores)
+        self.pin = pin
+
+    @property
+    def n_cores(self) -> int:
+        return self._n_cores
+
+    def run_grompps(self, task_list: List[dict]):
+        mdtools.grompp_all(task_list, n_workers=self._n_cores)
+
+    def run_mdruns(self, task_list: List[dict]):
+        if task_list[0].get("n_cpu") is not None:
+            # The cores were already budgeted for the whole group of simulations
+            n_threads = max(task_list[0]["n_cpu"] // len(task_list), 1)
+        else:
+            n_threads = self.threads_per_simulation
+        n_threads = min(n_threads, self._n_cores)
+        n_workers = min(len(task_list), max(self._n_cores // n_threads, 1))
+        logger.info(
+            "Running %s simulations, %s at a time with %s threads each",
+            len(task_list),
+            n_workers,
+            n_threads,
+        )
+        # Shared by all threads, so that every simulation is compared with the others of the step
+        detector = self.create_straggler_detector()
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            # Iterate over the results to propagate exceptions
+            list(
+                pool.map(lambda t: self._run_pinned(t, n_threads, detector), task_list)
+            )
+
+    def _run_pinned(
+        self, task: dict, n_threads: int, detector: Optional[StragglerDetector]
+    ):
+        cores = self._cores.acquire(n_threads)
+        try:
+            mdtools.mdrun_local(
+                task,
+                cores=cores if self.pin else None,
+                straggler_detector=detector,
+                max_relaunches=self.max_relaunches,
+            )
+        finally:
+            self._cores.release(cores)
+
+
+def create_executor(config: Config) -> AbstractExecutor:
+    executor = config.executor
+    straggler_options = dict(
+        straggler_timeout=config.straggler_timeout,
+        straggler_slowdown=config.straggler_slowdown,
+        max_relaunches=config.straggler_max_relaunches,
+    )
+    if executor == "auto":
+        executor = "slurm" if "SLURM_NPROCS" in os.environ else "local"
+    if executor == "slurm":
+        return SlurmExecutor(
+            min_ranks_per_simulation=config.slurm_min_ranks_per_simulation,
+            **straggler_options,
+        )
+    elif executor == "local":
+        return LocalExecutor(
+            n_cores=config.local_cores,
+            threads_per_simulation=config.local_threads_per_simulation,
+            pin=config.local_pin_cores,
+            **straggler_options,
+        )
+    else:
+        raise ExecutorError("Unknown executor {}".format(config.executor))
@@ -1,28 +1,45 @@
-from typing import List, Tuple
+import os
+from typing import List, Optional, Tuple
 
 import simulations.mdtools as mdtools
 from stringmethod import logger
 
+from .executors import AbstractExecutor, LocalExecutor, SlurmExecutor
+
 _instance = None
+_executor: Optional[AbstractExecutor] = None
 
 
 class SimulationJob:
+    def __init__(self, executor: AbstractExecutor):
+        self.executor = executor
+
     def run_all(self, tasks: List[Tuple[str, dict]]):
         if not tasks:
             return
         elif tasks[0][0] == "grompp":
-            mdtools.grompp_all([t[1] for t in tasks])
+            self.executor.run_grompps([t[1] for t in tasks])
         elif tasks[0][0] == "mdrun":
-            if len(tasks) > 1:
-                mdtools.mdrun_all([t[1] for t in tasks])
-            else:
-                mdtools.mdrun_one(tasks[0][1])
+            self.executor.run_mdruns([t[1] for t in tasks])
         else:
             raise ValueError("Unknown task operation {}".format(tasks[0][0]))
 
 
+def set_executor(executor: AbstractExecutor):
+    global _executor
+    _executor = executor
+
+
+def get_executor() -> AbstractExecutor:
+    """The executor set with set_executor, by default slurm if running in an allocation and local otherwise"""
+    global _executor
+    if _executor is None:
+        _executor = SlurmExecutor() if "SLURM_NPROCS" in os.environ else LocalExecutor()
+    return _executor
+
+
 def submit(tasks: List[Tuple[str, dict]], step=None):
     global _instance
-    _instance = SimulationJob()
+    _instance = SimulationJob(get_executor())
     _instance.run_all(tasks)
     logger.info("Finished with step %s.", step)
@@ -0,0 +1,266 @@
+"""
+Non-blocking launching of gmx commands with asyncio.
+
+Several commands run at the same time as long as they fit into the available slots, e.g. MPI ranks.
+The stderr of every command is streamed line by line to its own log file instead of being kept in memory,
+and a completion event is reported as soon as a command finishes, so that waiting commands can start right away.
+Commands which stall or run much slower than the others can be stopped and relaunched, see stragglers.py.
+
+Only mdtools.mdrun_all runs several commands with one launcher. mdtools.mdrun_one and mdtools.mdrun_local
+run a single simulation with a launcher of their own and block until it has finished. They only share
+its log streaming and straggler handling. Any concurrency comes from their callers, e.g. the threads of the local executor.
+"""
+
+import asyncio
+import os
+import signal
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from stringmethod import logger
+
+from . import stragglers
+
+
+@dataclass
+class LaunchRequest(object):
+    """Unique name of the command, used in logs and completion events"""
+
+    name: str
+    """Shell command to run"""
+    command: str
+    """Working directory of the command"""
+    cwd: Optional[str] = None
+    """File the command's stderr is appended to. Discarded if None"""
+    log_file: Optional[str] = None
+    """Number of slots, e.g. MPI ranks or cores, occupied by the command while it runs"""
+    n_slots: Optional[int] = 1
+    """Called in the child process before the command is run, e.g. to set the CPU affinity"""
+    preexec_fn: Optional[Callable] = None
+    """Directories whose output files show the command's progress. Required for straggler detection"""
+    progress_dirs: Optional[List[str]] = None
+    """
+    Called when the command was stopped as a straggler. Prepares a new attempt, e.g. with a fresh random seed,
+    and returns its request, or None if the command cannot be relaunched. Called in a worker thread
+    """
+    relaunch: Optional[Callable[[], Optional["LaunchRequest"]]] = None
+    """Number of times the command has been relaunched"""
+    attempt: Optional[int] = 0
+
+
+@dataclass
+class CompletionEvent(object):
+    request: LaunchRequest
+    returncode: int
+    """Wall time in seconds"""
+    duration: float
+    """Last lines the command wrote to stderr"""
+    stderr_tail: List[str] = field(default_factory=list)
+    """True if the command was stopped as a straggler"""
+    straggler: Optional[bool] = False
+
+
+class AsyncLauncher(object):
+    """
+    Runs commands as asyncio subprocesses.
+    Commands are started in the order they were given as soon as there are enough free slots,
+    so a command which does not fit may be overtaken by a smaller one.
+    """
+
+    """Number of lines of stderr kept in memory for the completion event"""
+    tail_lines = 20
+
+    def __init__(
+        self,
+        n_slots: int,
+        on_completion: Optional[Callable[[CompletionEvent], None]] = None,
+        straggler_detector: Optional[stragglers.StragglerDetector] = None,
+        max_relaunches: Optional[int] = 1,
+        poll_interval: Optional[float] = 10,
+    ):
+        """
+        :param n_slots: slots shared by all commands
+        :param on_completion: called with the completion event of every command as soon as it finishes
+        :param straggler_detector: tracks the progress of the commands with progress_dirs. No straggler detection if None
+        :param max_relaunches: number of times a straggler is relaunched. Only commands which can be relaunched
+        are stopped. Others are reported once when they stall and left running
+        :param poll_interval: seconds between progress checks
+        """
+        if n_slots < 1:
+            raise ValueError("Launcher needs at least one slot. Got {}".format(n_slots))
+        self.n_slots = n_slots
+        self.on_completion = on_completion
+        self.straggler_detector = straggler_detector
+        self.max_relaunches = max_relaunches
+        self.poll_interval = poll_interval
+        self._processes = dict()
+        self._stopped = set()
+        self._reported = set()
+
+    def run(self, requests: List[LaunchRequest]) -> List[CompletionEvent]:
+        """
+        Runs all commands and waits for them to finish
+        :return: the completion events in the order the commands finished
+        """
+        if len(requests) == 0:
+            return []
+        return asyncio.run(self._run_all(requests))
+
+    async def _run_all(self, requests: List[LaunchRequest]) -> List[CompletionEvent]:
+        pending = list(requests)
+        running = dict()
+        # Relaunches being prepared, e.g. running grompp for a new random seed
+        relaunching = set()
+        free_slots = self.n_slots
+        events = []
+        while pending or running or relaunching:
+            for request in list(pending):
+                n_slots = min(request.n_slots, self.n_slots)
+                if n_slots > free_slots:
+                    continue
+                pending.remove(request)
+                free_slots -= n_slots
+                running[asyncio.ensure_future(self._launch(request))] = (
+                    request,
+                    n_slots,
+                )
+            done, _ = await asyncio.wait(
+                list(running.keys()) + list(relaunching),
+                return_when=asyncio.FIRST_COMPLETED,
+                timeout=None if self.straggler_detector is None else self.poll_interval,
+            )
+            for future in done:
+                if future in relaunching:
+                    relaunching.remove(future)
+                    new_request = future.result()
+                    if new_request is not None:
+                        # Relaunch as soon as possible, the rest of the step may be waiting for it
+                        pending.insert(0, new_request)
+                    continue
+                free_slots += running.pop(future)[1]
+                event = future.result()
+                events.append(event)
+                if self.on_completion is not None:
+                    self.on_completion(event)
+                if event.straggler:
+                    relaunching.add(
+                        asyncio.ensure_future(self._relaunch(event.request))
+                    )
+            if self.straggler_detector is not None:
+                for request, _ in running.values():
+                    self._check_progress(request)
+        return events
+
+    def _check_progress(self, request: LaunchRequest):
+        """Stops the command if it is a straggler which can be relaunched"""
+        if (
+            request.progress_dirs is None
+            or id(request) not in self._processes
+            or id(request) in self._stopped
+        ):
+            return
+        detector = self.straggler_detector
+        detector.update(request.name, self._get_progress(request))
+        can_relaunch = (
+            request.relaunch is not None and request.attempt < self.max_relaunches
+        )
+        stalled = detector.is_stalled(request.name)
+        if not can_relaunch:
+            if stalled and id(request) not in self._reported:
+                self._reported.add(id(request))
+                logger.warning(
+                    "%s makes no progress, but cannot be relaunched. Leaving it running",
+                    request.name,
+                )
+            return
+        if stalled or detector.is_slow(request.name):
+            logger.warning(
+                "%s is a straggler (%s). Stopping and relaunching it",
+                request.name,
+                "no progress" if stalled else "slow progress",
+            )
+            self._stopped.add(id(request))
+            process = self._processes[id(request)]
+            try:
+                # The command runs in its own process group, which includes e.g. srun started by the shell
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    async def _relaunch(self, request: LaunchRequest) -> Optional[LaunchRequest]:
+        if request.relaunch is None or request.attempt >= self.max_relaunches:
+            return None
+        # Preparing the relaunch may block, e.g. on grompp, so it runs in a thread
+        # to keep streaming the output and checking the progress of the other commands
+        new_request = await asyncio.get_running_loop().run_in_executor(
+            None, request.relaunch
+        )
+        if new_request is not None:
+            new_request.attempt = request.attempt + 1
+        return new_request
+
+    @staticmethod
+    def _get_progress(request: LaunchRequest) -> float:
+        # Per simulation, so that commands running different numbers of simulations can be compared
+        return stragglers.get_progress(request.progress_dirs) / len(
+            request.progress_dirs
+        )
+
+    async def _launch(self, request: LaunchRequest) -> CompletionEvent:
+        logger.info("Running command %s", request.command)
+        start_time = time.perf_counter()
+        process = await asyncio.create_subprocess_shell(
+            request.command,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=request.cwd,
+            preexec_fn=request.preexec_fn,
+            # Straggler commands are stopped together with all their child processes
+            start_new_session=self.straggler_detector is not None,
+            # mdrun may write long lines, e.g. when listing many simulation directories
+            limit=2**20,
+        )
+        tracked = self.straggler_detector is not None and request.progress_dirs
+        if tracked:
+            self.straggler_detector.start(request.name, self._get_progress(request))
+        self._processes[id(request)] = process
+        tail = deque(maxlen=self.tail_lines)
+        with open(request.log_file or os.devnull, "a") as log:
+            async for line in process.stderr:
+                line = line.decode(errors="replace")
+                log.write(line)
+                tail.append(line)
+        returncode = await process.wait()
+        del self._processes[id(request)]
+        event = CompletionEvent(
+            request=request,
+            returncode=returncode,
+            duration=time.perf_counter() - start_time,
+            stderr_tail=list(tail),
+            straggler=id(request) in self._stopped,
+        )
+        if tracked:
+            if event.straggler:
+                self.straggler_detector.discard(request.name)
+            else:
+                self.straggler_detector.finish(request.name)
+        if event.straggler:
+            logger.info("Stopped %s after %.1f seconds", request.name, event.duration)
+        elif returncode == 0:
+            logger.info(
+                "Finished %s in %.1f seconds. Output written to %s",
+                request.name,
+                event.duration,
+                request.log_file,
+            )
+        else:
+            logger.warning(
+                "%s failed with exit code %s. Output written to %s. Last lines:\n%s",
+                request.name,
+                returncode,
+                request.log_file,
+                "".join(event.stderr_tail),
+            )
+        return event
@@ -1,9 +1,12 @@
 import os
+import shlex
 import shutil
+import struct
 import sys
+from concurrent.futures import Future, ThreadPoolExecutor
 from glob import glob
 from subprocess import PIPE, run
-from typing import List
+from typing import Callable, List, Optional
 
 import numpy as np
 
@@ -21,9 +24,34 @@ sys.path.append(parent)
 
 
 from stringmethod import logger
+from stringmethod.utils import xvg_reader
 
+from . import launcher, packing, stragglers
 
-def grompp_one(args: dict):
+# File in the simulation directory mdrun's stderr is written to
+MDRUN_LOG_FILE = "mdrun.err"
+
+
+def resolve_grompp_command() -> List[str]:
+    """
+    :return: the command to call gmx for grompp. Prefers a binary which does not require srun
+    """
+    for binary in ["gmx_seq", "gmx"]:
+        path = shutil.which(binary)
+        if path is not None:
+            return [path]
+    logger.warning(
+        "The program is calling many times `srun -n 1 gmx_mpi grompp` in a short period of time. So much communication with the slurm server can cause problems. Please try to have an accesible gmx binary that doesn't require srun."
+    )
+    return ["srun", "-n", "1", "gmx_mpi"]
+
+
+def grompp_one(args: dict, gmx: Optional[List[str]] = None):
+    """
+    :param args:
+    :param gmx: the gmx command as returned by resolve_grompp_command. Resolved again if not given
+    :raises IOError: if grompp cannot be run or fails
+    """
     input_files = {
         "-n": args["index_file"],
         "-f": args["mdp_file"],
@@ -35,42 +63,94 @@ def grompp_one(args: dict):
         args["grompp_options"] if args["grompp_options"] is not None else []
     )
     output_files = {"-o": args["tpr_file"], "-po": args["mdp_output_file"]}
-    infiles = " ".join([k + " " + v for k, v in input_files.items()])
-    outfiles = " ".join([k + " " + v for k, v in output_files.items()])
-    if shutil.which("gmx_seq") is not None:
-        gmx = "gmx_seq"
-    elif shutil.which("gmx") is not None:
-        gmx = "gmx"
-    else:
-        gmx = "srun -n 1 gmx_mpi"
-        logger.warning(
-            "The program is calling many times `srun -n 1 gmx_mpi grompp` in a short period of time. So much communication with the slurm server can cause problems. Please try to have an accesible gmx binary that doesn't require srun."
+    if gmx is None:
+        gmx = resolve_grompp_command()
+    # Options may be given as one string per option or with their values in the same string
+    command = gmx + ["grompp"] + shlex.split(" ".join(grompp_options))
+    for k, v in list(input_files.items()) + list(output_files.items()):
+        command += [k, v]
+    logger.info("Running command %s", " ".join(command))
+    try:
+        result = run(
+            command,
+            stdout=PIPE,
+            stderr=PIPE,
+        )
+    except OSError as ex:
+        raise IOError("Could not run grompp for {}: {}".format(args["tpr_file"], ex))
+    output = result.stderr.decode(errors="replace")
+    if result.returncode != 0:
+        raise IOError(
+            "grompp failed with exit code {} for {}:\n{}".format(
+                result.returncode, args["tpr_file"], output
+            )
         )
-    parse_options = " ".join(grompp_options)
-    command = f"{gmx} grompp {parse_options} {infiles} {outfiles}"
-    logger.info(f"Running command {command}")
-    result = run(
-        command,
-        stdout=PIPE,
-        stderr=PIPE,
-        shell=True,
-    )
-    output = result.stderr
 
     if output:
-        logger.info("grompp output:\n%s", output.decode())
+        logger.info("grompp output:\n%s", output)
 
 
-def grompp_all(task_list: List[dict]):
-    from multiprocessing import Pool
+class GromppService(object):
+    """
+    Long-lived pool of workers running grompp, shared by all steps and iterations.
+
+    The gmx binary is resolved once when the service is created. grompp runs in a subprocess,
+    so the workers are threads which only wait for their process to finish.
+    Tasks can be submitted without waiting for them, e.g. to prepare the next iteration while simulations run.
+    """
+
+    def __init__(self, n_workers: Optional[int] = None):
+        """
+        :param n_workers: number of grompps running at the same time.
+        By default the cores of the node in a slurm allocation, otherwise the cores available to this process
+        """
+        if n_workers is None:
+            if "SLURM_CPUS_ON_NODE" in os.environ:
+                n_workers = int(os.environ["SLURM_CPUS_ON_NODE"])
+            else:
+                n_workers = len(os.sched_getaffinity(0))
+        self.n_workers = max(n_workers, 1)
+        self.gmx = resolve_grompp_command()
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.n_workers, thread_name_prefix="grompp"
+        )
+
+    def submit(self, task_list: List[dict]) -> List[Future]:
+        """Starts grompp for all tasks without waiting for them to finish"""
+        return [self._pool.submit(grompp_one, args, self.gmx) for args in task_list]
+
+    def run(self, task_list: List[dict]):
+        """Runs grompp for all tasks and waits for them to finish"""
+        for future in self.submit(task_list):
+            # Propagate exceptions raised in the workers
+            future.result()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
 
-    proc_per_core = (
-        int(os.environ["SLURM_CPUS_ON_NODE"])
-        if "SLURM_CPUS_ON_NODE" in os.environ.keys()
-        else 1
-    )
-    with Pool(proc_per_core) as p:
-        p.map(grompp_one, task_list)
+
+_grompp_service: Optional[GromppService] = None
+
+
+def get_grompp_service(n_workers: Optional[int] = None) -> GromppService:
+    """
+    :param n_workers: the number of workers of the service. A running service with another number of workers is replaced.
+    :return: the grompp service of this process, created on first use
+    """
+    global _grompp_service
+    if _grompp_service is not None and n_workers not in [
+        None,
+        _grompp_service.n_workers,
+    ]:
+        _grompp_service.shutdown()
+        _grompp_service = None
+    if _grompp_service is None:
+        _grompp_service = GromppService(n_workers=n_workers)
+    return _grompp_service
+
+
+def grompp_all(task_list: List[dict], n_workers: Optional[int] = None):
+    get_grompp_service(n_workers).run(task_list)
 
 
 def _move_all_files(src, dest):
@@ -79,96 +159,310 @@ def _move_all_files(src, dest):
         shutil.move(os.path.join(src, f), os.path.join(dest, f))
 
 
-def mdrun_all(task_list: List[dict]):
-    output_dirs = [t["output_dir"] for t in task_list]
-    tpr_file = task_list[0]["tpr_file"].split("/")[-1]
-    mdrun_options = task_list[0]["mdrun_options"]
-    plumed_file = (
-        task_list[0]["plumed_file"].split("/")[-1]
-        if task_list[0]["plumed_file"] is not None
-        else None
+def mdrun_all(
+    task_list: List[dict],
+    min_ranks_per_simulation: Optional[int] = 1,
+    on_completion: Optional[Callable[[launcher.CompletionEvent], None]] = None,
+    straggler_detector: Optional[stragglers.StragglerDetector] = None,
+    max_relaunches: Optional[int] = 1,
+):
+    """
+    Runs the tasks as `gmx_mpi mdrun -multidir` jobs packed into the ranks of the allocation, see packing.plan_mdruns.
+    Batches of different tasks which fit into the allocation together are run at the same time.
+    The stderr of every batch is written to MDRUN_LOG_FILE in the directory of its first simulation.
+    :param task_list:
+    :param min_ranks_per_simulation:
+    :param on_completion: called as soon as a batch has finished
+    :param straggler_detector: stops batches which stall or are much slower than the others
+    if their tasks can be reseeded, see _reseed_tasks. The unfinished simulations of a stopped batch are relaunched
+    :param max_relaunches:
+    """
+    n_cpu = _get_n_cpu(task_list[0])
+    waves = packing.plan_mdruns(
+        task_list,
+        n_ranks=n_cpu,
+        min_ranks_per_simulation=min_ranks_per_simulation,
+        ranks_per_node=_get_ranks_per_node(),
+    )
+    packing.log_plan(waves, n_cpu)
+    batches = [batch for wave in waves for batch in wave]
+    exclusive = len(batches) > 1 or _shares_allocation(task_list[0])
+    request_batches = dict()
+
+    def create_request(batch: packing.MultidirBatch, name: str):
+        logger.info(
+            "Running %s simulations with %s cpus each.",
+            len(batch.tasks),
+            batch.ranks_per_simulation,
+        )
+        request = launcher.LaunchRequest(
+            name=name,
+            command=_prepare_multidir_batch(batch, exclusive=exclusive),
+            log_file="{}/{}".format(batch.tasks[0]["output_dir"], MDRUN_LOG_FILE),
+            n_slots=batch.n_ranks,
+            progress_dirs=[t["output_dir"] for t in batch.tasks],
+            # Simulations which cannot be reseeded are only reported when they straggle
+            relaunch=(
+                (lambda: relaunch(batch, name)) if _can_reseed(batch.tasks) else None
+            ),
+        )
+        request_batches[id(request)] = batch
+        return request
+
+    def relaunch(batch: packing.MultidirBatch, name: str):
+        tasks = _reseed_tasks(batch.tasks)
+        if tasks is None:
+            return None
+        new_batch = packing.MultidirBatch(
+            tasks=tasks,
+            ranks_per_simulation=batch.ranks_per_simulation,
+            work=batch.work[: len(tasks)],
+        )
+        return create_request(new_batch, name)
+
+    def finish(event: launcher.CompletionEvent):
+        _finish_multidir_batch(request_batches[id(event.request)])
+        if on_completion is not None:
+            on_completion(event)
+
+    requests = [
+        create_request(batch, "mdrun batch {}".format(batch_idx))
+        for batch_idx, batch in enumerate(batches)
+    ]
+    # A batch starts as soon as enough ranks are free, not only when a whole wave is done
+    launcher.AsyncLauncher(
+        n_slots=n_cpu,
+        on_completion=finish,
+        straggler_detector=straggler_detector,
+        max_relaunches=max_relaunches,
+    ).run(requests)
+
+
+def _can_reseed(task_list: List[dict]) -> bool:
+    """:return: True if all tasks provide a 'reseed' callable, see _reseed_tasks"""
+    return all(t.get("reseed") is not None for t in task_list)
+
+
+def _reseed_tasks(task_list: List[dict]) -> Optional[List[dict]]:
+    """
+    Prepares the unfinished tasks of a stopped straggler to be run again with a new random seed.
+    Tasks can be reseeded if they provide a 'reseed' callable, which replaces the tpr file and removes the old output.
+    :return: the tasks to run again, or None if there are none or one of them cannot be reseeded
+    """
+    task_list = [
+        t
+        for t in task_list
+        if not os.path.isfile("{}/confout.gro".format(t["output_dir"]))
+    ]
+    if len(task_list) == 0 or not _can_reseed(task_list):
+        return None
+    for task in task_list:
+        task["reseed"]()
+    # The new attempts start from scratch
+    return [dict(task, check_point_file=None) for task in task_list]
+
+
+def _prepare_multidir_batch(batch: packing.MultidirBatch, exclusive: bool) -> str:
+    """
+    :param batch:
+    :param exclusive: reserve the ranks for this job step, so that other steps can run next to it
+    :return: the command running the batch
+    """
+    output_dirs = [t["output_dir"] for t in batch.tasks]
+    tpr_file, mdrun_options, plumed_file, checkpoint = packing.get_command_key(
+        batch.tasks[0]
     )
     input_files = {"-s": tpr_file}
+    if checkpoint:
+        # All simulations of the batch continue from the checkpoint in their directory
+        input_files["-cpi"] = "state.cpt"
     if plumed_file is not None:
         input_files["-plumed"] = plumed_file
-    mdrun_options_parsed = mdrun_options[:] if mdrun_options is not None else []
-    infiles = " ".join([k + " " + v for k, v in input_files.items()])
-    mdrun_options_parsed = " ".join(mdrun_options_parsed)
-    n_cpu = int(os.environ["SLURM_NPROCS"])
-    if len(output_dirs) >= n_cpu:
-        n_jobs = n_cpu  # one or more batches
-    else:
-        cpu_per_node = int(os.environ["SLURM_CPUS_ON_NODE"])
-        divisors = [x for x in range(1, cpu_per_node + 1) if cpu_per_node % x == 0]
-        n_jobs = 1
-        for div in divisors:
-            if div * len(output_dirs) <= n_cpu:
-                n_jobs = div * len(output_dirs)
-    while output_dirs:
-        if plumed_file is not None:
-            for ddir in output_dirs[:n_jobs]:
-                if "restrained" not in ddir:
-                    try:
-                        os.symlink(
-                            ddir + "/../restrained/" + plumed_file,
-                            ddir + "/" + plumed_file,
-                        )
-                    except:
-                        pass
-        dirs = " ".join(output_dirs[:n_jobs])
-        del output_dirs[:n_jobs]
-        mpie = f"-n {n_cpu}"
-        logger.info(f"Running {n_jobs} simulation with {n_cpu} cpus.")
-        command = f"srun {mpie} gmx_mpi mdrun -cpo state.cpt {infiles} -multidir {dirs} {mdrun_options_parsed}"
-        logger.info(f"Running command {command}")
-        result = run(
-            command,
-            stdout=PIPE,
-            stderr=PIPE,
-            shell=True,
-        )
-        output = result.stderr
-        if plumed_file is not None:
-            for ddir in dirs.split():
+        for ddir in output_dirs:
+            if "restrained" not in ddir:
                 try:
-                    os.symlink(glob(f"{ddir}/colvar*")[0], ddir + "/" + "colvar")
+                    os.symlink(
+                        ddir + "/../restrained/" + plumed_file,
+                        ddir + "/" + plumed_file,
+                    )
                 except:
                     pass
-        if output:
-            logger.info("mdrun output:\n%s", output.decode())
+    infiles = " ".join([k + " " + v for k, v in input_files.items()])
+    mdrun_options_parsed = " ".join(mdrun_options)
+    dirs = " ".join(output_dirs)
+    mpie = f"-n {batch.n_ranks}"
+    if exclusive:
+        mpie += " --exclusive"
+    return f"srun {mpie} gmx_mpi mdrun -cpo state.cpt {infiles} -multidir {dirs} {mdrun_options_parsed}"
 
 
-def mdrun_one(task: dict):
-    output_dir = task["output_dir"]
-    wdir = os.getcwd()
-    os.chdir(output_dir)
-    tpr_file = task["tpr_file"]
-    plumed_file = task["plumed_file"]
-    check_point_file = task["check_point_file"]
-    input_files = {"-s": tpr_file, "-cpi": ""}
-    mdrun_options_parsed = (
-        task["mdrun_options"][:] if task["mdrun_options"] is not None else []
+def _finish_multidir_batch(batch: packing.MultidirBatch):
+    if batch.tasks[0]["plumed_file"] is not None:
+        for task in batch.tasks:
+            ddir = task["output_dir"]
+            try:
+                os.symlink(glob(f"{ddir}/colvar*")[0], ddir + "/" + "colvar")
+            except:
+                pass
+
+
+def mdrun_one(
+    task: dict,
+    straggler_detector: Optional[stragglers.StragglerDetector] = None,
+    max_relaunches: Optional[int] = 1,
+):
+    """
+    Runs one simulation with srun and blocks until it has finished, see _run_single.
+    Unlike mdrun_all, it is not launched together with other simulations
+    """
+    n_cpu = _get_n_cpu(task)
+    mpie = f"-n {n_cpu}"
+    if _shares_allocation(task):
+        mpie += " --exclusive"
+    logger.info(f"Running one simulation with {n_cpu} cpus.")
+    _run_single(
+        task,
+        lambda t: f"srun {mpie} gmx_mpi mdrun -cpt 5 -cpo state.cpt {_get_mdrun_input_options(t)}",
+        straggler_detector=straggler_detector,
+        max_relaunches=max_relaunches,
     )
-    if check_point_file is not None:
-        input_files["-cpi"] = check_point_file
-    if plumed_file is not None:
-        input_files["-plumed"] = plumed_file
+
+
+def mdrun_local(
+    task: dict,
+    cores: Optional[List[int]] = None,
+    straggler_detector: Optional[stragglers.StragglerDetector] = None,
+    max_relaunches: Optional[int] = 1,
+):
+    """
+    Run one simulation as a single rank on the local machine without srun.
+    Blocks until the simulation has finished, see _run_single. The local executor runs several of them in threads.
+    :param task:
+    :param cores: cores to pin the simulation to. The simulation uses one thread per core.
+    If None, the number of threads is taken from the task and the OS decides where they run.
+    :param straggler_detector: stops and relaunches the simulation if it stalls or is much slower than the others
+    and the task can be reseeded, see _reseed_tasks
+    :param max_relaunches:
+    """
+    n_threads = len(cores) if cores is not None else task.get("n_cpu") or 1
+    if shutil.which("gmx") is not None:
+        # Thread-MPI build, make sure it does not spawn several ranks
+        gmx = "gmx mdrun -ntmpi 1"
+    elif shutil.which("gmx_seq") is not None:
+        gmx = "gmx_seq mdrun"
+    else:
+        gmx = "gmx_mpi mdrun"
+    logger.info(f"Running simulation in {task['output_dir']} on cores {cores}")
+    _run_single(
+        task,
+        # GROMACS leaves the thread affinity alone when it has been set from outside
+        lambda t: f"{gmx} -ntomp {n_threads} -pin off -cpt 5 -cpo state.cpt {_get_mdrun_input_options(t)}",
+        preexec_fn=(
+            (lambda: os.sched_setaffinity(0, cores)) if cores is not None else None
+        ),
+        straggler_detector=straggler_detector,
+        max_relaunches=max_relaunches,
+    )
+
+
+def _get_mdrun_input_options(task: dict) -> str:
+    input_files = {"-s": task["tpr_file"], "-cpi": ""}
+    if task["check_point_file"] is not None:
+        input_files["-cpi"] = task["check_point_file"]
+    if task["plumed_file"] is not None:
+        input_files["-plumed"] = task["plumed_file"]
     infiles = " ".join([k + " " + v for k, v in input_files.items()])
-    mdrun_options_parsed = " ".join(mdrun_options_parsed)
-    n_cpu = int(os.environ["SLURM_NPROCS"])
-    logger.info(f"Running one simulation with {n_cpu} cpus.")
-    command = f"srun -n {n_cpu} gmx_mpi mdrun -cpt 5 -cpo state.cpt {infiles} {mdrun_options_parsed}"
-    logger.info(f"Running command {command}")
-    result = run(
-        command,
-        stdout=PIPE,
-        stderr=PIPE,
-        shell=True,
+    mdrun_options_parsed = " ".join(
+        task["mdrun_options"][:] if task["mdrun_options"] is not None else []
     )
-    output = result.stderr
-    if output:
-        logger.info("mdrun output:\n%s", output.decode())
-    os.chdir(wdir)
+    return f"{infiles} {mdrun_options_parsed}"
+
+
+def _run_single(
+    task: dict,
+    get_command: Callable[[dict], str],
+    preexec_fn: Optional[Callable] = None,
+    straggler_detector: Optional[stragglers.StragglerDetector] = None,
+    max_relaunches: Optional[int] = 1,
+):
+    """
+    Runs one simulation in its output directory with the command returned by get_command.
+    The launcher is private to this simulation and the call blocks until it has finished, including relaunches.
+    The launcher is only used for its log streaming and straggler handling
+    """
+    output_dir = task["output_dir"]
+
+    def create_request(t: dict) -> launcher.LaunchRequest:
+        return launcher.LaunchRequest(
+            name="mdrun in {}".format(output_dir),
+            command=get_command(t),
+            cwd=output_dir,
+            log_file="{}/{}".format(output_dir, MDRUN_LOG_FILE),
+            preexec_fn=preexec_fn,
+            progress_dirs=[output_dir],
+            relaunch=(lambda: relaunch(t)) if _can_reseed([t]) else None,
+        )
+
+    def relaunch(t: dict) -> Optional[launcher.LaunchRequest]:
+        tasks = _reseed_tasks([t])
+        return None if tasks is None else create_request(tasks[0])
+
+    launcher.AsyncLauncher(
+        n_slots=1,
+        straggler_detector=straggler_detector,
+        max_relaunches=max_relaunches,
+    ).run([create_request(task)])
+
+
+def copy_tpr_with_seeds(
+    shared_tpr_file: str, tpr_files: List[str], sentinel_seed: int, seeds: List[int]
+) -> bool:
+    """
+    Writes copies of a tpr file which only differ in their random seed.
+    The shared tpr file has to be generated with ld-seed set to sentinel_seed.
+    Its binary representation, a big-endian 64 bit integer, is replaced with a different seed in every copy.
+    :param shared_tpr_file:
+    :param tpr_files: the copies to write
+    :param sentinel_seed:
+    :param seeds: the seed of every copy
+    :return: False if the sentinel was not found exactly once in the tpr file, in which case nothing is written
+    """
+    with open(shared_tpr_file, "rb") as f:
+        content = f.read()
+    sentinel = struct.pack(">q", sentinel_seed)
+    offset = content.find(sentinel)
+    if offset < 0 or content.find(sentinel, offset + 1) >= 0:
+        return False
+    for tpr_file, seed in zip(tpr_files, seeds):
+        with open(tpr_file, "wb") as f:
+            f.write(content[:offset])
+            f.write(struct.pack(">q", seed))
+            f.write(content[offset + len(sentinel) :])
+    return True
+
+
+def _get_ranks_per_node() -> Optional[int]:
+    """Ranks of the slurm allocation on every node, if they are evenly distributed"""
+    n_nodes = int(os.environ.get("SLURM_NNODES", 1))
+    n_ranks = int(os.environ.get("SLURM_NPROCS", 0))
+    if n_ranks > 0 and n_ranks % n_nodes == 0:
+        return n_ranks // n_nodes
+    return None
+
+
+def _get_n_cpu(task: dict) -> int:
+    """Cores requested by the task, defaulting to the whole slurm allocation"""
+    if task.get("n_cpu") is not None:
+        return task["n_cpu"]
+    return int(os.environ["SLURM_NPROCS"])
+
+
+def _shares_allocation(task: dict) -> bool:
+    """
+    Tasks which request their own number of cores, e.g. from the pipeline, only get a part of the allocation.
+    Their job steps have to reserve their ranks with --exclusive, since other steps run next to them
+    """
+    return task.get("n_cpu") is not None
 
 
 def load_xvg(file_name: str, usemask: bool = False) -> np.array:
@@ -181,16 +475,11 @@ def load_xvg(file_name: str, usemask: bool = False) -> np.array:
     :param usemask:
     :return:
     """
+    return xvg_reader.load_xvg(file_name)
 
-    if not os.path.exists(file_name):
-        raise FileNotFoundError("WARNING: file " + file_name + " not found.")
 
-    # Since xvg/colvar files can have both @ and # as a head, we only read lines that don't start with these chars
-    data_lines = [line for line in open(file_name) if not line.startswith(("#", "@"))]
-    # then convert them to lists of floats
-    data_lines_num = [[float(x) for x in line.split()] for line in data_lines]
-    # and remove lines that have inconsistent number of fields (e.g. due to write errors during restarting).
-    data = [line for line in data_lines_num if len(line) == len(data_lines_num[0])]
-    if len(data) == 0:
-        raise IOError("No data found in file " + file_name)
-    return np.array(data)
+def load_xvg_endpoints(file_name: str, n_columns: Optional[int] = None) -> np.array:
+    """
+    Load the first and last frame of an xvg/colvar file
+    """
+    return xvg_reader.load_xvg_endpoints(file_name, n_columns=n_columns)
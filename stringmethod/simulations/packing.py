@@ -0,0 +1,185 @@
+"""
+Packing of mdrun tasks into `gmx_mpi mdrun -multidir` batches for a slurm allocation.
+
+All simulations of a multidir batch share the same command line and the same number of ranks,
+and the batch only finishes when its slowest simulation does. Tasks are therefore grouped by command line,
+sorted by their estimated remaining work and cut into batches of similar length. Batches which do not fill
+the allocation on their own are run side by side in the same wave, and the ranks left over in a wave are
+handed out to its longest batches.
+
+A plan only covers the tasks of one submitted step. The restrained simulations and the swarms of an iteration
+are separate steps, since the swarms start from the output of the restrained simulations and the next
+restrained simulations need the new string, so they are never packed into the same waves.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from stringmethod import logger
+from stringmethod.utils import mdp_parser
+
+
+@dataclass
+class MultidirBatch(object):
+    """mdrun tasks with the same command line, run as one -multidir job"""
+
+    tasks: List[dict]
+    """Number of MPI ranks of every simulation in the batch"""
+    ranks_per_simulation: int
+    """Estimated remaining work of every task, e.g. in MD steps"""
+    work: List[float] = field(default_factory=list)
+
+    @property
+    def n_ranks(self) -> int:
+        return len(self.tasks) * self.ranks_per_simulation
+
+    @property
+    def duration(self) -> float:
+        """Estimated duration in units of work per rank. The longest simulation decides"""
+        return max(self.work) / self.ranks_per_simulation
+
+
+def get_command_key(task: dict) -> tuple:
+    """
+    Tasks with the same key can run in the same multidir batch
+    :return: the names of the tpr and plumed files, the mdrun options and whether the tasks continue from a checkpoint
+    """
+    return (
+        os.path.basename(task["tpr_file"]),
+        tuple(task["mdrun_options"] or []),
+        None if task["plumed_file"] is None else os.path.basename(task["plumed_file"]),
+        task.get("check_point_file") is not None,
+    )
+
+
+def estimate_remaining_work(task: dict) -> Optional[float]:
+    """
+    :return: the number of MD steps left to run, or None if the length of the simulation is unknown.
+    The steps already done are read from the log of a simulation which is continued from a checkpoint.
+    """
+    mdout_file = "{}/mdout.mdp".format(task["output_dir"])
+    if not os.path.isfile(mdout_file):
+        return None
+    nsteps = mdp_parser.parse_mdp(mdout_file).get("nsteps")
+    if not isinstance(nsteps, float) or nsteps < 0:
+        return None
+    done = 0
+    if task.get("check_point_file") is not None:
+        done = _read_last_step("{}/md.log".format(task["output_dir"])) or 0
+    return max(nsteps - done, 0.0)
+
+
+_step_pattern = re.compile(r"^\s+Step\s+Time\s*\n\s+(\d+)", re.MULTILINE)
+
+
+def _read_last_step(log_file: str, tail_bytes: int = 65536) -> Optional[int]:
+    """The last step with energies written to an md.log file"""
+    try:
+        with open(log_file, "rb") as f:
+            f.seek(max(os.path.getsize(log_file) - tail_bytes, 0))
+            tail = f.read().decode(errors="ignore")
+    except OSError:
+        return None
+    steps = _step_pattern.findall(tail)
+    return int(steps[-1]) if steps else None
+
+
+def _get_ranks_per_simulation(
+    max_ranks: int, min_ranks: int, ranks_per_node: Optional[int]
+) -> int:
+    """
+    The largest number of ranks per simulation not larger than max_ranks
+    which does not split a simulation unevenly over nodes
+    """
+    for n_ranks in range(max_ranks, min_ranks, -1):
+        if (
+            ranks_per_node is None
+            or ranks_per_node % n_ranks == 0
+            or n_ranks % ranks_per_node == 0
+        ):
+            return n_ranks
+    return min_ranks
+
+
+def plan_mdruns(
+    task_list: List[dict],
+    n_ranks: int,
+    min_ranks_per_simulation: Optional[int] = 1,
+    ranks_per_node: Optional[int] = None,
+    work: Optional[List[Optional[float]]] = None,
+) -> List[List[MultidirBatch]]:
+    """
+    :param task_list: mdrun tasks
+    :param n_ranks: number of MPI ranks available
+    :param min_ranks_per_simulation:
+    :param ranks_per_node: ranks of the allocation on every node, to avoid splitting a simulation unevenly over nodes
+    :param work: estimated remaining work of every task. Estimated with estimate_remaining_work if not given
+    :return: waves of batches. The batches of a wave run at the same time and use at most n_ranks ranks together
+    """
+    min_ranks_per_simulation = max(1, min(min_ranks_per_simulation, n_ranks))
+    if work is None:
+        work = [estimate_remaining_work(t) for t in task_list]
+    known_work = [w for w in work if w is not None]
+    # Simulations of unknown length are assumed to be as long as the longest known one
+    default_work = max(known_work) if known_work else 1.0
+    work = [default_work if w is None else max(w, 1e-9) for w in work]
+    groups = dict()
+    for task, w in zip(task_list, work):
+        groups.setdefault(get_command_key(task), []).append((task, w))
+    batch_size = n_ranks // min_ranks_per_simulation
+    batches = []
+    for group in groups.values():
+        # Longest first, so that simulations of similar length end up in the same batch
+        group.sort(key=lambda tw: -tw[1])
+        for start in range(0, len(group), batch_size):
+            chunk = group[start : start + batch_size]
+            batches.append(
+                MultidirBatch(
+                    tasks=[t for t, _ in chunk],
+                    ranks_per_simulation=min_ranks_per_simulation,
+                    work=[w for _, w in chunk],
+                )
+            )
+    # First fit decreasing, longest batches first
+    batches.sort(key=lambda b: -b.duration)
+    waves = []
+    for batch in batches:
+        for wave in waves:
+            if sum(b.n_ranks for b in wave) + batch.n_ranks <= n_ranks:
+                wave.append(batch)
+                break
+        else:
+            waves.append([batch])
+    for wave in waves:
+        # Give the ranks nobody uses to the longest batches of the wave
+        for batch in sorted(wave, key=lambda b: -b.duration):
+            free_ranks = n_ranks - sum(b.n_ranks for b in wave)
+            max_ranks = batch.ranks_per_simulation + free_ranks // len(batch.tasks)
+            batch.ranks_per_simulation = _get_ranks_per_simulation(
+                max_ranks, batch.ranks_per_simulation, ranks_per_node
+            )
+    return waves
+
+
+def get_utilization(waves: List[List[MultidirBatch]], n_ranks: int) -> float:
+    """Fraction of the rank time used by simulations, assuming every wave lasts as long as its longest batch"""
+    used, total = 0.0, 0.0
+    for wave in waves:
+        wave_duration = max(b.duration for b in wave)
+        total += n_ranks * wave_duration
+        # With linear scaling, the rank time of a simulation does not depend on its number of ranks
+        used += sum(sum(b.work) for b in wave)
+    return used / total if total > 0 else 1.0
+
+
+def log_plan(waves: List[List[MultidirBatch]], n_ranks: int):
+    logger.info(
+        "Packed %s simulations into %s multidir batches in %s waves on %s ranks. Estimated utilization %.0f%%",
+        sum(len(b.tasks) for wave in waves for b in wave),
+        sum(len(wave) for wave in waves),
+        len(waves),
+        n_ranks,
+        100 * get_utilization(waves, n_ranks),
+    )
@@ -0,0 +1,236 @@
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+from stringmethod.config import Config
+from stringmethod.postprocessing.cv_store import CvStore
+from stringmethod.postprocessing.cv_value_extraction import CvValueExtractor
+from stringmethod.utils import periodicity
+from stringmethod.utils.scaling import MinMaxScaler
+
+from simulations.gmx_jobs import *
+from simulations.stringmd import StringIterationRunner
+
+
+@dataclass
+class SamplingRunner(StringIterationRunner):
+    """
+    Runs swarms around a converged string without moving it, to collect transitions for the free energy.
+
+    The string of the last string iteration is kept fixed and no new strings are written.
+    The swarms of a bead start from the previous iteration's swarm endpoint or start structure
+    closest to the bead, so the restrained simulations are skipped as long as one of them is close enough.
+    The swarms' start and end CVs are added to the CV store of the postprocessing after every iteration,
+    which also records the iterations which are done when the sampling is restarted.
+    """
+
+    """Number of sampling iterations to run after the last string iteration, including those already done"""
+    sampling_iterations: Optional[int] = 10
+    """
+    Largest distance between a bead and a previous structure, relative to the range of the CVs along the string,
+    for the structure to be used as the start of the bead's swarms without a restrained simulation
+    """
+    sampling_tolerance: Optional[float] = 0.05
+
+    def run(self):
+        last_string_iteration = self.iteration - 1
+        while os.path.isfile(self._get_string_filepath(last_string_iteration + 1)):
+            last_string_iteration += 1
+        string_path = self._get_string_filepath(last_string_iteration)
+        if not os.path.isfile(string_path):
+            raise IOError("File %s does not exist" % string_path)
+        self.string = np.loadtxt(string_path)
+        last_iteration = last_string_iteration + self.sampling_iterations
+        first_iteration = self._get_first_unfinished_iteration(last_string_iteration)
+        if first_iteration > last_iteration:
+            logger.info(
+                "All %s sampling iterations after string iteration %s are done",
+                self.sampling_iterations,
+                last_string_iteration,
+            )
+            return
+        logger.info(
+            "Sampling iterations %s to %s with the string of iteration %s",
+            first_iteration,
+            last_iteration,
+            last_string_iteration,
+        )
+        self.iteration = first_iteration - 1
+        previous_endpoints = (
+            self._read_swarm_endpoints(strict=False)[0] if self.swarm_size > 0 else None
+        )
+        for iteration in range(first_iteration, last_iteration + 1):
+            self.iteration = iteration
+            self._setup_dirs()
+            if previous_endpoints is not None:
+                self._chain_swarms(previous_endpoints)
+            if self.pipelined:
+                self._run_pipelined()
+            else:
+                self._run_restrained()
+                self._run_swarms()
+            if self.swarm_size == 0:
+                continue
+            if self.swarm_drift_error is not None:
+                self._run_adaptive_swarms()
+            endpoints = self._load_swarm_endpoints()
+            self._add_to_cv_store(endpoints)
+            if self.online_free_energy:
+                self._update_online_free_energy(endpoints)
+            previous_endpoints = endpoints
+
+    def _get_first_unfinished_iteration(self, last_string_iteration: int) -> int:
+        """
+        :return: the iteration after the last sampling iteration in the CV store,
+        or the one after the last string iteration if no sampling iteration is stored
+        """
+        last_stored_iteration = self._get_cv_store().last_iteration
+        if (
+            last_stored_iteration is None
+            or last_stored_iteration <= last_string_iteration
+        ):
+            return last_string_iteration + 1
+        return last_stored_iteration + 1
+
+    def _chain_swarms(self, previous_endpoints: np.array):
+        """
+        Copies the structure closest to every bead from the previous iteration to the bead's restrained directory,
+        where the swarms start from, if it is within sampling_tolerance of the bead
+        :param previous_endpoints: the previous iteration's endpoints, see _load_swarm_endpoints
+        """
+        periods = periodicity.get_periods(self.cv_periods, self.string.shape[1])
+        scaler = MinMaxScaler(periods=periods)
+        scaler.fit(periodicity.unwrap_path(self.string, periods))
+        # CVs which do not change along the string are not scaled
+        scale = np.where(scaler.scale > 0, scaler.scale, 1)
+        string_endpoints = self._transform_endpoints(previous_endpoints)
+        n_chained = 0
+        for point_idx in self._get_moving_points():
+            start_file = "{}/{}/{}/restrained/confout.gro".format(
+                self.md_dir, self.iteration, point_idx
+            )
+            if os.path.isfile(start_file):
+                continue
+            source, distance = self._get_closest_structure(
+                point_idx, string_endpoints[point_idx], scale, periods
+            )
+            if source is None or distance > self.sampling_tolerance:
+                logger.debug(
+                    "No structure close to point %s in iteration %s. Running a restrained simulation",
+                    point_idx,
+                    self.iteration - 1,
+                )
+                continue
+            shutil.copyfile(source, start_file)
+            n_chained += 1
+        logger.info(
+            "Starting the swarms of %s of %s points from the previous iteration's structures",
+            n_chained,
+            len(self._get_moving_points()),
+        )
+
+    def _get_closest_structure(
+        self,
+        point_idx: int,
+        swarm_endpoints: np.array,
+        scale: np.array,
+        periods: Optional[np.array],
+    ) -> Tuple[Optional[str], float]:
+        """
+        :param swarm_endpoints: the previous iteration's endpoints of the bead's swarms, in the CVs of the string
+        :param scale: the scale of every CV distances are measured in
+        :param periods:
+        :return: the coordinate file of the previous iteration closest to the bead and its scaled distance,
+        or None if there is none
+        """
+        previous_dir = "{}/{}/{}".format(self.md_dir, self.iteration - 1, point_idx)
+        valid_swarms = np.all(np.isfinite(swarm_endpoints), axis=(1, 2))
+        if not np.any(valid_swarms):
+            return None, np.inf
+        # The swarms start from the restrained simulation's output, so its CVs are the swarms' first frame
+        candidates = [
+            (
+                "{}/restrained/confout.gro".format(previous_dir),
+                swarm_endpoints[valid_swarms.argmax(), 0],
+            )
+        ] + [
+            ("{}/s{}/confout.gro".format(previous_dir, swarm_idx), values[1])
+            for swarm_idx, values in enumerate(swarm_endpoints)
+            if valid_swarms[swarm_idx]
+        ]
+        point = self.string[point_idx]
+        closest, closest_distance = None, np.inf
+        for coordinate_file, values in candidates:
+            if not os.path.isfile(coordinate_file):
+                continue
+            displacement = periodicity.minimum_image(values - point, periods)
+            distance = np.linalg.norm(displacement / scale)
+            if distance < closest_distance:
+                closest, closest_distance = coordinate_file, distance
+        return closest, closest_distance
+
+    def _create_restrained_tasks(self, point_idx: int, point: np.array):
+        if os.path.isfile(
+            "{}/{}/{}/restrained/confout.gro".format(
+                self.md_dir, self.iteration, point_idx
+            )
+        ):
+            # The swarms start from a previous structure
+            return None, None
+        return super()._create_restrained_tasks(point_idx, point)
+
+    def _prefetch_next_restrained_grompps(self):
+        # Most beads skip their restrained simulation, which is only known once the swarms are done
+        pass
+
+    def _add_to_cv_store(self, endpoints: np.array):
+        """
+        Appends the transitions of this iteration's finished swarms to the postprocessing CV store,
+        replacing those of an earlier attempt. Iterations before this one which are missing from the store
+        are read with CvValueExtractor first, so that the store has no gaps.
+        Only the CVs of the string are stored, i.e. no further columns of the output files.
+        :param endpoints: as returned by _load_swarm_endpoints
+        """
+        store = self._get_cv_store()
+        if store.last_iteration is None or store.last_iteration < self.iteration - 1:
+            CvValueExtractor(
+                postprocessing_dir=self.postprocessing_dir,
+                md_dir=self.md_dir,
+                use_plumed=self.use_plumed,
+                last_iteration=self.iteration - 1,
+            ).compute_cv_coordinates()
+            store = self._get_cv_store()
+        if store.last_iteration is not None and store.last_iteration >= self.iteration:
+            store.truncate(self.iteration)
+        moving_points = self._get_moving_points()
+        transitions = endpoints[moving_points]
+        finished = np.all(np.isfinite(transitions), axis=(2, 3))
+        output_file = "colvar" if self.use_plumed else "pullx.xvg"
+        files = [
+            "{}/{}/{}/s{}/{}".format(
+                self.md_dir, self.iteration, moving_points[idx], swarm_idx, output_file
+            )
+            for idx, swarm_idx in zip(*np.nonzero(finished))
+        ]
+        try:
+            store.append(self.iteration, transitions[finished], files=files)
+        except ValueError as ex:
+            logger.warning(
+                "Could not add iteration %s to the CV store, it is added by the postprocessing instead: %s",
+                self.iteration,
+                ex,
+            )
+
+    def _get_cv_store(self) -> CvStore:
+        return CvStore("{}/cv_store".format(self.postprocessing_dir))
+
+    @classmethod
+    def from_config(clazz, config: Config, **kwargs):
+        return super().from_config(
+            config,
+            sampling_iterations=config.sampling_iterations,
+            sampling_tolerance=config.sampling_tolerance,
+            **kwargs
+        )
@@ -0,0 +1,103 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from simulations.gmx_jobs import gmx_jobs
+from stringmethod import logger
+
+
+def available_cores() -> int:
+    """
+    Number of cores the scheduler may fill with tasks, as given by the current executor.
+    """
+    return gmx_jobs.get_executor().n_cores
+
+
+@dataclass
+class ScheduledTask(object):
+    """Unique name of the task, used to declare dependencies"""
+
+    name: str
+    """gmx_jobs tasks, i.e. a list of (operation, args) tuples run in a single submit"""
+    tasks: List[Tuple[str, dict]]
+    """Number of cores occupied by the task while it runs"""
+    n_cores: Optional[int] = 1
+    """Names of the tasks which have to finish before this one can start"""
+    dependencies: Optional[List[str]] = field(default_factory=list)
+    """Files which have to exist before this task can start"""
+    required_files: Optional[List[str]] = field(default_factory=list)
+    """Callable invoked right before the task is launched, e.g. to write input files"""
+    prepare: Optional[Callable] = None
+
+
+class PipelineScheduler(object):
+    """
+    Dependency driven task scheduler.
+
+    Tasks are started as soon as their dependencies have finished and their required files exist,
+    as long as there are enough free cores for them. Tasks are considered in the order they were added,
+    so a task which does not fit in the free cores may be overtaken by a smaller one added later.
+    """
+
+    def __init__(self, n_cores: int):
+        if n_cores < 1:
+            raise ValueError(
+                "Scheduler needs at least one core. Got {}".format(n_cores)
+            )
+        self.n_cores = n_cores
+        self._tasks: Dict[str, ScheduledTask] = dict()
+
+    def add(self, task: ScheduledTask) -> None:
+        if task.name in self._tasks:
+            raise ValueError("Task {} was already added".format(task.name))
+        self._tasks[task.name] = task
+
+    def run(self) -> None:
+        pending = list(self._tasks.values())
+        finished = set()
+        running = dict()
+        free_cores = self.n_cores
+        with ThreadPoolExecutor(max_workers=self.n_cores) as pool:
+            while pending or running:
+                for task in list(pending):
+                    if not self._is_ready(task, finished):
+                        continue
+                    n_cores = min(task.n_cores, self.n_cores)
+                    if n_cores > free_cores:
+                        continue
+                    pending.remove(task)
+                    free_cores -= n_cores
+                    logger.debug(
+                        "Starting task %s on %s cores. %s cores left",
+                        task.name,
+                        n_cores,
+                        free_cores,
+                    )
+                    running[pool.submit(self._run_task, task)] = (task, n_cores)
+                if not running:
+                    raise IOError(
+                        "Could not start tasks {}. Their input files do not exist. Check the logs for errors".format(
+                            [t.name for t in pending]
+                        )
+                    )
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, n_cores = running.pop(future)
+                    # Propagate exceptions raised in the worker thread
+                    future.result()
+                    free_cores += n_cores
+                    finished.add(task.name)
+
+    def _is_ready(self, task: ScheduledTask, finished: set) -> bool:
+        for dependency in task.dependencies:
+            # Dependencies which were never scheduled have already been done
+            if dependency in self._tasks and dependency not in finished:
+                return False
+        return all(os.path.exists(f) for f in task.required_files)
+
+    @staticmethod
+    def _run_task(task: ScheduledTask) -> None:
+        if task.prepare is not None:
+            task.prepare()
+        gmx_jobs.submit(tasks=task.tasks, step=task.name)
@@ -0,0 +1,130 @@
+"""
+Detection of simulations which are much slower than their peers or do not make progress at all.
+
+Progress is measured as the growth of the output files in a simulation's directory,
+e.g. md.log and the pull or colvar output, which gromacs writes at a steady rate.
+Other files, such as the stderr of mdrun, may grow without the simulation progressing and are ignored.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+"""Extensions of the files gromacs writes as a simulation progresses"""
+OUTPUT_FILE_EXTENSIONS = (".log", ".xvg", ".edr", ".trr", ".xtc")
+
+
+def is_output_file(file_name: str) -> bool:
+    """:return: True for the trajectory, energy, log and CV output of a simulation"""
+    return file_name.endswith(OUTPUT_FILE_EXTENSIONS) or file_name.startswith("colvar")
+
+
+def get_progress(output_dirs: List[str]) -> int:
+    """Total size in bytes of the output files in the simulation directories, see is_output_file"""
+    size = 0
+    for output_dir in output_dirs:
+        try:
+            with os.scandir(output_dir) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False) and is_output_file(
+                        entry.name
+                    ):
+                        size += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            # The directory has not been created yet
+            pass
+    return size
+
+
+@dataclass
+class _Progress(object):
+    start_time: float
+    start_size: int
+    size: int
+    last_growth_time: float
+    end_time: Optional[float] = None
+
+    def get_rate(self, now: float) -> float:
+        duration = (self.end_time or now) - self.start_time
+        return (self.size - self.start_size) / duration if duration > 0 else 0.0
+
+
+@dataclass
+class StragglerDetector(object):
+    """
+    Tracks the progress of running simulations. Thread safe, so that simulations launched
+    from different threads can be compared with each other.
+    """
+
+    """A simulation whose output has not grown for this many seconds is a straggler"""
+    stall_timeout: Optional[float] = 600
+    """
+    A simulation which progresses this many times slower than the median of the others is a straggler.
+    Only applied when at least min_peers other simulations have been tracked
+    """
+    slowdown: Optional[float] = 3.0
+    min_peers: Optional[int] = 3
+    _progress: Dict[str, _Progress] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def start(self, name: str, size: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._progress[name] = _Progress(
+                start_time=now, start_size=size, size=size, last_growth_time=now
+            )
+
+    def update(self, name: str, size: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            progress = self._progress[name]
+            if size > progress.size:
+                progress.last_growth_time = now
+            progress.size = size
+
+    def finish(self, name: str, now: Optional[float] = None):
+        """Keeps the simulation's final rate as a reference for the others"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if name in self._progress:
+                self._progress[name].end_time = now
+
+    def discard(self, name: str):
+        """Forgets a simulation, e.g. one that was stopped as a straggler"""
+        with self._lock:
+            self._progress.pop(name, None)
+
+    def is_stalled(self, name: str, now: Optional[float] = None) -> bool:
+        """True if the simulation's output has not grown for stall_timeout seconds"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return (
+                self.stall_timeout is not None
+                and now - self._progress[name].last_growth_time > self.stall_timeout
+            )
+
+    def is_slow(self, name: str, now: Optional[float] = None) -> bool:
+        """True if the simulation progresses slowdown times slower than the median of the others"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            progress = self._progress[name]
+            if self.slowdown is None or now - progress.start_time < (
+                self.stall_timeout or 0
+            ):
+                # Too early to tell a slow start from a slow simulation
+                return False
+            peer_rates = [
+                p.get_rate(now)
+                for n, p in self._progress.items()
+                if n != name and p.get_rate(now) > 0
+            ]
+            if len(peer_rates) < self.min_peers:
+                return False
+            return progress.get_rate(now) * self.slowdown < np.median(peer_rates)
+
+    def is_straggler(self, name: str, now: Optional[float] = None) -> bool:
+        return self.is_stalled(name, now) or self.is_slow(name, now)
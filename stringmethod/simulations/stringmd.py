@@ -1,17 +1,33 @@
+import glob
+import json
 import os
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import partial
 from os.path import abspath
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 from stringmethod import utils
 from stringmethod.config import Config
+from stringmethod.postprocessing.online_estimation import OnlineFreeEnergyEstimator
+from stringmethod.utils import adaptive_swarms, periodicity, templates
 from stringmethod.utils.custom import custom_function
 from stringmethod.utils.scaling import MinMaxScaler
 
+from simulations import convergence, scheduler
 from simulations.gmx_jobs import *
 
+# ld-seed of the shared swarm tpr files, replaced with a random seed in the copy of every swarm
+_SWARM_SEED_SENTINEL = 0x5EED5EED5EED5EED
+
+
+def _get_random_seeds(n: int) -> List[int]:
+    """
+    :return: n random seeds for the swarms, positive and within the range of the 32 bit seeds of gromacs
+    """
+    return np.random.default_rng().integers(1, 2**31, size=n).tolist()
+
 
 @dataclass
 class StringIterationRunner(object):
@@ -32,6 +48,44 @@ class StringIterationRunner(object):
     # gpus_per_node: Optional[int] = None
     use_function: Optional[bool] = False
     use_plumed: Optional[bool] = False
+    pipelined: Optional[bool] = False
+    pipeline_cores_per_simulation: Optional[int] = 1
+    io_workers: Optional[int] = 16
+    postprocessing_dir: Optional[str] = "postprocessing"
+    online_free_energy: Optional[bool] = False
+    online_n_grid_points: Optional[int] = 30
+    """Period of every CV, None for non-periodic CVs"""
+    cv_periods: Optional[tuple] = None
+    """
+    Run grompp once per bead and give every swarm a copy of the tpr file with its own random seed
+    """
+    shared_swarm_tpr: Optional[bool] = False
+    """Fraction of the swarms of every bead which have to finish for the drift to be computed"""
+    swarm_quorum: Optional[float] = 1.0
+    """
+    Target standard error of the drift of every bead, relative to the range of the CVs along the string.
+    If set, swarm_size swarms are run first and more swarms are added to the beads above the target
+    """
+    swarm_drift_error: Optional[float] = None
+    """Maximum number of swarms of a bead when adding swarms. 4 times swarm_size if None"""
+    max_swarm_size: Optional[int] = None
+    """
+    Stop once the running average of the last convergence_window strings changed less than this
+    in convergence_patience consecutive iterations. Never stop early if None
+    """
+    convergence_threshold: Optional[float] = None
+    convergence_window: Optional[int] = 5
+    convergence_patience: Optional[int] = 3
+    """Set when the iterations stopped because the string converged"""
+    converged: Optional[bool] = False
+    _convergence_monitor: Optional[convergence.ConvergenceMonitor] = None
+    _online_estimator: Optional[OnlineFreeEnergyEstimator] = None
+    """Running grompps of the next iteration's restrained simulations"""
+    _prefetched_grompps: Optional[list] = None
+
+    def __post_init__(self):
+        if self.shared_swarm_tpr and not self._can_share_swarm_tpr():
+            self.shared_swarm_tpr = False
 
     def run(self):
 
@@ -39,10 +93,25 @@ class StringIterationRunner(object):
             if os.path.isfile(self._get_string_filepath(self.iteration)):
                 self.iteration += 1
                 continue
+            if self._get_convergence_monitor().is_converged():
+                logger.info(
+                    "The string converged before iteration %s. Stopping",
+                    self.iteration,
+                )
+                self.converged = True
+                break
             self._init()
-            self._run_restrained()
-            self._run_swarms()
-            self._compute_new_string()
+            if self.pipelined:
+                self._run_pipelined()
+            else:
+                self._run_restrained()
+                self._run_swarms()
+            if self.swarm_drift_error is not None and self.swarm_size > 0:
+                self._run_adaptive_swarms()
+            endpoints = self._load_swarm_endpoints() if self.swarm_size > 0 else None
+            self._compute_new_string(endpoints)
+            if self.online_free_energy and endpoints is not None:
+                self._update_online_free_energy(endpoints)
             self.iteration += 1
 
     def _init(self):
@@ -68,6 +137,28 @@ class StringIterationRunner(object):
         return True
 
     def _run_restrained(self):
+        self._wait_for_prefetched_grompps()
+        self._create_restrained_input_files()
+        grompp_tasks, mdrun_tasks = [], []
+        for point_idx, point in enumerate(self.string):
+            if self.fixed_endpoints and point_idx in [
+                0,
+                self.string.shape[0] - 1,
+            ]:
+                continue
+            grompp_args, mdrun_args = self._create_restrained_tasks(point_idx, point)
+            if grompp_args is not None:
+                grompp_tasks.append(("grompp", grompp_args))
+            if mdrun_args is not None:
+                mdrun_tasks.append(("mdrun", mdrun_args))
+        gmx_jobs.submit(tasks=grompp_tasks, step="restrained_grompp")
+        gmx_jobs.submit(tasks=mdrun_tasks, step="restrained_mdrun")
+
+    def _run_swarms(self):
+        if self.use_plumed:
+            self._create_swarm_plumed_files()
+        if self.shared_swarm_tpr:
+            self._create_shared_swarm_mdp_file()
         grompp_tasks, mdrun_tasks = [], []
         for point_idx, point in enumerate(self.string):
             if self.fixed_endpoints and point_idx in [
@@ -75,38 +166,203 @@ class StringIterationRunner(object):
                 self.string.shape[0] - 1,
             ]:
                 continue
-            string_restraints = dict()
-            for cv_idx, position in enumerate(point):
-                string_restraints["pull-coord{}-init".format(cv_idx + 1)] = position
-            mdp_file = self._create_restrained_mdp_file(point_idx, string_restraints)
             if self.use_plumed:
-                plumed_file = self._create_restrained_plumed_file(
-                    point_idx, string_restraints
-                )
+                plumed_file = self._get_restrained_plumed_filepath(point_idx)
             else:
                 plumed_file = None
-            output_dir = abspath(
-                "{}/{}/{}/restrained/".format(self.md_dir, self.iteration, point_idx)
+            point_grompp_args, point_mdrun_args = self._create_swarm_tasks(
+                point_idx, plumed_file
             )
-            tpr_file = abspath("{}/topol.tpr".format(output_dir))
-            if os.path.isfile(tpr_file):
-                logger.debug(
-                    "File %s already exists. Not running grompp again",
-                    tpr_file,
+            grompp_tasks += [("grompp", args) for args in point_grompp_args]
+            mdrun_tasks += [("mdrun", args) for args in point_mdrun_args]
+        gmx_jobs.submit(tasks=grompp_tasks, step="swarms_grompp")
+        if self.shared_swarm_tpr:
+            for point_idx in self._get_moving_points():
+                self._create_shared_swarm_tprs(point_idx)
+        self._prefetch_next_restrained_grompps()
+        gmx_jobs.submit(tasks=mdrun_tasks, step="swarms_mdrun")
+
+    def _run_adaptive_swarms(self):
+        """
+        Adds swarms to the beads whose drift has a larger standard error than swarm_drift_error,
+        until all beads reach the target or max_swarm_size swarms.
+        The new swarms get the next free indices, so the directory layout stays the same.
+        """
+        max_swarm_size = self.max_swarm_size or 4 * self.swarm_size
+        periods = periodicity.get_periods(self.cv_periods, self.string.shape[1])
+        scaler = MinMaxScaler(periods=periods)
+        scaler.fit(periodicity.unwrap_path(self.string, periods))
+        moving_points = self._get_moving_points()
+        while True:
+            endpoints, _ = self._read_swarm_endpoints(strict=False)
+            _, displacements = self._get_swarm_displacements(endpoints)
+            n_swarms = np.array([self._get_swarm_count(p) for p in moving_points])
+            n_valid = np.sum(np.all(np.isfinite(displacements), axis=2), axis=1)
+            standard_error = adaptive_swarms.get_drift_standard_error(
+                displacements, scaler.scale
+            )
+            required = adaptive_swarms.get_required_swarm_sizes(
+                n_swarms,
+                n_valid,
+                standard_error,
+                self.swarm_drift_error,
+                max_swarm_size,
+            )
+            logger.info(
+                "Standard error of the drift of every bead in iteration %s: %s",
+                self.iteration,
+                standard_error,
+            )
+            if np.all(required == n_swarms):
+                logger.info(
+                    "Ran %s swarms in iteration %s, %s to %s per bead",
+                    n_swarms.sum(),
+                    self.iteration,
+                    n_swarms.min(),
+                    n_swarms.max(),
+                )
+                return
+            for point_idx, n, n_required in zip(moving_points, n_swarms, required):
+                for swarm_idx in range(n, n_required):
+                    os.makedirs(
+                        "{}/{}/{}/s{}".format(
+                            self.md_dir, self.iteration, point_idx, swarm_idx
+                        ),
+                        exist_ok=True,
+                    )
+            logger.info(
+                "Adding %s swarms to %s beads above the target error %s",
+                (required - n_swarms).sum(),
+                np.count_nonzero(required > n_swarms),
+                self.swarm_drift_error,
+            )
+            self._run_swarms()
+
+    def _get_swarm_count(self, point_idx: int) -> int:
+        """The number of swarms of a bead in this iteration, including those added in adaptive mode"""
+        n_swarms = self.swarm_size
+        while os.path.isdir(
+            "{}/{}/{}/s{}".format(self.md_dir, self.iteration, point_idx, n_swarms)
+        ):
+            n_swarms += 1
+        return n_swarms
+
+    def _run_pipelined(self):
+        """
+        Run the restrained and swarm simulations of all beads with a dependency driven scheduler.
+        The swarms of a bead start as soon as its restrained simulation has finished,
+        regardless of the state of the other beads.
+        """
+        n_cores = scheduler.available_cores()
+        cores_per_simulation = min(self.pipeline_cores_per_simulation, n_cores)
+        pipeline = scheduler.PipelineScheduler(n_cores=n_cores)
+        self._wait_for_prefetched_grompps()
+        self._create_restrained_input_files()
+        if self.shared_swarm_tpr:
+            self._create_shared_swarm_mdp_file()
+        for point_idx, point in enumerate(self.string):
+            if self.fixed_endpoints and point_idx in [
+                0,
+                self.string.shape[0] - 1,
+            ]:
+                continue
+            restrained_grompp_step = "restrained_grompp_point{}".format(point_idx)
+            restrained_mdrun_step = "restrained_mdrun_point{}".format(point_idx)
+            grompp_args, mdrun_args = self._create_restrained_tasks(point_idx, point)
+            if grompp_args is not None:
+                pipeline.add(
+                    scheduler.ScheduledTask(
+                        name=restrained_grompp_step, tasks=[("grompp", grompp_args)]
+                    )
+                )
+            if mdrun_args is not None:
+                mdrun_args["n_cpu"] = cores_per_simulation
+                pipeline.add(
+                    scheduler.ScheduledTask(
+                        name=restrained_mdrun_step,
+                        tasks=[("mdrun", mdrun_args)],
+                        n_cores=cores_per_simulation,
+                        dependencies=[restrained_grompp_step],
+                    )
+                )
+            restrained_confout = abspath(
+                "{}/{}/{}/restrained/confout.gro".format(
+                    self.md_dir, self.iteration, point_idx
                 )
+            )
+            if self.use_plumed:
+                plumed_file = self._get_restrained_plumed_filepath(point_idx)
             else:
-                in_file = abspath(
-                    "{}/{}/{}/restrained/confout.gro".format(
-                        self.md_dir, self.iteration - 1, point_idx
+                plumed_file = None
+            swarm_grompp_args, swarm_mdrun_args = self._create_swarm_tasks(
+                point_idx, plumed_file
+            )
+            swarm_grompp_steps = []
+            for args in swarm_grompp_args:
+                step = "swarms_grompp_point{}_{}".format(
+                    point_idx, os.path.basename(os.path.dirname(args["tpr_file"]))
+                )
+                pipeline.add(
+                    scheduler.ScheduledTask(
+                        name=step,
+                        tasks=[("grompp", args)],
+                        dependencies=[restrained_mdrun_step],
+                        required_files=[restrained_confout],
                     )
                 )
-                if not os.path.exists(in_file):
-                    raise IOError(
-                        "File {} does not exist. Cannot continue string MD. Check the logs for errors".format(
-                            in_file
-                        )
+                swarm_grompp_steps.append(step)
+            if swarm_mdrun_args:
+                swarm_cores = min(cores_per_simulation * len(swarm_mdrun_args), n_cores)
+                for args in swarm_mdrun_args:
+                    args["n_cpu"] = swarm_cores
+                pipeline.add(
+                    scheduler.ScheduledTask(
+                        name="swarms_mdrun_point{}".format(point_idx),
+                        tasks=[("mdrun", args) for args in swarm_mdrun_args],
+                        n_cores=swarm_cores,
+                        dependencies=[restrained_mdrun_step] + swarm_grompp_steps,
+                        required_files=[restrained_confout],
+                        prepare=partial(self._prepare_swarms, point_idx),
                     )
-                grompp_args = dict(
+                )
+        pipeline.run()
+
+    def _prefetch_next_restrained_grompps(self):
+        """
+        Starts the grompps of the next iteration's restrained simulations in the background, so that they run
+        while this iteration's swarms do.
+        Only possible with plumed, since the restraints are then not part of the tpr file and the next string is not needed.
+        """
+        if not self.use_plumed:
+            logger.info(
+                "Not preparing the restrained simulations of iteration %s in advance, since their restraints are part of the mdp file and depend on the next string",
+                self.iteration + 1,
+            )
+            return
+        if (
+            self.iteration >= self.max_iterations
+            or self._prefetched_grompps is not None
+        ):
+            return
+        next_iteration = self.iteration + 1
+        grompp_tasks = []
+        for point_idx in self._get_moving_points():
+            output_dir = abspath(
+                "{}/{}/{}/restrained/".format(self.md_dir, next_iteration, point_idx)
+            )
+            tpr_file = abspath("{}/topol.tpr".format(output_dir))
+            in_file = abspath(
+                "{}/{}/{}/restrained/confout.gro".format(
+                    self.md_dir, self.iteration, point_idx
+                )
+            )
+            if os.path.isfile(tpr_file) or not os.path.isfile(in_file):
+                continue
+            os.makedirs(output_dir, exist_ok=True)
+            mdp_file = "{}/restrained.mdp".format(output_dir)
+            templates.write_if_changed(mdp_file, self._render_mdp({}))
+            grompp_tasks.append(
+                dict(
                     mdp_file=mdp_file,
                     index_file="{}/index.ndx".format(self.topology_dir),
                     topology_file="{}/topol.top".format(self.topology_dir),
@@ -115,8 +371,113 @@ class StringIterationRunner(object):
                     mdp_output_file="{}/mdout.mdp".format(output_dir),
                     grompp_options=self.grompp_options,
                 )
-                grompp_tasks.append(("grompp", grompp_args))
-            # SPC Pick up checkpoint files if available
+            )
+        if grompp_tasks:
+            logger.info(
+                "Preparing the restrained simulations of iteration %s while the swarms run",
+                next_iteration,
+            )
+            self._prefetched_grompps = mdtools.get_grompp_service().submit(grompp_tasks)
+
+    def _wait_for_prefetched_grompps(self):
+        if self._prefetched_grompps is None:
+            return
+        for future in self._prefetched_grompps:
+            try:
+                future.result()
+            except IOError as ex:
+                # The missing tpr file is created again with the other restrained grompps
+                logger.warning("Preparing a restrained simulation failed: %s", ex)
+        self._prefetched_grompps = None
+        logger.info("Finished with step restrained_grompp_prefetch.")
+
+    def _create_restrained_tasks(
+        self, point_idx: int, point: np.array
+    ) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        The input files have to be written with _create_restrained_input_files first
+        :return: the grompp and mdrun arguments, or None for the steps which are already done
+        """
+        mdp_file = self._get_restrained_mdp_filepath(point_idx)
+        if self.use_plumed:
+            plumed_file = self._get_restrained_plumed_filepath(point_idx)
+        else:
+            plumed_file = None
+        output_dir = abspath(
+            "{}/{}/{}/restrained/".format(self.md_dir, self.iteration, point_idx)
+        )
+        tpr_file = abspath("{}/topol.tpr".format(output_dir))
+        grompp_args, mdrun_args = None, None
+        if os.path.isfile(tpr_file):
+            logger.debug(
+                "File %s already exists. Not running grompp again",
+                tpr_file,
+            )
+        else:
+            in_file = abspath(
+                "{}/{}/{}/restrained/confout.gro".format(
+                    self.md_dir, self.iteration - 1, point_idx
+                )
+            )
+            if not os.path.exists(in_file):
+                raise IOError(
+                    "File {} does not exist. Cannot continue string MD. Check the logs for errors".format(
+                        in_file
+                    )
+                )
+            grompp_args = dict(
+                mdp_file=mdp_file,
+                index_file="{}/index.ndx".format(self.topology_dir),
+                topology_file="{}/topol.top".format(self.topology_dir),
+                structure_file=in_file,
+                tpr_file=tpr_file,
+                mdp_output_file="{}/mdout.mdp".format(output_dir),
+                grompp_options=self.grompp_options,
+            )
+        # SPC Pick up checkpoint files if available
+        check_point_file = abspath("{}/state.cpt".format(output_dir))
+        if not os.path.isfile(check_point_file):
+            check_point_file = None
+        mdrun_confout = "{}/confout.gro".format(output_dir)
+        if os.path.isfile(mdrun_confout):
+            logger.debug(
+                "File %s already exists. Not running mdrun again",
+                mdrun_confout,
+            )
+        else:
+            # Pick up checkpoint files if available
+            mdrun_args = dict(
+                output_dir=output_dir,
+                tpr_file=tpr_file,
+                check_point_file=check_point_file,
+                mdrun_options=self.mdrun_options_restrained,
+                # gpus_per_node=self.gpus_per_node,
+                plumed_file=plumed_file,
+            )
+        return grompp_args, mdrun_args
+
+    def _create_swarm_tasks(
+        self, point_idx: int, plumed_file: Optional[str]
+    ) -> Tuple[List[dict], List[dict]]:
+        """
+        :return: the grompp and mdrun arguments of the swarms of a bead which have not been run yet
+        """
+        grompp_tasks, mdrun_tasks = [], []
+        for swarm_idx in range(self._get_swarm_count(point_idx)):
+            output_dir = abspath(
+                "{}/{}/{}/s{}/".format(
+                    self.md_dir, self.iteration, point_idx, swarm_idx
+                )
+            )
+            tpr_file = abspath("{}/topol.tpr".format(output_dir))
+            if os.path.isfile(tpr_file):
+                logger.debug(
+                    "File %s already exists. Not running grompp again",
+                    tpr_file,
+                )
+            else:
+                grompp_tasks.append(self._get_swarm_grompp_args(point_idx, swarm_idx))
+            # Pick up checkpoint files if available
             check_point_file = abspath("{}/state.cpt".format(output_dir))
             if not os.path.isfile(check_point_file):
                 check_point_file = None
@@ -127,129 +488,219 @@ class StringIterationRunner(object):
                     mdrun_confout,
                 )
             else:
-                # Pick up checkpoint files if available
+                # SPC Pick up checkpoint files if available
                 mdrun_args = dict(
                     output_dir=output_dir,
                     tpr_file=tpr_file,
                     check_point_file=check_point_file,
-                    mdrun_options=self.mdrun_options_restrained,
+                    mdrun_options=self.mdrun_options_swarms,
                     # gpus_per_node=self.gpus_per_node,
                     plumed_file=plumed_file,
+                    # Called if the swarm is stopped as a straggler and run again
+                    reseed=partial(self._reseed_swarm, point_idx, swarm_idx),
                 )
-                mdrun_tasks.append(("mdrun", mdrun_args))
-        gmx_jobs.submit(tasks=grompp_tasks, step="restrained_grompp")
-        gmx_jobs.submit(tasks=mdrun_tasks, step="restrained_mdrun")
+                mdrun_tasks.append(mdrun_args)
+        if self.shared_swarm_tpr and grompp_tasks:
+            # The tpr files of the swarms are copied from the shared one once it exists
+            grompp_tasks = self._get_shared_swarm_grompp_tasks(point_idx)
+        return grompp_tasks, mdrun_tasks
 
-    def _run_swarms(self):
-        grompp_tasks, mdrun_tasks = [], []
-        for point_idx, point in enumerate(self.string):
-            if self.fixed_endpoints and point_idx in [
-                0,
-                self.string.shape[0] - 1,
-            ]:
-                continue
-            for swarm_idx in range(self.swarm_size):
-                mdp_file = abspath("{}/swarms.mdp".format(self.mdp_dir))
-                if self.use_plumed:
-                    plumed_file = self._create_restrained_plumed_file(point_idx, {})
-                else:
-                    plumed_file = None
-                output_dir = abspath(
-                    "{}/{}/{}/s{}/".format(
-                        self.md_dir, self.iteration, point_idx, swarm_idx
-                    )
+    def _get_swarm_grompp_args(
+        self, point_idx: int, swarm_idx: int, tpr_file: Optional[str] = None
+    ) -> dict:
+        """
+        :param tpr_file: the output tpr file. By default the one in the swarm's directory
+        """
+        output_dir = abspath(
+            "{}/{}/{}/s{}/".format(self.md_dir, self.iteration, point_idx, swarm_idx)
+        )
+        return dict(
+            mdp_file=abspath("{}/swarms.mdp".format(self.mdp_dir)),
+            index_file="{}/index.ndx".format(self.topology_dir),
+            topology_file="{}/topol.top".format(self.topology_dir),
+            structure_file=abspath(
+                "{}/{}/{}/restrained/confout.gro".format(
+                    self.md_dir, self.iteration, point_idx
                 )
-                tpr_file = abspath("{}/topol.tpr".format(output_dir))
-                if os.path.isfile(tpr_file):
-                    logger.debug(
-                        "File %s already exists. Not running grompp again",
-                        tpr_file,
-                    )
-                else:
-                    grompp_args = dict(
-                        mdp_file=mdp_file,
-                        index_file="{}/index.ndx".format(self.topology_dir),
-                        topology_file="{}/topol.top".format(self.topology_dir),
-                        structure_file=abspath(
-                            "{}/{}/{}/restrained/confout.gro".format(
-                                self.md_dir, self.iteration, point_idx
-                            )
-                        ),
-                        tpr_file=tpr_file,
-                        mdp_output_file="{}/mdout.mdp".format(output_dir),
-                        grompp_options=self.grompp_options,
-                    )
-                    grompp_tasks.append(("grompp", grompp_args))
-                # Pick up checkpoint files if available
-                check_point_file = abspath("{}/state.cpt".format(output_dir))
-                if not os.path.isfile(check_point_file):
-                    check_point_file = None
-                mdrun_confout = "{}/confout.gro".format(output_dir)
-                if os.path.isfile(mdrun_confout):
-                    logger.debug(
-                        "File %s already exists. Not running mdrun again",
-                        mdrun_confout,
-                    )
-                else:
-                    # SPC Pick up checkpoint files if available
-                    mdrun_args = dict(
-                        output_dir=output_dir,
-                        tpr_file=tpr_file,
-                        check_point_file=check_point_file,
-                        mdrun_options=self.mdrun_options_swarms,
-                        # gpus_per_node=self.gpus_per_node,
-                        plumed_file=plumed_file,
-                    )
-                    mdrun_tasks.append(("mdrun", mdrun_args))
-        gmx_jobs.submit(tasks=grompp_tasks, step="swarms_grompp")
-        gmx_jobs.submit(tasks=mdrun_tasks, step="swarms_mdrun")
+            ),
+            tpr_file=tpr_file or abspath("{}/topol.tpr".format(output_dir)),
+            mdp_output_file="{}/mdout.mdp".format(output_dir),
+            grompp_options=self.grompp_options,
+        )
+
+    def _get_shared_swarm_grompp_tasks(self, point_idx: int) -> List[dict]:
+        shared_tpr_file = self._get_shared_swarm_tpr_filepath(point_idx)
+        if os.path.isfile(shared_tpr_file):
+            logger.debug(
+                "File %s already exists. Not running grompp again",
+                shared_tpr_file,
+            )
+            return []
+        grompp_args = self._get_swarm_grompp_args(
+            point_idx, 0, tpr_file=shared_tpr_file
+        )
+        grompp_args["mdp_file"] = self._get_shared_swarm_mdp_filepath()
+        grompp_args["mdp_output_file"] = abspath(
+            "{}/{}/{}/swarms_mdout.mdp".format(self.md_dir, self.iteration, point_idx)
+        )
+        return [grompp_args]
+
+    def _create_shared_swarm_mdp_file(self):
+        """Writes the swarm mdp file with a recognizable random seed, the same for all beads"""
+        template = templates.load_template(
+            templates.MdpTemplate, "{}/swarms.mdp".format(self.mdp_dir)
+        )
+        templates.write_if_changed(
+            self._get_shared_swarm_mdp_filepath(),
+            template.render({"ld-seed": _SWARM_SEED_SENTINEL}),
+        )
+
+    def _create_shared_swarm_tprs(self, point_idx: int):
+        """
+        Copies the shared tpr file of a bead to the swarms which do not have a tpr file yet,
+        each copy with its own random seed.
+        Falls back to running grompp for every swarm if the seed cannot be found in the shared tpr file.
+        """
+        swarm_indices = [
+            swarm_idx
+            for swarm_idx in range(self._get_swarm_count(point_idx))
+            if not os.path.isfile(
+                "{}/{}/{}/s{}/topol.tpr".format(
+                    self.md_dir, self.iteration, point_idx, swarm_idx
+                )
+            )
+        ]
+        if len(swarm_indices) == 0:
+            return
+        shared_tpr_file = self._get_shared_swarm_tpr_filepath(point_idx)
+        if not os.path.isfile(shared_tpr_file):
+            raise IOError(
+                "File {} does not exist. Check the logs for errors".format(
+                    shared_tpr_file
+                )
+            )
+        tpr_files = [
+            abspath(
+                "{}/{}/{}/s{}/topol.tpr".format(
+                    self.md_dir, self.iteration, point_idx, swarm_idx
+                )
+            )
+            for swarm_idx in swarm_indices
+        ]
+        seeds = _get_random_seeds(len(tpr_files))
+        if mdtools.copy_tpr_with_seeds(
+            shared_tpr_file, tpr_files, _SWARM_SEED_SENTINEL, seeds
+        ):
+            logger.debug(
+                "Copied %s to %s swarms with seeds %s",
+                shared_tpr_file,
+                len(tpr_files),
+                seeds,
+            )
+            return
+        logger.warning(
+            "Could not find the random seed in %s. Running grompp for every swarm of point %s instead",
+            shared_tpr_file,
+            point_idx,
+        )
+        gmx_jobs.submit(
+            tasks=[
+                ("grompp", self._get_swarm_grompp_args(point_idx, swarm_idx))
+                for swarm_idx in swarm_indices
+            ],
+            step="swarms_grompp_point{}".format(point_idx),
+        )
+
+    def _reseed_swarm(self, point_idx: int, swarm_idx: int):
+        """
+        Removes the output of a swarm and replaces its tpr file with one with a new random seed,
+        so that the swarm can be run again from scratch
+        """
+        output_dir = abspath(
+            "{}/{}/{}/s{}/".format(self.md_dir, self.iteration, point_idx, swarm_idx)
+        )
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if entry.is_file() or entry.is_symlink():
+                    os.remove(entry.path)
+        tpr_file = abspath("{}/topol.tpr".format(output_dir))
+        shared_tpr_file = self._get_shared_swarm_tpr_filepath(point_idx)
+        seed = _get_random_seeds(1)[0]
+        if (
+            self.shared_swarm_tpr
+            and os.path.isfile(shared_tpr_file)
+            and mdtools.copy_tpr_with_seeds(
+                shared_tpr_file, [tpr_file], _SWARM_SEED_SENTINEL, [seed]
+            )
+        ):
+            logger.info("Relaunching swarm %s with seed %s", output_dir, seed)
+            return
+        template = templates.load_template(
+            templates.MdpTemplate, "{}/swarms.mdp".format(self.mdp_dir)
+        )
+        grompp_args = self._get_swarm_grompp_args(point_idx, swarm_idx)
+        grompp_args["mdp_file"] = "{}/swarms.mdp".format(output_dir)
+        templates.write_if_changed(
+            grompp_args["mdp_file"],
+            template.render({"ld-seed": seed, "gen-seed": seed}),
+        )
+        logger.info("Relaunching swarm %s with seed %s", output_dir, seed)
+        mdtools.get_grompp_service().run([grompp_args])
+
+    def _prepare_swarms(self, point_idx: int):
+        """Writes the input files of a bead's swarms which depend on the output of its restrained simulation"""
+        if self.use_plumed:
+            # The swarm plumed file replaces the restrained one,
+            # so it can only be written once the restrained simulation is done
+            self._create_restrained_plumed_file(point_idx, {})
+        if self.shared_swarm_tpr:
+            self._create_shared_swarm_tprs(point_idx)
+
+    def _can_share_swarm_tpr(self) -> bool:
+        """
+        The copies of a shared tpr file only differ in ld-seed, so the swarms of a bead only diverge
+        with a stochastic integrator and without generated velocities, which would be the same for all swarms
+        :return: False, with a warning, if the swarm settings would make the swarms of a bead identical
+        """
+        mdp_file = "{}/swarms.mdp".format(self.mdp_dir)
+        if not os.path.isfile(mdp_file):
+            return True
+        mdp_options = {
+            k.lower().replace("_", "-"): str(v).strip().lower()
+            for k, v in utils.parse_mdp(mdp_file).items()
+        }
+        if mdp_options.get("gen-vel", "no") == "yes":
+            logger.warning(
+                "gen-vel is set in %s. Not using shared_swarm_tpr, since all swarms of a bead would start with the same velocities",
+                mdp_file,
+            )
+            return False
+        if mdp_options.get("integrator", "md") not in ["sd", "bd"]:
+            logger.warning(
+                "The integrator in %s is not stochastic (sd or bd). Not using shared_swarm_tpr, since the swarms of a bead might not diverge",
+                mdp_file,
+            )
+            return False
+        return True
 
-    def _compute_new_string(self) -> bool:
+    def _compute_new_string(self, endpoints: Optional[np.array] = None) -> bool:
+        """
+        :param endpoints: the swarms' endpoints as returned by _load_swarm_endpoints. Loaded if not given
+        """
         drifted_string = self.string.copy()
-        n_cvs = self.string.shape[1]
+        periods = periodicity.get_periods(self.cv_periods, self.string.shape[1])
         if self.swarm_size > 0:
-            for point_idx, point in enumerate(self.string):
-                if self.fixed_endpoints and point_idx in [
-                    0,
-                    self.string.shape[0] - 1,
-                ]:
-                    continue
-                swarm_drift = np.empty((self.swarm_size, n_cvs))
-                for swarm_idx in range(self.swarm_size):
-                    output_dir = abspath(
-                        "{}/{}/{}/s{}/".format(
-                            self.md_dir, self.iteration, point_idx, swarm_idx
-                        )
-                    )
-                    if not self.use_plumed:
-                        pull_xvg_out = "{}/pullx.xvg".format(output_dir)
-                        data = mdtools.load_xvg(file_name=pull_xvg_out)
-                        # Skip first column which contains the time and exclude any columns which come after the CVs
-                        # This could be e.g. other restraints not part of the CV set
-                    else:
-                        pull_out = "{}/colvar".format(output_dir)
-                        data_lines = [
-                            line
-                            for line in open(pull_out)
-                            if not line.startswith("#")
-                            and len(line.split()) == n_cvs + 1
-                        ]
-                        data = np.array(
-                            [[float(x) for x in line.split()] for line in data_lines]
-                        )
-                    data = data[:, 1 : (n_cvs + 1)]
-                    if self.use_function:
-                        data = custom_function(data)
-                    if swarm_idx == 0:
-                        # Set the actual start coordinates here, in case they differ from the reference values
-                        # Can happen due to e.g. a too weak potential
-                        drifted_string[point_idx] = data[0]
-                    swarm_drift[swarm_idx] = data[-1] - drifted_string[point_idx]
-                drift = swarm_drift.mean(axis=0)
-                drifted_string[point_idx] += drift
+            if endpoints is None:
+                endpoints = self._load_swarm_endpoints()
+            start_coordinates, displacements = self._get_swarm_displacements(endpoints)
+            drifted_string[self._get_moving_points()] = start_coordinates + np.nanmean(
+                displacements, axis=1
+            )
+        # Follow the string across periodic boundaries, so that it can be handled like a non-periodic string
+        drifted_string = periodicity.unwrap_path(drifted_string, periods)
         # scale CVs
         # This is required to emphasize both small scale and large scale displacements
-        scaler = MinMaxScaler()
+        scaler = MinMaxScaler(periods=periods)
         scaled_string = scaler.fit_transform(drifted_string)
         # TODO better scaling, let user control it via config
         new_scaled_string = utils.reparametrize_path_iter(
@@ -258,83 +709,315 @@ class StringIterationRunner(object):
             arclength_weight=None,
         )
         new_string = scaler.inverse_transform(new_scaled_string)
-        np.savetxt(self._get_string_filepath(self.iteration), new_string)
+        np.savetxt(
+            self._get_string_filepath(self.iteration),
+            periodicity.wrap(new_string, periods),
+        )
 
         # Compute convergence
-        # Note that this convergence does not take periodic boundary conditions into account.
-        # To handle that you need to compute your own metric. See the alanine dipeptide example
-        scaled_current_string = scaler.transform(self.string)
-        mean_norm = (
-            np.linalg.norm(new_scaled_string) + np.linalg.norm(scaled_current_string)
-        ) / 2
-        convergence = (
-            np.linalg.norm(new_scaled_string - scaled_current_string) / mean_norm
+        string_convergence, displacements = convergence.compare_strings(
+            self.string, new_string, scaler, periods
         )
         logger.info(
             "Convergence between iteration %s and %s: %s",
             self.iteration - 1,
             self.iteration,
-            convergence,
+            string_convergence,
+        )
+        self._get_convergence_monitor().add(
+            self.iteration, string_convergence, displacements
         )
         return True
 
+    def _get_swarm_displacements(
+        self, endpoints: np.array
+    ) -> Tuple[np.array, np.array]:
+        """
+        :param endpoints: as returned by _load_swarm_endpoints
+        :return: the start coordinates of every moving bead and the displacement of all its swarms,
+        in the CVs of the string. Displacements of swarms which are NaN in endpoints are NaN
+        """
+        endpoints = self._transform_endpoints(endpoints)
+        periods = periodicity.get_periods(self.cv_periods, self.string.shape[1])
+        moving_points = self._get_moving_points()
+        # Set the actual start coordinates here, in case they differ from the reference values
+        # Can happen due to e.g. a too weak potential
+        # Beads may have fewer swarms than others or excluded swarms, so take them from the first valid swarm
+        valid_swarms = np.all(np.isfinite(endpoints[moving_points]), axis=(2, 3))
+        start_coordinates = endpoints[moving_points, valid_swarms.argmax(axis=1), 0]
+        displacements = periodicity.minimum_image(
+            endpoints[moving_points, :, 1] - start_coordinates[:, np.newaxis],
+            periods,
+        )
+        return start_coordinates, displacements
+
+    def _update_online_free_energy(self, endpoints: np.array):
+        """
+        Adds the transitions of this iteration's swarms to the online free energy estimate and persists it.
+        Like the CV store of the postprocessing, the estimate uses the CV values written by the simulations
+        :param endpoints: as returned by _load_swarm_endpoints
+        """
+        if self._online_estimator is None:
+            self._online_estimator = OnlineFreeEnergyEstimator(
+                postprocessing_dir=self.postprocessing_dir,
+                n_grid_points=self.online_n_grid_points,
+                cv_periods=self.cv_periods,
+            )
+        transitions = endpoints[self._get_moving_points()].reshape(
+            (-1,) + endpoints.shape[2:]
+        )
+        try:
+            self._online_estimator.add_transitions(self.iteration, transitions)
+        except ValueError as ex:
+            logger.warning("Disabling the online free energy estimate: %s", ex)
+            self.online_free_energy = False
+            return
+        self._online_estimator.run()
+        self._online_estimator.persist()
+
+    def _load_swarm_endpoints(self) -> np.array:
+        """
+        Reads the output of all swarms in parallel
+        :return: an array of shape (beads, swarms, 2, CVs) with the CV values in the first and last frame of every swarm,
+        as written by the simulations, i.e. not transformed by custom_function. The entries of fixed endpoints, of swarms excluded by the quorum
+        and of swarms beyond the number of swarms of a bead are NaN.
+        """
+        endpoints, excluded = self._read_swarm_endpoints(strict=self.swarm_quorum == 1)
+        if excluded:
+            self._exclude_swarms(excluded)
+        return endpoints
+
+    def _read_swarm_endpoints(
+        self, strict: bool
+    ) -> Tuple[np.array, List[Tuple[int, int]]]:
+        """
+        :param strict: raise an exception if the output of a swarm cannot be read,
+        instead of leaving out swarms which did not finish
+        :return: the endpoints as in _load_swarm_endpoints and the swarms which were left out
+        """
+        n_cvs = self.string.shape[1]
+        swarm_counts = {p: self._get_swarm_count(p) for p in self._get_moving_points()}
+        endpoints = np.full(
+            (
+                self.string.shape[0],
+                max(swarm_counts.values(), default=self.swarm_size),
+                2,
+                n_cvs,
+            ),
+            np.nan,
+        )
+
+        def load(point_idx: int, swarm_idx: int) -> bool:
+            """:return: False if the swarm is excluded from the drift"""
+            output_dir = abspath(
+                "{}/{}/{}/s{}/".format(
+                    self.md_dir, self.iteration, point_idx, swarm_idx
+                )
+            )
+            if not strict and not os.path.isfile("{}/confout.gro".format(output_dir)):
+                return False
+            try:
+                # Only the first and last frame are needed
+                if not self.use_plumed:
+                    pull_xvg_out = "{}/pullx.xvg".format(output_dir)
+                    data = mdtools.load_xvg_endpoints(file_name=pull_xvg_out)
+                else:
+                    pull_out = "{}/colvar".format(output_dir)
+                    data = mdtools.load_xvg_endpoints(
+                        file_name=pull_out, n_columns=n_cvs + 1
+                    )
+            except (IOError, ValueError, IndexError) as ex:
+                if strict:
+                    raise
+                logger.warning("Could not read the output in %s: %s", output_dir, ex)
+                return False
+            # Skip first column which contains the time and exclude any columns which come after the CVs
+            # This could be e.g. other restraints not part of the CV set
+            endpoints[point_idx, swarm_idx] = data[:, 1 : (n_cvs + 1)]
+            return True
+
+        swarms = [
+            (point_idx, swarm_idx)
+            for point_idx, n_swarms in swarm_counts.items()
+            for swarm_idx in range(n_swarms)
+        ]
+        with ThreadPoolExecutor(max_workers=self.io_workers) as pool:
+            # Iterate over the results to propagate exceptions
+            loaded = list(pool.map(lambda swarm: load(*swarm), swarms))
+        return endpoints, [swarm for swarm, ok in zip(swarms, loaded) if not ok]
+
+    def _transform_endpoints(self, endpoints: np.array) -> np.array:
+        """
+        :param endpoints: as returned by _load_swarm_endpoints
+        :return: the endpoints in the CVs of the string, i.e. transformed by custom_function if use_function is set
+        """
+        if not self.use_function:
+            return endpoints
+        # The custom function transforms every row (frame) independently,
+        # so it can be applied to all swarms at once.
+        # It may change its input in place, so it gets a copy to keep the raw endpoints
+        return custom_function(
+            endpoints.reshape((-1, endpoints.shape[-1])).copy()
+        ).reshape(endpoints.shape)
+
+    def _exclude_swarms(self, excluded: List[Tuple[int, int]]):
+        """
+        Checks that every bead has enough finished swarms for the quorum and records the excluded ones.
+        The output files of excluded swarms are renamed, so that postprocessing ignores them.
+        """
+        swarm_counts = {p: self._get_swarm_count(p) for p in self._get_moving_points()}
+        for point_idx, n_swarms in swarm_counts.items():
+            n_finished = n_swarms - sum(1 for p, _ in excluded if p == point_idx)
+            if n_finished < self.swarm_quorum * n_swarms:
+                raise IOError(
+                    "Only {} of {} swarms of point {} in iteration {} finished, fewer than the quorum of {}. Check the logs for errors".format(
+                        n_finished,
+                        n_swarms,
+                        point_idx,
+                        self.iteration,
+                        self.swarm_quorum,
+                    )
+                )
+        for point_idx, swarm_idx in excluded:
+            output_dir = "{}/{}/{}/s{}".format(
+                self.md_dir, self.iteration, point_idx, swarm_idx
+            )
+            for output_file in glob.glob("{}/*.xvg".format(output_dir)) + glob.glob(
+                "{}/colvar".format(output_dir)
+            ):
+                os.replace(output_file, output_file + ".excluded")
+        excluded_file = "{}/{}/excluded_swarms.json".format(self.md_dir, self.iteration)
+        with open(excluded_file, "w") as f:
+            json.dump(
+                [
+                    dict(point=int(point_idx), swarm=int(swarm_idx))
+                    for point_idx, swarm_idx in excluded
+                ],
+                f,
+            )
+        logger.warning(
+            "Excluded %s of %s swarms from the drift of iteration %s. See %s",
+            len(excluded),
+            sum(swarm_counts.values()),
+            self.iteration,
+            excluded_file,
+        )
+
+    def _get_convergence_monitor(self) -> convergence.ConvergenceMonitor:
+        if self._convergence_monitor is None:
+            self._convergence_monitor = convergence.ConvergenceMonitor(
+                string_dir=self.string_dir,
+                window=self.convergence_window,
+                threshold=self.convergence_threshold,
+                patience=self.convergence_patience,
+                cv_periods=self.cv_periods,
+            )
+        return self._convergence_monitor
+
+    def _get_moving_points(self) -> np.array:
+        """Indices of the beads which are updated between iterations"""
+        point_indices = np.arange(self.string.shape[0])
+        if self.fixed_endpoints:
+            point_indices = point_indices[1:-1]
+        return point_indices
+
     def _get_string_filepath(self, iteration: int) -> str:
         return "{}/string{}.txt".format(self.string_dir, iteration)
 
-    def _create_restrained_mdp_file(
+    def _create_restrained_input_files(self):
+        """
+        Renders the mdp and plumed files of all beads' restrained simulations in one batch.
+        Files of steps which are already done are not rendered again.
+        """
+        files = dict()
+        for point_idx in self._get_moving_points():
+            string_restraints = self._get_string_restraints(self.string[point_idx])
+            output_dir = "{}/{}/{}/restrained".format(
+                self.md_dir, self.iteration, point_idx
+            )
+            if not os.path.isfile("{}/topol.tpr".format(output_dir)):
+                files[self._get_restrained_mdp_filepath(point_idx)] = self._render_mdp(
+                    string_restraints
+                )
+            if self.use_plumed and not os.path.isfile(
+                "{}/confout.gro".format(output_dir)
+            ):
+                files[self._get_restrained_plumed_filepath(point_idx)] = (
+                    self._render_plumed(string_restraints)
+                )
+        templates.write_all(files, n_workers=self.io_workers)
+
+    def _create_swarm_plumed_files(self):
+        """
+        Replaces the restrained plumed files of all beads with the unrestrained version used by the swarms.
+        The content is the same for every bead, so it is only rendered once.
+        """
+        content = self._render_plumed({})
+        templates.write_all(
+            {
+                self._get_restrained_plumed_filepath(point_idx): content
+                for point_idx in self._get_moving_points()
+            },
+            n_workers=self.io_workers,
+        )
+
+    def _create_restrained_plumed_file(
         self, point_idx: int, string_restraints: Dict[str, Any]
     ) -> str:
-        mdp_template_file = abspath("{}/{}".format(self.mdp_dir, "restrained.mdp"))
-        mdp_file = abspath(
+        plumed_file = self._get_restrained_plumed_filepath(point_idx)
+        templates.write_if_changed(plumed_file, self._render_plumed(string_restraints))
+        return plumed_file
+
+    def _render_mdp(self, string_restraints: Dict[str, Any]) -> str:
+        template = templates.load_template(
+            templates.MdpTemplate, "{}/restrained.mdp".format(self.mdp_dir)
+        )
+        # With plumed, the restraints are part of the plumed file
+        return template.render({} if self.use_plumed else string_restraints)
+
+    def _render_plumed(self, string_restraints: Dict[str, Any]) -> str:
+        template = templates.load_template(
+            templates.PlumedTemplate, "{}/plumed.dat".format(self.mdp_dir)
+        )
+        return template.render(
+            [
+                string_restraints["pull-coord{}-init".format(n + 1)]
+                for n in range(len(string_restraints.keys()))
+            ]
+        )
+
+    @staticmethod
+    def _get_string_restraints(point: np.array) -> Dict[str, Any]:
+        string_restraints = dict()
+        for cv_idx, position in enumerate(point):
+            string_restraints["pull-coord{}-init".format(cv_idx + 1)] = position
+        return string_restraints
+
+    def _get_shared_swarm_mdp_filepath(self) -> str:
+        return abspath("{}/{}/swarms.mdp".format(self.md_dir, self.iteration))
+
+    def _get_shared_swarm_tpr_filepath(self, point_idx: int) -> str:
+        return abspath(
+            "{}/{}/{}/swarms.tpr".format(self.md_dir, self.iteration, point_idx)
+        )
+
+    def _get_restrained_mdp_filepath(self, point_idx: int) -> str:
+        return abspath(
             "{}/{}/{}/restrained/restrained.mdp".format(
                 self.md_dir,
                 self.iteration,
                 point_idx,
             )
         )
-        shutil.copy(mdp_template_file, mdp_file)
-        if not self.use_plumed:
-            with open(mdp_file, "a") as f:
-                f.write(
-                    "\n\n;--------automatically injected properties from python below----\n\n"
-                )
-                for k, v in string_restraints.items():
-                    f.write("{}={}\n".format(k, v))
-        return mdp_file
 
-    def _create_restrained_plumed_file(
-        self, point_idx: int, string_restraints: Dict[str, Any]
-    ) -> str:
-        plumed_template_file = abspath("{}/{}".format(self.mdp_dir, "plumed.dat"))
-        plumed_file = abspath(
+    def _get_restrained_plumed_filepath(self, point_idx: int) -> str:
+        return abspath(
             "{}/{}/{}/restrained/plumed.dat".format(
                 self.md_dir,
                 self.iteration,
                 point_idx,
             )
         )
-        plumed_template_content = open(plumed_template_file, "r").readlines()
-        string_restraints_list = [
-            string_restraints["pull-coord{}-init".format(n + 1)]
-            for n in range(len(string_restraints.keys()))
-        ]
-        restr_counter = 0
-        for n, line in enumerate(plumed_template_content):
-            if "XXX" in line:
-                if string_restraints:
-                    plumed_template_content[n] = line.replace(
-                        "XXX", str(string_restraints_list[restr_counter])
-                    )
-                else:
-                    plumed_template_content[n] = ""
-                restr_counter += 1
-        with open(plumed_file, "w") as f:
-            f.write(
-                "\n\n#--------automatically injected properties from python below----\n\n"
-            )
-            for line in plumed_template_content:
-                f.write(line)
-        return plumed_file
 
     @classmethod
     def from_config(clazz, config: Config, **kwargs):
@@ -353,5 +1036,19 @@ class StringIterationRunner(object):
             # gpus_per_node=config.gpus_per_node,
             use_function=config.use_function,
             use_plumed=config.use_plumed,
+            pipelined=config.pipelined,
+            pipeline_cores_per_simulation=config.pipeline_cores_per_simulation,
+            io_workers=config.io_workers,
+            postprocessing_dir=config.postprocessing_dir,
+            online_free_energy=config.online_free_energy,
+            online_n_grid_points=config.online_n_grid_points,
+            cv_periods=config.cv_periods,
+            shared_swarm_tpr=config.shared_swarm_tpr,
+            swarm_quorum=config.swarm_quorum,
+            swarm_drift_error=config.swarm_drift_error,
+            max_swarm_size=config.max_swarm_size,
+            convergence_threshold=config.convergence_threshold,
+            convergence_window=config.convergence_window,
+            convergence_patience=config.convergence_patience,
             **kwargs
         )
@@ -0,0 +1,70 @@
+"""
+Adaptive number of swarms per bead.
+
+The drift of a bead is the mean displacement of its swarms, so its statistical error decreases with the square root
+of the number of swarms. Beads in flat regions of the free energy landscape need fewer swarms for the same
+precision than beads on a barrier, where the swarms spread out.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+
+def get_drift_standard_error(
+    displacements: np.array, scale: Optional[np.array] = None
+) -> np.array:
+    """
+    :param displacements: array of shape (beads, swarms, CVs) with the displacement of every swarm.
+    Swarms which are NaN, e.g. because they were not run, are ignored
+    :param scale: the scale of every CV, e.g. its range along the string. CVs with a scale of 0 are ignored
+    :return: the largest standard error of the mean displacement over all CVs of every bead.
+    Infinite for beads with fewer than two swarms
+    """
+    n_valid = np.sum(np.all(np.isfinite(displacements), axis=2), axis=1)
+    if scale is not None:
+        scale = np.asarray(scale, dtype=float)
+        displacements = displacements[:, :, scale > 0] / scale[scale > 0]
+    if displacements.shape[2] == 0:
+        return np.zeros(displacements.shape[0])
+    standard_error = np.full(displacements.shape[0], np.inf)
+    enough = n_valid > 1
+    standard_error[enough] = np.max(
+        np.nanstd(displacements[enough], axis=1, ddof=1)
+        / np.sqrt(n_valid[enough])[:, np.newaxis],
+        axis=1,
+    )
+    return standard_error
+
+
+def get_required_swarm_sizes(
+    n_swarms: np.array,
+    n_valid: np.array,
+    standard_error: np.array,
+    target_error: float,
+    max_swarm_size: int,
+) -> np.array:
+    """
+    :param n_swarms: the number of swarms already launched for every bead
+    :param n_valid: the number of swarms of every bead which contributed to the standard error
+    :param standard_error: as returned by get_drift_standard_error
+    :param target_error:
+    :param max_swarm_size:
+    :return: the number of swarms every bead needs to reach the target error, at most max_swarm_size.
+    Beads which already reach it keep their number of swarms
+    """
+    n_swarms = np.asarray(n_swarms)
+    required_valid = np.where(
+        np.isfinite(standard_error),
+        np.ceil(
+            np.maximum(n_valid, 1)
+            * (np.nan_to_num(standard_error, posinf=0) / target_error) ** 2
+        ),
+        # Without an estimate, double the number of swarms
+        2 * np.maximum(n_valid, 1),
+    )
+    required = np.maximum(n_swarms + required_valid - n_valid, n_swarms + 1)
+    required = np.minimum(required, max_swarm_size).astype(int)
+    return np.where(
+        standard_error > target_error, np.maximum(required, n_swarms), n_swarms
+    )
@@ -0,0 +1,62 @@
+"""
+Helpers for periodic CVs, e.g. dihedral angles.
+
+Periods are given per CV, with None or NaN for CVs which are not periodic.
+Periodic CVs are wrapped to the interval [-period/2, period/2).
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+def get_periods(periods: Optional[Sequence], n_cvs: int) -> Optional[np.array]:
+    """
+    :param periods: the period of every CV, None for non-periodic CVs. None if no CV is periodic
+    :param n_cvs:
+    :return: an array of length n_cvs with NaN for non-periodic CVs, or None if no CV is periodic
+    """
+    if periods is None:
+        return None
+    periods = np.array([np.nan if p is None else p for p in periods], dtype=float)
+    if len(periods) != n_cvs:
+        raise ValueError(
+            "Expected one period per CV, got {} periods for {} CVs".format(
+                len(periods), n_cvs
+            )
+        )
+    return periods if np.any(np.isfinite(periods)) else None
+
+
+def wrap(values: np.array, periods: Optional[np.array]) -> np.array:
+    """Maps the values of periodic CVs to [-period/2, period/2). The CVs are in the last dimension"""
+    if periods is None:
+        return values
+    periods = np.asarray(periods, dtype=float)
+    periodic = np.isfinite(periods)
+    p = np.where(periodic, periods, 1)
+    wrapped = (values + p / 2) % p - p / 2
+    return np.where(periodic, wrapped, values)
+
+
+def minimum_image(displacements: np.array, periods: Optional[np.array]) -> np.array:
+    """The shortest displacements between periodic images. The CVs are in the last dimension"""
+    if periods is None:
+        return displacements
+    periods = np.asarray(periods, dtype=float)
+    periodic = np.isfinite(periods)
+    p = np.where(periodic, periods, 1)
+    return np.where(
+        periodic, displacements - p * np.round(displacements / p), displacements
+    )
+
+
+def unwrap_path(path: np.array, periods: Optional[np.array]) -> np.array:
+    """
+    Makes a path continuous by following the minimum image displacement between consecutive points.
+    The first point is kept, later points may end up outside of [-period/2, period/2).
+    """
+    if periods is None or len(path) < 2:
+        return path
+    segments = minimum_image(np.diff(path, axis=0), periods)
+    return np.concatenate([path[:1], path[:1] + np.cumsum(segments, axis=0)])
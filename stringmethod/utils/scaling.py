@@ -15,6 +15,11 @@ class MinMaxScaler(object):
     Used for normalizing the string
     """
 
+    """
+    Period of every column, NaN for non-periodic columns, or None.
+    Periodic columns are scaled by their period, so that distances are measured relative to one full turn.
+    """
+    periods: Optional[np.array] = None
     _scale: Optional[np.array] = None
     _offset: Optional[np.array] = None
 
@@ -30,6 +35,16 @@ class MinMaxScaler(object):
     def fit(self, arr: np.array) -> None:
         self._offset = arr.min(axis=0)
         self._scale = arr.max(axis=0) - self._offset
+        if self.periods is not None:
+            periodic = np.isfinite(self.periods)
+            self._scale = np.where(periodic, self.periods, self._scale)
+
+    @property
+    def scale(self) -> np.array:
+        """The range of every column, or the period of periodic columns"""
+        if self._scale is None:
+            raise NotInstantiatedError()
+        return self._scale
 
     def transform(self, arr: np.array) -> np.array:
         if self._scale is None or self._offset is None:
@@ -1,93 +1,105 @@
 import numpy as np
 
 from stringmethod import logger
+from stringmethod.utils import periodicity
 
 
 def compute_path_length(path, S=None):
+    if S is None:
+        return compute_arclengths(path).sum()
     L = 0  # total curve length
     for i in range(0, len(path) - 1):
         point1, point2 = path[i], path[i + 1]
-        if S is not None:
-            point1 = np.append(point1, S(point1))
-            point2 = np.append(point2, S(point2))
+        point1 = np.append(point1, S(point1))
+        point2 = np.append(point2, S(point2))
         L += np.linalg.norm(point2 - point1)
     return L
 
 
-def _linear_reparametrization(
-    path, epsilon, arclength_weight, check_correctness=True
-):
-    """One iteration of linear reparametrization"""
-    # global failing_path
+def _normalize_arclength_weight(len_path, arclength_weight):
+    if arclength_weight is None:
+        return np.zeros((len_path - 1,)) + 1 / (len_path - 1)  # Equal weights for all
+    elif len(arclength_weight) != len_path - 1:
+        raise Exception(
+            "Expected arclength weights to be of length %s. Got %s"
+            % (len_path - 1, len(arclength_weight))
+        )
+    else:
+        # Normalize weight
+        return arclength_weight / sum(arclength_weight)
+
+
+def _interpolate_along_path(path, arc_positions):
+    """
+    Finds the points at the given distances along the piecewise linear path, all in one go.
+    :param path: an np array with points along the string as rows and dimensions as columns
+    :param arc_positions: distances from the first point measured along the path
+    :return: an np array with one row per arc position
+    """
+    segment_lengths = compute_arclengths(path)
+    cumulative_length = np.concatenate(([0], np.cumsum(segment_lengths)))
+    # Index of the segment every new point ends up on.
+    # side='right' makes sure we skip segments of zero length
+    segment_idx = np.searchsorted(cumulative_length, arc_positions, side="right") - 1
+    segment_idx = np.clip(segment_idx, 0, len(path) - 2)
+    lengths = segment_lengths[segment_idx]
+    displacement = arc_positions - cumulative_length[segment_idx]
+    fraction = np.divide(
+        displacement, lengths, out=np.zeros(lengths.shape), where=lengths > 0
+    )
+    return path[segment_idx] + fraction[:, np.newaxis] * (
+        path[segment_idx + 1] - path[segment_idx]
+    )
+
+
+def _linear_reparametrization(path, epsilon, arclength_weight, check_correctness=True):
+    """
+    One iteration of linear reparametrization.
+    Places the new points at the weighted arc lengths along the old path using cumulative sums and interpolation.
+    """
     arc_count = len(path) - 1
     L = compute_path_length(path)
-    # arc_length = L / arc_count  # point to point distance
-    new_path = np.empty(path.shape)
-    dl = 0  # extra length remaining from previous arc step
+    arc_positions = L * np.concatenate(([0], np.cumsum(arclength_weight)))
+    new_path = _interpolate_along_path(path, arc_positions)
     # endpoints fixes
     new_path[0] = path[0]
     new_path[arc_count] = path[arc_count]
-    next_old_point_idx, new_point_idx = 1, 1
-    current_point = path[0]
-    veclength = 0  # Define here for better trouble shooting
-    while new_point_idx < len(path) - 1:
-        arc_length = L * arclength_weight[new_point_idx - 1]
-        displacement = arc_length - dl  # displacement along unitvector
-        if len(path) == next_old_point_idx:
-            # failing_path = path
-            logger.debug("Failing path: %s", path)
-            logger.warning(
-                "Index too big.. displacement=%s, new_point_idx=%s, next_old_point_idx=%s, dl=%s, arc_length=%s, L=%s, veclength=%s",
-                displacement,
-                new_point_idx,
-                next_old_point_idx,
-                dl,
-                arc_length,
-                L,
-                veclength,
-            )
-        next_point = path[next_old_point_idx]
-        vector = next_point - current_point  # vector to next point
-        # We should place our point along this vector if the vector is long enough
-        veclength = np.linalg.norm(vector)
-        if (
-            displacement > veclength + epsilon
-        ):  # Note that to avoid troubles with double precision we consider points to be equal if they are within 'epsilon' precision
-            # Step forward to next point in the old path since no new point fits on this vector
-            dl += veclength
-            current_point = next_point
-            next_old_point_idx += 1
-        else:
-            # Create a point in the new path and step forward towards intermediate point along unit vector
-            unitvec = vector / veclength
-            current_point = current_point + unitvec * displacement
-            new_path[new_point_idx] = current_point
-            new_point_idx += 1
-            dl = 0
-            # Here we do not step forward in the old path since more points might fit along that vector
     if check_correctness:
-        if new_point_idx != arc_count or dl > arc_length / 100:
+        arc_lengths = L * arclength_weight
+        distances = compute_arclengths(new_path)
+        for i in np.flatnonzero(np.abs(distances - arc_lengths) > epsilon):
             logger.warning(
-                "Did not reparametrize correctly. new_point_idx=%s, dl=%s, arc_length=%s, arc_count=%s, L=%s",
-                new_point_idx,
-                dl,
-                arc_length,
-                arc_count,
-                L,
+                "Arc length wrong, %s instead of %s for points %s-%s",
+                distances[i],
+                arc_lengths[i],
+                i,
+                i + 1,
             )
-        for i in range(0, arc_count):
-            d = np.linalg.norm(new_path[i] - new_path[i + 1])
-            if abs(d - arc_length) > epsilon:
-                logger.warning(
-                    "Arc length wrong, %s instead of %s for points %s-%s",
-                    d,
-                    arc_length,
-                    i,
-                    i + 1,
-                )
     return new_path
 
 
+def reparametrize_path_arclength(path, arclength_weight=None, periods=None):
+    """
+    Given initial points on a path, place the points at equal distances measured along the same path.
+    Unlike reparametrize_path_iter this is done in a single pass,
+    so the straight line distance between new points can be shorter than the arc length where the path bends.
+    :param path: an np array with points along the string as rows and dimensions as columns
+    :param arclength_weight: How far apart the arcs should be relative each other. See reparametrize_path_iter
+    :param periods: period of every dimension, NaN for non-periodic dimensions. See reparametrize_path_iter
+    :return:
+    """
+    one_dim = len(path.shape) == 1
+    if one_dim:
+        path = path[:, np.newaxis]
+    path = periodicity.unwrap_path(path, periods)
+    arclength_weight = _normalize_arclength_weight(len(path), arclength_weight)
+    new_path = _linear_reparametrization(
+        path, 0, arclength_weight, check_correctness=False
+    )
+    new_path = periodicity.wrap(new_path, periods)
+    return new_path[:, 0] if one_dim else new_path
+
+
 def reparametrize_path_iter(
     path,
     check_correctness=False,
@@ -95,6 +107,7 @@ def reparametrize_path_iter(
     max_iterations=999,
     convergence=1e-2,
     arclength_weight=None,
+    periods=None,
 ):
     """
     Given initial points on a path, realign the points equidistantly along the same path
@@ -104,21 +117,15 @@ def reparametrize_path_iter(
     :param max_iterations:
     :param convergence: when the string has been considered to converge. Measured as norm(newpath-oldpath)/norm(oldpath)
     :param arclength_weight: How far apart the arcs (distance between two points) should be relative each othter. If =None, points will be equidistant. This does not need to be normalized, but keep the entries > 0
+    :param periods: period of every dimension, NaN for non-periodic dimensions. Segments between points follow the
+    minimum image convention and the new points are wrapped to [-period/2, period/2)
     :return:
     """
-    len_path = len(path)
-    if arclength_weight is None:
-        arclength_weight = np.zeros((len_path - 1,)) + 1 / (
-            len_path - 1
-        )  # Equal weights for all
-    elif len(arclength_weight) != len_path - 1:
-        raise Exception(
-            "Expected arclength weights to be of length %s. Got %s"
-            % (len_path - 1, len(arclength_weight))
-        )
-    else:
-        # Normalize weight
-        arclength_weight = arclength_weight / sum(arclength_weight)
+    one_dim = len(path.shape) == 1
+    if one_dim:
+        path = path[:, np.newaxis]
+    path = periodicity.unwrap_path(path, periods)
+    arclength_weight = _normalize_arclength_weight(len(path), arclength_weight)
     previous_path = path
     new_path = path
     for itr in range(0, max_iterations):
@@ -128,20 +135,33 @@ def reparametrize_path_iter(
             arclength_weight,
             check_correctness=check_correctness,
         )
-        dist = np.linalg.norm(new_path - previous_path) / np.linalg.norm(
-            previous_path
-        )
+        dist = np.linalg.norm(new_path - previous_path) / np.linalg.norm(previous_path)
         if dist <= convergence:
             break
         previous_path = new_path
-    return new_path
+    new_path = periodicity.wrap(new_path, periods)
+    return new_path[:, 0] if one_dim else new_path
 
 
-def reparametrize_path_grid(path, resolution=30000):
+def _interpolate_path_parameter(path, t):
+    """
+    Points on the piecewise linear path for parameter values t, where t=i corresponds to the i:th point
+    and values beyond the last point are clamped to it. Equivalent to np.interp over every dimension.
+    """
+    segment_idx = np.clip(np.floor(t).astype(int), 0, len(path) - 2)
+    fraction = np.clip(t - segment_idx, 0, 1)
+    return path[segment_idx] + fraction[:, np.newaxis] * (
+        path[segment_idx + 1] - path[segment_idx]
+    )
+
+
+def reparametrize_path_grid(path, resolution=30000, max_chunk_values=2**22):
     """
     Given initial points on a path, realign the points equidistantly along the same path.
     Originally from https://stackoverflow.com/questions/19117660/how-to-generate-equispaced-interpolating-values
     The resolution ngrid sets the number of grid points between two points on the string.
+    The grid is never stored in full: it is generated in chunks of at most max_chunk_values numbers
+    and only the cumulative distance along it is kept.
     """
     # find lots of points on the piecewise linear curve defined by x and y
     if len(path.shape) == 1:
@@ -155,21 +175,42 @@ def reparametrize_path_grid(path, resolution=30000):
     L = compute_path_length(path)
     arc_length = L / arc_count  # point to point distance
     ngrid = resolution * arc_count
-    grid = np.empty((dim, ngrid))
     t = np.linspace(0, len(path), ngrid)
-    for i in range(dim):
-        grid[i] = np.interp(t, np.arange(len(path)), path[:, i])
+    # cumulative_dist[j] is the distance along the grid from its first to its j:th point
+    cumulative_dist = np.empty((ngrid,))
+    chunk_size = max(max_chunk_values // dim, 1)
+    previous_point, previous_dist = path[0], 0
+    for chunk_start in range(0, ngrid, chunk_size):
+        grid = _interpolate_path_parameter(
+            path, t[chunk_start : chunk_start + chunk_size]
+        )
+        steps = np.linalg.norm(
+            np.diff(grid, axis=0, prepend=previous_point[np.newaxis]), axis=1
+        )
+        cumulative_dist[chunk_start : chunk_start + len(grid)] = (
+            previous_dist + np.cumsum(steps)
+        )
+        previous_point, previous_dist = (
+            grid[-1],
+            cumulative_dist[chunk_start + len(grid) - 1],
+        )
     i, idx = 0, [0]
-    while i < ngrid:
-        total_dist = 0
-        for j in range(i + 1, ngrid):
-            total_dist += np.linalg.norm(grid[:, j] - grid[:, j - 1])
-            if total_dist >= arc_length:
-                # TODO not that we always overestimate the arc_length here.
-                # A slightly more accurate approximation is to take the point that gives the closest arc_length,
-                # i.e. an arc_length which can be too short.
-                idx.append(j)
-                break
+    total_dist = 0
+    while i < ngrid - 1:
+        # First grid point at least one arc length away from grid point i
+        j = np.searchsorted(
+            cumulative_dist, cumulative_dist[i] + arc_length, side="left"
+        )
+        j = max(j, i + 1)
+        if j >= ngrid:
+            total_dist = cumulative_dist[-1] - cumulative_dist[i]
+            break
+        # TODO not that we always overestimate the arc_length here.
+        # A slightly more accurate approximation is to take the point that gives the closest arc_length,
+        # i.e. an arc_length which can be too short.
+        idx.append(j)
+        total_dist = cumulative_dist[j] - cumulative_dist[i]
+        # Like the original algorithm, restart the search from the grid point after the new one
         i = j + 1
     if total_dist > 0:
         # We missed the last point since we overestimate the arc_length a bit at each step
@@ -177,7 +218,7 @@ def reparametrize_path_grid(path, resolution=30000):
             "Remaining total dist %s for arc length %s", total_dist, arc_length
         )
         idx.append(ngrid - 1)
-    new_path = grid[:, idx].T
+    new_path = _interpolate_path_parameter(path, t[idx])
     if len(path) != len(new_path):
         raise Exception(
             "Number of path points differ after reparametrization, something must have gone wrong. Previous: "
@@ -230,24 +271,16 @@ def change_string_length(stringpath, new_length):
     new_arclength_weight = np.empty((new_length - 1,))
     new_arclength_weight[0 : (new_length - old_length)] = old_arclengths[0]
     # We still want the length of the first arc to be approximately the same
-    new_arclength_weight[
-        (new_length - old_length) : (new_length - 1)
-    ] = old_arclengths
-    new_path = reparametrize_path_iter(
-        new_path, arclength_weight=new_arclength_weight
-    )
+    new_arclength_weight[(new_length - old_length) : (new_length - 1)] = old_arclengths
+    new_path = reparametrize_path_iter(new_path, arclength_weight=new_arclength_weight)
     if reduce_length:
         new_path, new_arclength_weight = (
             new_path[::frac],
             new_arclength_weight[::frac],
         )
-        new_path[-1] = stringpath[
-            -1
-        ]  # Just to make sure last point is the same
+        new_path[-1] = stringpath[-1]  # Just to make sure last point is the same
         if len(new_arclength_weight) >= len(new_path):
-            new_arclength_weight = new_arclength_weight[
-                0 : orig_new_length - 1
-            ]
+            new_arclength_weight = new_arclength_weight[0 : orig_new_length - 1]
         new_path = reparametrize_path_iter(
             new_path, arclength_weight=new_arclength_weight
         )
@@ -255,10 +288,10 @@ def change_string_length(stringpath, new_length):
 
 
 def compute_arclengths(stringpath):
-    arclengths = np.empty((len(stringpath) - 1,))
-    for i in range(len(stringpath) - 1):
-        arclengths[i] = np.linalg.norm(stringpath[i + 1] - stringpath[i])
-    return arclengths
+    segments = np.diff(stringpath, axis=0)
+    if len(segments.shape) == 1:
+        return np.abs(segments)
+    return np.linalg.norm(segments, axis=1)
 
 
 def get_straight_path(start, end, number_points=20, height_func=None):
@@ -0,0 +1,142 @@
+"""
+Parsed mdp and plumed templates, rendered into the input files of every bead.
+
+Templates are read once and kept in a cache until the template file changes on disk.
+Rendered files are only written when their content differs from the file already on disk,
+which avoids many small redundant writes on shared file systems.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Sequence
+
+from stringmethod import logger
+
+_cache = dict()
+
+
+class MdpTemplate(object):
+    """
+    An mdp file to which the restraint properties of a bead are appended.
+    Properties which are already set in the template are commented out, since grompp rejects duplicate parameters.
+    """
+
+    header = "\n\n;--------automatically injected properties from python below----\n\n"
+
+    def __init__(self, template_file: str):
+        with open(template_file) as f:
+            self.content = f.read()
+        self.lines = self.content.splitlines(keepends=True)
+        self._keys = [_get_mdp_key(line) for line in self.lines]
+
+    def render(self, properties: Optional[Dict[str, Any]] = None) -> str:
+        """
+        :param properties: mdp properties and their values. If empty, the template is returned unchanged
+        """
+        if not properties:
+            return self.content
+        overridden = set(_normalize_mdp_key(k) for k in properties.keys())
+        content = "".join(
+            "; " + line if key in overridden else line
+            for line, key in zip(self.lines, self._keys)
+        )
+        return (
+            content
+            + self.header
+            + "".join("{}={}\n".format(k, v) for k, v in properties.items())
+        )
+
+
+def _normalize_mdp_key(key: str) -> str:
+    # grompp treats dashes and underscores in parameter names the same way
+    return key.strip().lower().replace("_", "-")
+
+
+def _get_mdp_key(line: str) -> Optional[str]:
+    line = line.split(";")[0]
+    if "=" not in line:
+        return None
+    return _normalize_mdp_key(line.split("=", 1)[0])
+
+
+class PlumedTemplate(object):
+    """
+    A plumed file with one restraint value per line marked with a placeholder.
+    Lines with a placeholder are removed when rendered without values, e.g. for the unrestrained swarms.
+    """
+
+    header = "\n\n#--------automatically injected properties from python below----\n\n"
+    placeholder = "XXX"
+
+    def __init__(self, template_file: str):
+        with open(template_file) as f:
+            self.lines = f.readlines()
+        self._placeholder_lines = [
+            n for n, line in enumerate(self.lines) if self.placeholder in line
+        ]
+
+    @property
+    def n_placeholders(self) -> int:
+        return len(self._placeholder_lines)
+
+    def render(self, values: Optional[Sequence] = None) -> str:
+        """
+        :param values: the value of every placeholder line in order of appearance. None to remove the lines
+        """
+        lines = list(self.lines)
+        for value_idx, n in enumerate(self._placeholder_lines):
+            if values:
+                lines[n] = lines[n].replace(self.placeholder, str(values[value_idx]))
+            else:
+                lines[n] = ""
+        return self.header + "".join(lines)
+
+
+def load_template(template_class, template_file: str):
+    """
+    :param template_class: MdpTemplate or PlumedTemplate
+    :param template_file:
+    :return: the parsed template, only read again if the file was modified since it was last parsed
+    """
+    template_file = os.path.abspath(template_file)
+    stat = os.stat(template_file)
+    key = (template_class, template_file)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(key)
+    if cached is None or cached[0] != version:
+        logger.debug("Parsing template %s", template_file)
+        cached = (version, template_class(template_file))
+        _cache[key] = cached
+    return cached[1]
+
+
+def write_if_changed(file_name: str, content: str) -> bool:
+    """
+    :return: True if the file was written, False if it already had this content
+    """
+    try:
+        if os.path.getsize(file_name) == len(content.encode()):
+            with open(file_name) as f:
+                if f.read() == content:
+                    return False
+    except OSError:
+        # The file does not exist yet
+        pass
+    with open(file_name, "w") as f:
+        f.write(content)
+    return True
+
+
+def write_all(files: Dict[str, str], n_workers: Optional[int] = 1) -> int:
+    """
+    Writes a batch of rendered files, skipping the ones which are unchanged
+    :param files: the content of every file by file name
+    :param n_workers: number of threads writing files in parallel
+    :return: the number of files written
+    """
+    if len(files) == 0:
+        return 0
+    with ThreadPoolExecutor(max_workers=max(1, min(n_workers, len(files)))) as pool:
+        n_written = sum(pool.map(lambda item: write_if_changed(*item), files.items()))
+    logger.debug("Wrote %s of %s rendered input files", n_written, len(files))
+    return n_written
@@ -0,0 +1,105 @@
+"""
+Fast readers for the xvg (gromacs) and colvar (plumed) files written by the swarm simulations.
+"""
+
+import os
+import warnings
+from typing import List, Optional
+
+import numpy as np
+
+_COMMENT_CHARS = ("#", "@")
+"""Size of the first block read from the end of a file when looking for its last line"""
+_TAIL_BLOCK_SIZE = 4096
+
+
+def _is_data_line(line: str) -> bool:
+    # Since xvg/colvar files can have both @ and # as a head, we only read lines that don't start with these chars
+    return len(line.strip()) > 0 and not line.startswith(_COMMENT_CHARS)
+
+
+def _parse_lines(lines: List[str], n_columns: Optional[int] = None) -> np.array:
+    """
+    Converts data lines to a 2D array in bulk.
+    Lines with an inconsistent number of fields (e.g. due to write errors during restarting) are removed.
+    :param lines: lines without comments
+    :param n_columns: expected number of fields per line. Defaults to the number of fields in the first line
+    :return:
+    """
+    if len(lines) == 0:
+        return np.empty((0, 0 if n_columns is None else n_columns))
+    if n_columns is None:
+        n_columns = len(lines[0].split())
+    try:
+        with warnings.catch_warnings():
+            # Unparsable data is only a warning for numpy, we want to fall back to the slow path
+            warnings.simplefilter("error")
+            values = np.fromstring(" ".join(lines), sep=" ")
+    except (ValueError, DeprecationWarning):
+        values = None
+    if values is not None and values.size == len(lines) * n_columns:
+        return values.reshape((len(lines), n_columns))
+    # Some lines are broken. Only keep the ones with the right number of fields
+    lines = [line for line in lines if len(line.split()) == n_columns]
+    if len(lines) == 0:
+        return np.empty((0, n_columns))
+    return np.fromstring(" ".join(lines), sep=" ").reshape((len(lines), n_columns))
+
+
+def load_xvg(file_name: str, n_columns: Optional[int] = None) -> np.array:
+    """
+    Loads all data rows of an xvg/colvar file.
+    :param file_name:
+    :param n_columns: only keep rows with this number of fields. Defaults to the number of fields of the first row
+    :return:
+    """
+    if not os.path.exists(file_name):
+        raise FileNotFoundError("WARNING: file " + file_name + " not found.")
+    with open(file_name) as f:
+        lines = [line for line in f if _is_data_line(line)]
+    data = _parse_lines(lines, n_columns=n_columns)
+    if len(data) == 0:
+        raise IOError("No data found in file " + file_name)
+    return data
+
+
+def load_xvg_endpoints(file_name: str, n_columns: Optional[int] = None) -> np.array:
+    """
+    Loads the first and last data rows of an xvg/colvar file without reading the rest of the file.
+    The last row is found by reading the file backwards from its end.
+    :param file_name:
+    :param n_columns: only consider rows with this number of fields. Defaults to the number of fields of the first row
+    :return: an array of shape (2, n_columns)
+    """
+    if not os.path.exists(file_name):
+        raise FileNotFoundError("WARNING: file " + file_name + " not found.")
+    with open(file_name, "rb") as f:
+        first = None
+        for line in f:
+            line = line.decode()
+            if _is_data_line(line) and (
+                n_columns is None or len(line.split()) == n_columns
+            ):
+                first = _parse_lines([line], n_columns=n_columns)
+                break
+        if first is None or first.shape[0] == 0:
+            raise IOError("No data found in file " + file_name)
+        n_columns = first.shape[1]
+        file_size = f.seek(0, os.SEEK_END)
+        block_size = _TAIL_BLOCK_SIZE
+        while True:
+            start = max(file_size - block_size, 0)
+            f.seek(start)
+            lines = f.read(file_size - start).decode().splitlines()
+            if start > 0:
+                # The first line of the block is most likely cut
+                lines = lines[1:]
+            for line in reversed(lines):
+                if not _is_data_line(line):
+                    continue
+                last = _parse_lines([line], n_columns=n_columns)
+                if last.shape[0] == 1:
+                    return np.concatenate([first, last])
+            if start == 0:
+                raise IOError("No data found in file " + file_name)
+            block_size *= 4
@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+
+from stringmethod.utils import adaptive_swarms
+
+
+class TestAdaptiveSwarms(unittest.TestCase):
+    def test_standard_error(self):
+        displacements = np.full((3, 4, 2), np.nan)
+        # Swarms of the first bead do not spread out
+        displacements[0] = 1.0
+        displacements[1, :, 0] = [0, 2, 0, 2]
+        displacements[1, :, 1] = 0
+        # Only one swarm of the last bead finished
+        displacements[2, 0] = 1.0
+        standard_error = adaptive_swarms.get_drift_standard_error(
+            displacements, scale=np.array([2.0, 0.0])
+        )
+        self.assertEqual(0, standard_error[0])
+        self.assertAlmostEqual(np.std([0, 1, 0, 1], ddof=1) / 2, standard_error[1])
+        self.assertEqual(np.inf, standard_error[2])
+
+    def test_required_swarm_sizes(self):
+        def get_required(max_swarm_size):
+            return adaptive_swarms.get_required_swarm_sizes(
+                n_swarms=np.array([8, 8, 8, 8]),
+                n_valid=np.array([8, 8, 6, 1]),
+                standard_error=np.array([0.05, 0.2, 0.2, np.inf]),
+                target_error=0.1,
+                max_swarm_size=max_swarm_size,
+            ).tolist()
+
+        # Four times as many valid swarms halve the error
+        self.assertListEqual([8, 32, 26, 9], get_required(40))
+        self.assertListEqual([8, 30, 26, 9], get_required(30))
+
+
+if __name__ == "__main__":
+    unittest.main()
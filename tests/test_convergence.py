@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from stringmethod.simulations import convergence
+from stringmethod.utils.scaling import MinMaxScaler
+
+
+class TestConvergence(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.string_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _add_iteration(self, monitor, iteration, string):
+        np.savetxt("{}/string{}.txt".format(self.string_dir, iteration), string)
+        monitor.add(iteration, 0.1, np.zeros(len(string)))
+
+    def test_converged(self):
+        string = np.array([[0.0, 0.0], [1.0, 1.0], [2.0, 2.0]])
+        np.savetxt("{}/string0.txt".format(self.string_dir), string)
+        monitor = convergence.ConvergenceMonitor(
+            string_dir=self.string_dir, window=2, threshold=0.01, patience=2
+        )
+        self._add_iteration(monitor, 1, string + 0.5)
+        self._add_iteration(monitor, 2, string + 0.5)
+        self._add_iteration(monitor, 3, string + 0.5)
+        self.assertFalse(monitor.is_converged())
+        self._add_iteration(monitor, 4, string + 0.5)
+        self.assertTrue(monitor.is_converged())
+        np.testing.assert_array_equal([1, 2, 3, 4], monitor.iterations)
+        # The time series is restored after a restart
+        restored = convergence.ConvergenceMonitor(
+            string_dir=self.string_dir, window=2, threshold=0.01, patience=2
+        )
+        self.assertTrue(restored.is_converged())
+        self.assertEqual((4, 3), restored.displacements.shape)
+        # An iteration which is run again replaces the later ones
+        self._add_iteration(restored, 2, string)
+        np.testing.assert_array_equal([1, 2], restored.iterations)
+        self.assertFalse(restored.is_converged())
+
+    def test_periodic(self):
+        string = np.array([[170.0], [-175.0], [-160.0]])
+        new_string = np.array([[-170.0], [-165.0], [-150.0]])
+        scaler = MinMaxScaler(periods=np.array([360.0]))
+        scaler.fit(new_string)
+        _, displacements = convergence.compare_strings(
+            string, new_string, scaler, periods=np.array([360.0])
+        )
+        np.testing.assert_allclose([20, 10, 10], 360 * displacements)
+
+
+if __name__ == "__main__":
+    unittest.main()
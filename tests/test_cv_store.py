@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from stringmethod.config import Config
+from stringmethod.postprocessing import CvStore, CvValueExtractor
+
+
+def write_swarm_output(md_dir, iteration, bead, swarm, data):
+    swarm_dir = "{}/{}/{}/s{}".format(md_dir, iteration, bead, swarm)
+    os.makedirs(swarm_dir, exist_ok=True)
+    with open("{}/pullx.xvg".format(swarm_dir), "w") as f:
+        f.write('@    title "Pull COM"\n')
+        for time, row in enumerate(data):
+            f.write("\t".join(str(v) for v in [time] + list(row)) + "\n")
+
+
+class TestCvStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.md_dir = os.path.join(self.tmp_dir.name, "md")
+        self.config = Config(
+            postprocessing_dir=os.path.join(self.tmp_dir.name, "postprocessing")
+        )
+        self.transitions = {}
+        for iteration in [1, 2]:
+            self._add_iteration(iteration, n_swarms=3)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _add_iteration(self, iteration, n_swarms):
+        values = np.random.rand(2 * n_swarms, 2, 2)
+        for idx, transition in enumerate(values):
+            write_swarm_output(
+                self.md_dir, iteration, idx // n_swarms, idx % n_swarms, transition
+            )
+        self.transitions[iteration] = values
+
+    def _extract(self, **kwargs):
+        ce = CvValueExtractor.from_config(
+            config=self.config, md_dir=self.md_dir, **kwargs
+        )
+        ce.run()
+        return ce.cv_coordinates
+
+    def test_only_new_iterations_are_read(self):
+        cv_coordinates = self._extract()
+        self.assertIsInstance(cv_coordinates, np.memmap)
+        expected = np.concatenate([self.transitions[1], self.transitions[2]])
+        self.assertAlmostEqual(abs(cv_coordinates - expected).max(), 0, places=10)
+        # Changed files of a stored iteration are not read again
+        write_swarm_output(self.md_dir, 1, 0, 0, np.zeros((2, 2)))
+        self._add_iteration(3, n_swarms=3)
+        cv_coordinates = self._extract()
+        expected = np.concatenate([expected, self.transitions[3]])
+        self.assertAlmostEqual(abs(cv_coordinates - expected).max(), 0, places=10)
+        cv_coordinates = self._extract(first_iteration=2, last_iteration=2)
+        self.assertAlmostEqual(
+            abs(cv_coordinates - self.transitions[2]).max(), 0, places=10
+        )
+
+    def test_unfinished_iteration_is_read_again(self):
+        self._extract()
+        self._add_iteration(2, n_swarms=4)
+        cv_coordinates = self._extract()
+        expected = np.concatenate([self.transitions[1], self.transitions[2]])
+        self.assertEqual(expected.shape, cv_coordinates.shape)
+        self.assertAlmostEqual(abs(cv_coordinates - expected).max(), 0, places=10)
+        store = CvStore("{}/cv_store".format(self.config.postprocessing_dir))
+        self.assertEqual(8, len(store.get_files(2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
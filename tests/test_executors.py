@@ -0,0 +1,109 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+# The simulations modules import each other as top-level packages
+sys.path.append(os.path.join(os.path.dirname(__file__), "../stringmethod"))
+
+from simulations.gmx_jobs import executors
+from stringmethod.config import Config
+
+_CORES = {0, 1, 2, 3}
+
+
+class TestExecutors(unittest.TestCase):
+    def test_core_pool(self):
+        pool = executors._CorePool([3, 1, 2, 0])
+        first = pool.acquire(2)
+        self.assertListEqual([0, 1], first)
+        self.assertListEqual([2, 3], pool.acquire(2))
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire(1)))
+        thread.start()
+        time.sleep(0.1)
+        # No core is free until one is released
+        self.assertListEqual([], acquired)
+        pool.release(first)
+        thread.join(timeout=5)
+        self.assertListEqual([[0]], acquired)
+        self.assertListEqual([1], pool.acquire(1))
+
+    def test_create_executor(self):
+        with mock.patch.object(
+            executors.os, "sched_getaffinity", return_value=_CORES
+        ), mock.patch.dict(os.environ, clear=True):
+            executor = executors.create_executor(
+                Config(
+                    executor="auto",
+                    local_cores=2,
+                    local_threads_per_simulation=4,
+                    local_pin_cores=False,
+                    straggler_timeout=60,
+                )
+            )
+            self.assertIsInstance(executor, executors.LocalExecutor)
+            self.assertEqual(2, executor.n_cores)
+            self.assertEqual(2, executor.threads_per_simulation)
+            self.assertFalse(executor.pin)
+            self.assertIsNotNone(executor.create_straggler_detector())
+            with self.assertRaises(executors.ExecutorError):
+                executors.create_executor(Config(executor="slurm"))
+            with mock.patch.dict(os.environ, {"SLURM_NPROCS": "8"}):
+                executor = executors.create_executor(
+                    Config(executor="auto", slurm_min_ranks_per_simulation=2)
+                )
+                self.assertIsInstance(executor, executors.SlurmExecutor)
+                self.assertEqual(8, executor.n_cores)
+                self.assertEqual(2, executor.min_ranks_per_simulation)
+                self.assertIsNone(executor.create_straggler_detector())
+                self.assertIsInstance(
+                    executors.create_executor(Config(executor="local")),
+                    executors.LocalExecutor,
+                )
+            with self.assertRaises(executors.ExecutorError):
+                executors.create_executor(Config(executor="unknown"))
+
+    def test_local_executor(self):
+        lock = threading.Lock()
+        calls = []
+        running = []
+
+        def mdrun_local(task, cores, straggler_detector, max_relaunches):
+            with lock:
+                # Simulations running at the same time never share cores
+                for other in running:
+                    self.assertFalse(set(cores) & set(other))
+                running.append(cores)
+                calls.append((task["output_dir"], cores))
+            time.sleep(0.05)
+            with lock:
+                running.remove(cores)
+
+        tasks = [dict(output_dir=str(i)) for i in range(4)]
+        with mock.patch.object(
+            executors.os, "sched_getaffinity", return_value=_CORES
+        ), mock.patch.object(executors.mdtools, "mdrun_local", mdrun_local):
+            executors.LocalExecutor(threads_per_simulation=2).run_mdruns(tasks)
+            self.assertListEqual(
+                [str(i) for i in range(4)],
+                sorted(output_dir for output_dir, _ in calls),
+            )
+            self.assertTrue(all(len(cores) == 2 for _, cores in calls))
+            # Simulations budgeted with n_cpu split the cores between them
+            calls.clear()
+            executors.LocalExecutor(threads_per_simulation=1).run_mdruns(
+                [dict(t, n_cpu=4) for t in tasks[:2]]
+            )
+            self.assertTrue(all(len(cores) == 2 for _, cores in calls))
+        with mock.patch.object(
+            executors.os, "sched_getaffinity", return_value=_CORES
+        ), mock.patch.object(executors.mdtools, "mdrun_local") as mocked_mdrun_local:
+            executors.LocalExecutor(pin=False).run_mdruns(tasks[:1])
+            self.assertIsNone(mocked_mdrun_local.call_args[1]["cores"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from stringmethod.postprocessing.index_conversion import (
+    IndexConverter,
+    IndexConverterException,
+)
+
+
+class TestIndexConverter(unittest.TestCase):
+    def setUp(self):
+        self.converter = IndexConverter(n_dim=3, n_grid_points=4)
+
+    def test_bin_and_grid_indices_round_trip(self):
+        bin_idx = np.arange(self.converter.n_bins)
+        grid_idx = self.converter.convert_to_grid_idx(bin_idx)
+        self.assertEqual((self.converter.n_bins, 3), grid_idx.shape)
+        self.assertListEqual([0, 1, 2], self.converter.convert_to_grid_idx(6).tolist())
+        self.assertEqual(6, self.converter.convert_to_bin_idx(np.array([0, 1, 2])))
+        self.assertTrue(
+            np.array_equal(bin_idx, self.converter.convert_to_bin_idx(grid_idx))
+        )
+
+    def test_vector_and_grid_round_trip(self):
+        vectors = np.random.rand(2, self.converter.n_bins)
+        grids = self.converter.convert_to_grid(vectors)
+        self.assertEqual((2, 4, 4, 4), grids.shape)
+        self.assertEqual(vectors[0, 6], grids[0, 0, 1, 2])
+        self.assertTrue(
+            np.array_equal(vectors[1], self.converter.convert_to_vector(grids[1]))
+        )
+
+    def test_indices_outside_grid(self):
+        with self.assertRaises(IndexConverterException):
+            self.converter.convert_to_grid_idx(np.array([0, self.converter.n_bins]))
+        with self.assertRaises(IndexConverterException):
+            self.converter.convert_to_bin_idx(np.array([[0, 0, 0], [0, 4, 0]]))
+        with self.assertRaises(IndexConverterException):
+            self.converter.convert_to_vector(np.zeros((4, 4)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import time
+import unittest
+
+from stringmethod.simulations import launcher, stragglers
+
+
+class TestLauncher(unittest.TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            requests = [
+                launcher.LaunchRequest(
+                    name="slow",
+                    command="sleep 0.5; echo slow >&2",
+                    log_file=os.path.join(tmp_dir, "slow.err"),
+                    n_slots=2,
+                ),
+                launcher.LaunchRequest(
+                    name="fast",
+                    command="echo line1 >&2; echo line2 >&2",
+                    cwd=tmp_dir,
+                    log_file=os.path.join(tmp_dir, "fast.err"),
+                ),
+                launcher.LaunchRequest(
+                    name="failing", command="echo error >&2; exit 3", n_slots=1
+                ),
+            ]
+            completed = []
+            start_time = time.perf_counter()
+            events = launcher.AsyncLauncher(
+                n_slots=3, on_completion=lambda e: completed.append(e.request.name)
+            ).run(requests)
+            # All commands fit into the slots and run at the same time
+            self.assertLess(time.perf_counter() - start_time, 1.5)
+            self.assertEqual(["slow"], completed[-1:])
+            self.assertListEqual(completed, [e.request.name for e in events])
+            returncodes = {e.request.name: e.returncode for e in events}
+            self.assertDictEqual({"slow": 0, "fast": 0, "failing": 3}, returncodes)
+            with open(os.path.join(tmp_dir, "fast.err")) as f:
+                self.assertEqual("line1\nline2\n", f.read())
+            failing = [e for e in events if e.request.name == "failing"][0]
+            self.assertListEqual(["error\n"], failing.stderr_tail)
+
+    def test_slots(self):
+        requests = [
+            launcher.LaunchRequest(name=str(i), command="sleep 0.2", n_slots=2)
+            for i in range(3)
+        ]
+        start_time = time.perf_counter()
+        launcher.AsyncLauncher(n_slots=3).run(requests)
+        # Only one command fits at a time
+        self.assertGreater(time.perf_counter() - start_time, 0.55)
+
+    def test_relaunch_straggler(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+
+            def relaunch():
+                return launcher.LaunchRequest(
+                    name="stalled",
+                    command="echo done > out.txt",
+                    cwd=tmp_dir,
+                    progress_dirs=[tmp_dir],
+                )
+
+            request = launcher.LaunchRequest(
+                name="stalled",
+                command="sleep 30",
+                progress_dirs=[tmp_dir],
+                relaunch=relaunch,
+            )
+            start_time = time.perf_counter()
+            events = launcher.AsyncLauncher(
+                n_slots=1,
+                straggler_detector=stragglers.StragglerDetector(stall_timeout=0.2),
+                poll_interval=0.1,
+            ).run([request])
+            self.assertLess(time.perf_counter() - start_time, 5)
+            self.assertListEqual([True, False], [e.straggler for e in events])
+            self.assertEqual(1, events[1].request.attempt)
+            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "out.txt")))
+
+    def test_relaunch_does_not_block(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            completed = dict()
+
+            def relaunch():
+                # E.g. grompp for a new random seed
+                time.sleep(1)
+                completed["relaunch"] = time.perf_counter()
+                return None
+
+            requests = [
+                launcher.LaunchRequest(
+                    name="stalled",
+                    command="sleep 30",
+                    progress_dirs=[tmp_dir],
+                    relaunch=relaunch,
+                ),
+                launcher.LaunchRequest(name="other", command="sleep 0.5"),
+            ]
+            launcher.AsyncLauncher(
+                n_slots=2,
+                on_completion=lambda e: completed.setdefault(
+                    e.request.name, time.perf_counter()
+                ),
+                straggler_detector=stragglers.StragglerDetector(stall_timeout=0.1),
+                poll_interval=0.05,
+            ).run(requests)
+            # The other command is reported while the relaunch is being prepared
+            self.assertLess(completed["other"], completed["relaunch"])
+
+    def test_keep_stalled_without_relaunch(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            request = launcher.LaunchRequest(
+                name="stalled",
+                command="sleep 0.5; echo done > out.txt",
+                cwd=tmp_dir,
+                progress_dirs=[tmp_dir],
+            )
+            events = launcher.AsyncLauncher(
+                n_slots=1,
+                straggler_detector=stragglers.StragglerDetector(stall_timeout=0.1),
+                poll_interval=0.05,
+            ).run([request])
+            self.assertFalse(events[0].straggler)
+            self.assertEqual(0, events[0].returncode)
+            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "out.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
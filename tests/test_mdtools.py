@@ -0,0 +1,158 @@
+import functools
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from stringmethod.simulations import launcher, mdtools, stragglers
+
+
+class TestMdtools(unittest.TestCase):
+    def test_copy_tpr_with_seeds(self):
+        sentinel = 0x5EED5EED5EED5EED
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shared_tpr = os.path.join(tmp_dir, "shared.tpr")
+            with open(shared_tpr, "wb") as f:
+                f.write(b"header" + struct.pack(">q", sentinel) + b"body")
+            tpr_files = [os.path.join(tmp_dir, "{}.tpr".format(i)) for i in range(3)]
+            self.assertTrue(
+                mdtools.copy_tpr_with_seeds(shared_tpr, tpr_files, sentinel, [1, 2, 3])
+            )
+            for seed, tpr_file in zip([1, 2, 3], tpr_files):
+                with open(tpr_file, "rb") as f:
+                    self.assertEqual(
+                        b"header" + struct.pack(">q", seed) + b"body", f.read()
+                    )
+            # The seed has to be unambiguous
+            with open(shared_tpr, "wb") as f:
+                f.write(struct.pack(">q", sentinel) * 2)
+            os.remove(tpr_files[0])
+            self.assertFalse(
+                mdtools.copy_tpr_with_seeds(shared_tpr, tpr_files[:1], sentinel, [1])
+            )
+            self.assertFalse(os.path.exists(tpr_files[0]))
+
+    def test_grompp_service(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # A fake gmx which writes the file given with -o
+            gmx = os.path.join(tmp_dir, "gmx")
+            with open(gmx, "w") as f:
+                f.write(
+                    '#!/bin/sh\nwhile [ "$1" != "-o" ]; do shift; done\ntouch "$2"\n'
+                )
+            os.chmod(gmx, 0o755)
+            tasks = [
+                dict(
+                    index_file="index.ndx",
+                    mdp_file="grompp.mdp",
+                    topology_file="topol.top",
+                    structure_file="conf.gro",
+                    tpr_file=os.path.join(tmp_dir, "{}.tpr".format(i)),
+                    mdp_output_file="mdout.mdp",
+                    grompp_options=["-maxwarn 1"],
+                )
+                for i in range(5)
+            ]
+            with mock.patch.dict(os.environ, {"PATH": tmp_dir}):
+                service = mdtools.GromppService(n_workers=2)
+            try:
+                self.assertEqual([gmx], service.gmx)
+                futures = service.submit(tasks[:2])
+                service.run(tasks[2:])
+                for future in futures:
+                    future.result()
+            finally:
+                service.shutdown()
+            for task in tasks:
+                self.assertTrue(os.path.isfile(task["tpr_file"]))
+
+    def test_grompp_failure(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gmx = os.path.join(tmp_dir, "gmx")
+            with open(gmx, "w") as f:
+                f.write("#!/bin/sh\necho 'Fatal error' >&2\nexit 1\n")
+            os.chmod(gmx, 0o755)
+            task = dict(
+                index_file="index.ndx",
+                mdp_file="grompp.mdp",
+                topology_file="topol.top",
+                structure_file="conf.gro",
+                tpr_file=os.path.join(tmp_dir, "topol.tpr"),
+                mdp_output_file="mdout.mdp",
+                grompp_options=None,
+            )
+            with self.assertRaisesRegex(IOError, "Fatal error"):
+                mdtools.grompp_one(task, gmx=[gmx])
+            with self.assertRaises(IOError):
+                mdtools.grompp_one(task, gmx=[os.path.join(tmp_dir, "missing")])
+            service = mdtools.GromppService(n_workers=1)
+            try:
+                with self.assertRaises(IOError):
+                    service.run([task])
+            finally:
+                service.shutdown()
+
+    def test_exclusive_job_steps(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tasks = [
+                dict(
+                    tpr_file="topol.tpr",
+                    check_point_file=None,
+                    plumed_file=None,
+                    mdrun_options=None,
+                    output_dir=os.path.join(tmp_dir, str(i)),
+                )
+                for i in range(2)
+            ]
+            with mock.patch.dict(
+                os.environ, {"SLURM_NPROCS": "4", "SLURM_NNODES": "1"}
+            ), mock.patch.object(mdtools, "_run_single") as run_single:
+                mdtools.mdrun_one(tasks[0])
+                self.assertNotIn("--exclusive", run_single.call_args[0][1](tasks[0]))
+                # A pipeline step with its own cores runs next to other steps
+                mdtools.mdrun_one(dict(tasks[0], n_cpu=2))
+                self.assertIn("--exclusive", run_single.call_args[0][1](tasks[0]))
+            with mock.patch.dict(
+                os.environ, {"SLURM_NPROCS": "4", "SLURM_NNODES": "1"}
+            ), mock.patch.object(mdtools.launcher, "AsyncLauncher") as async_launcher:
+                mdtools.mdrun_all(tasks)
+                (requests,) = async_launcher.return_value.run.call_args[0]
+                self.assertNotIn("--exclusive", requests[0].command)
+                mdtools.mdrun_all([dict(t, n_cpu=2) for t in tasks])
+                (requests,) = async_launcher.return_value.run.call_args[0]
+                self.assertIn("--exclusive", requests[0].command)
+
+    def test_keep_stalled_without_reseed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # A restrained simulation, which cannot be reseeded
+            task = dict(
+                tpr_file="topol.tpr",
+                check_point_file=None,
+                plumed_file=None,
+                mdrun_options=None,
+                output_dir=tmp_dir,
+            )
+            fast_launcher = functools.partial(
+                launcher.AsyncLauncher, poll_interval=0.05
+            )
+            with mock.patch.object(mdtools.launcher, "AsyncLauncher", fast_launcher):
+                mdtools._run_single(
+                    task,
+                    lambda t: "sleep 0.6; touch confout.gro",
+                    straggler_detector=stragglers.StragglerDetector(stall_timeout=0.1),
+                )
+            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, "confout.gro")))
+            with mock.patch.dict(
+                os.environ, {"SLURM_NPROCS": "4", "SLURM_NNODES": "1"}
+            ), mock.patch.object(mdtools.launcher, "AsyncLauncher") as async_launcher:
+                mdtools.mdrun_all([task])
+                (requests,) = async_launcher.return_value.run.call_args[0]
+                self.assertIsNone(requests[0].relaunch)
+                mdtools.mdrun_all([dict(task, reseed=lambda: None)])
+                (requests,) = async_launcher.return_value.run.call_args[0]
+                self.assertIsNotNone(requests[0].relaunch)
+
+
+if __name__ == "__main__":
+    unittest.main()
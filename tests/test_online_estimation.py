@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from stringmethod.postprocessing import (
+    FreeEnergyCalculator,
+    OnlineFreeEnergyEstimator,
+    TransitionCountCalculator,
+)
+
+
+def create_transitions(n_transitions, rng, scale=1.0):
+    start = scale * rng.normal(size=(n_transitions, 2))
+    end = 0.5 * start + 0.9 * scale * rng.normal(size=start.shape)
+    return np.stack([start, end], axis=1)
+
+
+class TestOnlineFreeEnergyEstimator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.rng = np.random.default_rng(0)
+        self.transitions = [
+            create_transitions(2000, self.rng),
+            create_transitions(2000, self.rng, scale=0.5),
+            # A wider spread, which does not fit on the grid of the previous iterations
+            create_transitions(2000, self.rng, scale=2.0),
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _create_estimator(self):
+        return OnlineFreeEnergyEstimator(
+            postprocessing_dir=self.tmp_dir.name, n_grid_points=6
+        )
+
+    def _assert_matches_full_estimate(self, estimator, cv_coordinates):
+        tc = TransitionCountCalculator(
+            postprocessing_dir=self.tmp_dir.name,
+            cv_coordinates=cv_coordinates,
+            n_grid_points=6,
+        )
+        tc.grid = estimator.grid
+        transition_count = tc.compute_transition_count()
+        self.assertEqual(0, abs(estimator.transition_count - transition_count).max())
+        fc = FreeEnergyCalculator(
+            postprocessing_dir=self.tmp_dir.name,
+            transition_count=transition_count,
+            grid=estimator.grid,
+            method="power_iteration",
+        )
+        fc.run()
+        self.assertAlmostEqual(
+            abs(estimator.probability_distribution - fc.probability_distribution).max(),
+            0,
+            places=7,
+        )
+
+    def test_incremental_estimate(self):
+        estimator = self._create_estimator()
+        for iteration, transitions in enumerate(self.transitions[:2], start=1):
+            estimator.add_transitions(iteration, transitions)
+            estimator.run()
+            estimator.persist()
+        self._assert_matches_full_estimate(
+            estimator, np.concatenate(self.transitions[:2])
+        )
+        grid = estimator.grid
+        estimator.add_transitions(3, self.transitions[2])
+        estimator.run()
+        self.assertGreater(abs(estimator.grid - grid).max(), 0)
+        self._assert_matches_full_estimate(estimator, np.concatenate(self.transitions))
+        self.assertTrue(
+            os.path.isfile("{}/online/free_energy.npy".format(self.tmp_dir.name))
+        )
+
+    def test_estimate_continues_after_restart(self):
+        estimator = self._create_estimator()
+        estimator.add_transitions(1, self.transitions[0])
+        estimator.add_transitions(2, self.transitions[1])
+        estimator = self._create_estimator()
+        # Iteration 2 was run again
+        estimator.add_transitions(2, self.transitions[2])
+        estimator.run()
+        self._assert_matches_full_estimate(
+            estimator, np.concatenate([self.transitions[0], self.transitions[2]])
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
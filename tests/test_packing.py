@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from stringmethod.simulations import packing
+
+
+def _create_task(output_dir, mdrun_options=None, check_point_file=None):
+    return dict(
+        output_dir=output_dir,
+        tpr_file=output_dir + "/topol.tpr",
+        check_point_file=check_point_file,
+        mdrun_options=mdrun_options,
+        plumed_file=None,
+    )
+
+
+class TestPacking(unittest.TestCase):
+    def test_partial_batch(self):
+        tasks = [_create_task("s{}".format(i)) for i in range(100)]
+        waves = packing.plan_mdruns(tasks, n_ranks=64)
+        self.assertEqual(2, len(waves))
+        self.assertEqual([64, 36], [len(wave[0].tasks) for wave in waves])
+        for wave in waves:
+            self.assertLessEqual(sum(b.n_ranks for b in wave), 64)
+        # Small batches get the ranks which would otherwise be idle
+        waves = packing.plan_mdruns(tasks[:3], n_ranks=64)
+        self.assertEqual(21, waves[0][0].ranks_per_simulation)
+        waves = packing.plan_mdruns(tasks[:3], n_ranks=64, ranks_per_node=32)
+        self.assertEqual(16, waves[0][0].ranks_per_simulation)
+
+    def test_heterogeneous_tasks(self):
+        tasks = [_create_task("s{}".format(i)) for i in range(10)] + [
+            _create_task("restrained{}".format(i), mdrun_options=["-nsteps", "10"])
+            for i in range(4)
+        ]
+        waves = packing.plan_mdruns(tasks, n_ranks=32)
+        self.assertEqual(1, len(waves))
+        self.assertEqual(2, len(waves[0]))
+        self.assertLessEqual(sum(b.n_ranks for b in waves[0]), 32)
+        self.assertGreater(sum(b.n_ranks for b in waves[0]), 14)
+        # Simulations of similar length are batched together
+        waves = packing.plan_mdruns(tasks[:4], n_ranks=2, work=[10, 1, 10, 1])
+        self.assertListEqual(
+            [[10, 10], [1, 1]], [batch.work for wave in waves for batch in wave]
+        )
+        self.assertAlmostEqual(1, packing.get_utilization(waves, n_ranks=2))
+
+    def test_estimate_remaining_work(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            task = _create_task(tmp_dir)
+            self.assertIsNone(packing.estimate_remaining_work(task))
+            with open(os.path.join(tmp_dir, "mdout.mdp"), "w") as f:
+                f.write("nsteps = 1000\n")
+            self.assertEqual(1000, packing.estimate_remaining_work(task))
+            with open(os.path.join(tmp_dir, "md.log"), "w") as f:
+                f.write(
+                    "           Step           Time\n"
+                    "            200        0.40000\n\n"
+                    "           Step           Time\n"
+                    "            400        0.80000\n"
+                )
+            task["check_point_file"] = os.path.join(tmp_dir, "state.cpt")
+            self.assertEqual(600, packing.estimate_remaining_work(task))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+
+from stringmethod.postprocessing import TransitionCountCalculator
+from stringmethod.utils import periodicity
+from stringmethod.utils import string_reparametrization as sr
+from stringmethod.utils.scaling import MinMaxScaler
+
+
+class TestPeriodicity(unittest.TestCase):
+    def setUp(self):
+        self.periods = np.array([360, np.nan])
+
+    def test_wrap_and_minimum_image(self):
+        values = np.array([[180, 200], [-190, -190], [540, 1]])
+        wrapped = periodicity.wrap(values, self.periods)
+        self.assertListEqual([[-180, 200], [170, -190], [-180, 1]], wrapped.tolist())
+        displacements = periodicity.minimum_image(
+            np.array([[350, 350], [-200, -200]]), [360, None]
+        )
+        self.assertListEqual([[-10, 350], [160, -200]], displacements.tolist())
+
+    def test_reparametrization_across_boundary(self):
+        path = np.array([[170, 0], [175, 0], [-178, 0], [-170, 0]])
+        new_path = sr.reparametrize_path_iter(path, periods=self.periods)
+        unwrapped = periodicity.unwrap_path(new_path, self.periods)
+        self.assertAlmostEqual(abs(unwrapped[:, 0] - np.linspace(170, 190, 4)).max(), 0)
+        self.assertTrue(np.all(new_path[:, 0] >= -180) and np.all(new_path[:, 0] < 180))
+
+    def test_scaling_by_period(self):
+        path = periodicity.unwrap_path(np.array([[170, 0], [-170, 10]]), self.periods)
+        scaled = MinMaxScaler(periods=self.periods).fit_transform(path)
+        self.assertAlmostEqual(abs(scaled - [[0, 0], [20 / 360, 1]]).max(), 0)
+
+    def test_periodic_binning(self):
+        cv_coordinates = np.array(
+            [[[179, 0], [-179, 1]], [[-181, 0], [181, 1]], [[0, 0], [0, 1]]]
+        )
+        tc = TransitionCountCalculator(
+            postprocessing_dir=None,
+            cv_coordinates=cv_coordinates,
+            n_grid_points=4,
+            cv_periods=(360, None),
+        )
+        tc.run()
+        self.assertListEqual([-135, -45, 45, 135], tc.grid[:, 0].tolist())
+        grid_coordinates = tc._find_grid_coordinates(cv_coordinates[:, :, :])
+        self.assertListEqual([3, 0], grid_coordinates[0, :, 0].tolist())
+        self.assertListEqual([3, 0], grid_coordinates[1, :, 0].tolist())
+        self.assertListEqual([2, 2], grid_coordinates[2, :, 0].tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -60,7 +60,7 @@ class TestPostProcessing(unittest.TestCase):
         ) = create_constant_probability_distribution(
             n_grid_points=n_grid_points, n_transitions=n_transitions
         )
-        tc = TransitionCountCalculator(
+        tc = TransitionCountCalculator.from_config(
             config=self.config,
             n_grid_points=n_grid_points,
             cv_coordinates=cv_coordinates,
@@ -72,7 +72,7 @@ class TestPostProcessing(unittest.TestCase):
         )
         print(tc.transition_count)
         self.assertTrue(
-            np.all(tc.transition_count == n_transitions),
+            np.all(tc.transition_count.toarray() == n_transitions),
             "Transition count is constant",
         )
 
@@ -85,13 +85,13 @@ class TestPostProcessing(unittest.TestCase):
         ) = create_constant_probability_distribution(
             n_grid_points=n_grid_points
         )
-        tc = TransitionCountCalculator(
+        tc = TransitionCountCalculator.from_config(
             config=self.config,
             n_grid_points=n_grid_points,
             cv_coordinates=cv_coordinates,
         )
         tc.run()
-        fc = FreeEnergyCalculator(
+        fc = FreeEnergyCalculator.from_config(
             config=self.config,
             grid=tc.grid,
             transition_count=tc.transition_count,
@@ -123,19 +123,19 @@ class TestPostProcessing(unittest.TestCase):
             [[0, 0], [0, 0], [0, 1], [1, 1], [1, 0], [1, 0]]
         )
         in_transition_count = np.array([[2, 1], [2, 1]])
-        tc = TransitionCountCalculator(
+        tc = TransitionCountCalculator.from_config(
             config=self.config,
             n_grid_points=n_grid_points,
             cv_coordinates=cv_coordinates,
         )
         tc.run()
         self.assertAlmostEqual(
-            abs(in_transition_count - tc.transition_count).max(),
+            abs(in_transition_count - tc.transition_count.toarray()).max(),
             0,
             places=4,
             msg="Transition count differs",
         )
-        fc = FreeEnergyCalculator(
+        fc = FreeEnergyCalculator.from_config(
             config=self.config,
             grid=tc.grid,
             transition_count=tc.transition_count,
@@ -160,6 +160,127 @@ class TestPostProcessing(unittest.TestCase):
             msg="Total probability should equal 1",
         )
 
+    def test_sparse_solvers_match_detailed_balance(self):
+        n_grid_points = 6
+        # A fixed seed, since the solvers only agree if there is a unique stationary distribution
+        cv_coordinates = np.random.default_rng(0).normal(size=(2000, 2, 2))
+        cv_coordinates[:, 1] = (
+            0.7 * cv_coordinates[:, 0] + 0.3 * cv_coordinates[:, 1]
+        )
+        tc = TransitionCountCalculator.from_config(
+            config=self.config,
+            n_grid_points=n_grid_points,
+            cv_coordinates=cv_coordinates,
+        )
+        tc.run()
+        distributions = []
+        for method in ["detailed_balance", "power_iteration", "linear_solve"]:
+            fc = FreeEnergyCalculator.from_config(
+                config=self.config,
+                grid=tc.grid,
+                transition_count=tc.transition_count,
+                method=method,
+            )
+            fc.run()
+            distributions.append(fc.probability_distribution)
+        for prob in distributions[1:]:
+            self.assertAlmostEqual(
+                abs(distributions[0] - prob).max(),
+                0,
+                places=6,
+                msg="Probability distributions differ",
+            )
+
+    def test_sparse_eigensolver_matches_dense(self):
+        n_grid_points = 6
+        cv_coordinates = np.random.default_rng(0).normal(size=(2000, 2, 2))
+        cv_coordinates[:, 1] = (
+            0.7 * cv_coordinates[:, 0] + 0.3 * cv_coordinates[:, 1]
+        )
+        tc = TransitionCountCalculator.from_config(
+            config=self.config,
+            n_grid_points=n_grid_points,
+            cv_coordinates=cv_coordinates,
+        )
+        tc.run()
+        distributions = []
+        for eigensolver in ["dense", "sparse"]:
+            fc = FreeEnergyCalculator.from_config(
+                config=self.config,
+                grid=tc.grid,
+                transition_count=tc.transition_count,
+                method="eigenvector",
+                eigensolver=eigensolver,
+                n_eigenpairs=4,
+            )
+            fc.run()
+            distributions.append(fc.probability_distribution)
+        self.assertAlmostEqual(
+            abs(distributions[0] - distributions[1]).max(),
+            0,
+            places=8,
+            msg="Probability distributions differ",
+        )
+
+    def test_free_energy_on_3d_grid(self):
+        prob = np.random.rand(5, 5, 5)
+        prob[0, 1, 2] = 0
+        prob[4, 4, 4] = np.nan
+        prob /= np.nansum(prob)
+        fe = {}
+        for unreached_bins in ["max", "inf", "mask"]:
+            fc = FreeEnergyCalculator.from_config(
+                config=self.config,
+                transition_count=np.zeros((0, 0)),
+                probability_distribution=prob,
+                unreached_bins=unreached_bins,
+                dtype="float32",
+            )
+            fe[unreached_bins] = fc.compute_free_energy()
+            self.assertEqual(np.float32, fe[unreached_bins].dtype)
+        reached = np.isfinite(prob) & (prob > 0)
+        expected = -fc.kB * fc.T * np.log(prob[reached])
+        expected -= expected.min()
+        self.assertAlmostEqual(
+            abs(fe["max"][reached] - expected).max(), 0, places=4
+        )
+        self.assertTrue(np.all(fe["max"][~reached] == np.finfo(np.float32).max))
+        self.assertTrue(np.all(np.isinf(fe["inf"][~reached])))
+        self.assertTrue(np.array_equal(~reached, np.ma.getmaskarray(fe["mask"])))
+        # Unreached bins are infinite by default
+        fc = FreeEnergyCalculator.from_config(
+            config=self.config,
+            transition_count=np.zeros((0, 0)),
+            probability_distribution=prob,
+        )
+        self.assertTrue(np.all(np.isinf(fc.compute_free_energy()[~reached])))
+
+    def test_vectorized_binning_matches_closest_grid_point(self):
+        n_grid_points = 7
+        cv_coordinates = np.random.normal(size=(200, 2, 2))
+        cv_coordinates[3, 1, 0] = np.inf
+        tc = TransitionCountCalculator.from_config(
+            config=self.config,
+            n_grid_points=n_grid_points,
+            cv_coordinates=cv_coordinates,
+        )
+        tc.run()
+        self.assertTrue(np.all(np.isfinite(tc.grid)), "Grid ignores Inf values")
+        self.assertEqual(len(cv_coordinates) - 1, tc.transition_count.sum())
+        # Non-uniform grid
+        tc.grid[:, 0] = np.sort(np.random.normal(size=n_grid_points))
+        points = cv_coordinates[:, 0]
+        expected = np.array(
+            [
+                [np.abs(p[cv] - tc.grid[:, cv]).argmin() for cv in range(2)]
+                for p in points
+            ]
+        )
+        self.assertTrue(
+            np.array_equal(expected, tc._find_grid_coordinates(points)),
+            "Grid coordinates differ",
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,185 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+# The simulations modules import each other as top-level packages
+sys.path.append(os.path.join(os.path.dirname(__file__), "../stringmethod"))
+
+from simulations import stringmd
+from simulations.samplingmd import SamplingRunner
+from stringmethod.postprocessing import CvStore
+
+_STRING = np.array([[0.0, 0.0], [1.0, 1.0], [2.0, 2.0], [3.0, 3.0]])
+
+
+class TestSamplingRunner(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        tmp_dir = self._tmp_dir.name
+        self.runner = SamplingRunner(
+            append=False,
+            iteration=2,
+            string=_STRING.copy(),
+            swarm_size=2,
+            string_dir=os.path.join(tmp_dir, "strings"),
+            md_dir=os.path.join(tmp_dir, "md"),
+            mdp_dir=os.path.join(tmp_dir, "mdp"),
+            topology_dir=os.path.join(tmp_dir, "topology"),
+            postprocessing_dir=os.path.join(tmp_dir, "postprocessing"),
+            sampling_tolerance=0.05,
+        )
+        # The structures of the previous iteration, each file containing its own name
+        for point_idx in range(1, 3):
+            for name in ["restrained", "s0", "s1"]:
+                output_dir = "{}/1/{}/{}".format(self.runner.md_dir, point_idx, name)
+                os.makedirs(output_dir)
+                with open("{}/confout.gro".format(output_dir), "w") as f:
+                    f.write("{} {}".format(point_idx, name))
+        self.endpoints = np.full((4, 2, 2, 2), np.nan)
+        # Point 1: the first swarm ends next to the bead
+        self.endpoints[1, :, 0] = [1.2, 1.2]
+        self.endpoints[1, :, 1] = [[1.01, 1.0], [1.5, 1.5]]
+        # Point 2: nothing is within the tolerance
+        self.endpoints[2, :, 0] = [2.6, 2.6]
+        self.endpoints[2, :, 1] = [[2.9, 2.9], [1.4, 1.4]]
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _read(self, coordinate_file: str) -> str:
+        with open(coordinate_file) as f:
+            return f.read()
+
+    def test_closest_structure(self):
+        scale = np.array([3.0, 3.0])
+        coordinate_file, distance = self.runner._get_closest_structure(
+            1, self.endpoints[1], scale, None
+        )
+        self.assertEqual("1 s0", self._read(coordinate_file))
+        self.assertAlmostEqual(0.01 / 3, distance)
+        # Closest across the periodic boundary
+        coordinate_file, distance = self.runner._get_closest_structure(
+            1, self.endpoints[1] + 2, scale, np.array([2.0, 2.0])
+        )
+        self.assertEqual("1 s0", self._read(coordinate_file))
+        self.assertAlmostEqual(0.01 / 3, distance)
+        # The swarms start from the restrained simulation's output
+        endpoints = self.endpoints[1].copy()
+        endpoints[:, 0] = [1.0, 1.02]
+        endpoints[0, 1] = [1.5, 1.5]
+        coordinate_file, distance = self.runner._get_closest_structure(
+            1, endpoints, scale, None
+        )
+        self.assertEqual("1 restrained", self._read(coordinate_file))
+        self.assertAlmostEqual(0.02 / 3, distance)
+        # Swarms which did not finish are left out
+        endpoints = self.endpoints[1].copy()
+        endpoints[0] = np.nan
+        coordinate_file, _ = self.runner._get_closest_structure(
+            1, endpoints, scale, None
+        )
+        self.assertEqual("1 restrained", self._read(coordinate_file))
+        os.remove("{}/1/1/s0/confout.gro".format(self.runner.md_dir))
+        coordinate_file, _ = self.runner._get_closest_structure(
+            1, self.endpoints[1], scale, None
+        )
+        self.assertEqual("1 restrained", self._read(coordinate_file))
+        self.assertEqual(
+            (None, np.inf),
+            self.runner._get_closest_structure(1, self.endpoints[0], scale, None),
+        )
+
+    def test_chain_swarms(self):
+        self.runner._setup_dirs()
+        self.runner._chain_swarms(self.endpoints)
+        start_file = "{}/2/{}/restrained/confout.gro"
+        self.assertEqual("1 s0", self._read(start_file.format(self.runner.md_dir, 1)))
+        # Nothing within sampling_tolerance, the restrained simulation is run instead
+        self.assertFalse(os.path.exists(start_file.format(self.runner.md_dir, 2)))
+        self.runner.sampling_tolerance = 0.5
+        self.runner._chain_swarms(self.endpoints)
+        self.assertEqual(
+            "2 restrained", self._read(start_file.format(self.runner.md_dir, 2))
+        )
+        # Existing start structures are kept
+        self.runner._chain_swarms(self.endpoints * 0)
+        self.assertEqual("1 s0", self._read(start_file.format(self.runner.md_dir, 1)))
+
+    def test_skip_restrained(self):
+        self.runner._setup_dirs()
+        self.runner._chain_swarms(self.endpoints)
+        self.assertEqual(
+            (None, None), self.runner._create_restrained_tasks(1, _STRING[1])
+        )
+        grompp_args, mdrun_args = self.runner._create_restrained_tasks(2, _STRING[2])
+        self.assertEqual(
+            os.path.abspath("{}/1/2/restrained/confout.gro".format(self.runner.md_dir)),
+            grompp_args["structure_file"],
+        )
+        self.assertIsNotNone(mdrun_args)
+
+    def test_cv_store(self):
+        store = CvStore("{}/cv_store".format(self.runner.postprocessing_dir))
+        self.assertEqual(2, self.runner._get_first_unfinished_iteration(1))
+        # String iterations in the store do not count as sampling iterations
+        store.append(1, np.zeros((4, 2, 2)))
+        self.assertEqual(2, self.runner._get_first_unfinished_iteration(1))
+        self.runner._add_to_cv_store(self.endpoints)
+        store = CvStore("{}/cv_store".format(self.runner.postprocessing_dir))
+        self.assertEqual(3, self.runner._get_first_unfinished_iteration(1))
+        self.assertEqual(8, store.n_transitions)
+        np.testing.assert_array_equal(
+            self.endpoints[1:3].reshape((-1, 2, 2)), store.get_cv_coordinates(2, 2)
+        )
+        self.assertListEqual(
+            [
+                "{}/2/{}/s{}/pullx.xvg".format(self.runner.md_dir, point_idx, swarm_idx)
+                for point_idx in range(1, 3)
+                for swarm_idx in range(2)
+            ],
+            store.get_files(2),
+        )
+        # A swarm left out by the quorum replaces the earlier attempt
+        self.endpoints[2, 1] = np.nan
+        self.runner._add_to_cv_store(self.endpoints)
+        store = CvStore("{}/cv_store".format(self.runner.postprocessing_dir))
+        self.assertEqual(7, store.n_transitions)
+        self.assertEqual(3, len(store.get_files(2)))
+
+    def test_raw_endpoints(self):
+        def shift_in_place(data):
+            data += 10
+            return data
+
+        self.runner.use_function = True
+        self.runner._setup_dirs()
+        for iteration in range(2):
+            np.savetxt(self.runner._get_string_filepath(iteration), _STRING)
+        raw_endpoints = self.endpoints.copy()
+        self.runner._online_estimator = mock.Mock()
+        with mock.patch.object(stringmd, "custom_function", shift_in_place):
+            np.testing.assert_array_equal(
+                raw_endpoints + 10, self.runner._transform_endpoints(self.endpoints)
+            )
+            self.runner._chain_swarms(self.endpoints)
+            self.runner._add_to_cv_store(self.endpoints)
+            self.runner._compute_new_string(self.endpoints)
+            self.runner._update_online_free_energy(self.endpoints)
+        np.testing.assert_array_equal(raw_endpoints, self.endpoints)
+        # The CV store and the online estimate get the values written by the simulations
+        store = CvStore("{}/cv_store".format(self.runner.postprocessing_dir))
+        np.testing.assert_array_equal(
+            raw_endpoints[1:3].reshape((-1, 2, 2)), store.get_cv_coordinates(2, 2)
+        )
+        transitions = self.runner._online_estimator.add_transitions.call_args[0][1]
+        np.testing.assert_array_equal(
+            raw_endpoints[1:3].reshape((-1, 2, 2)), transitions
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
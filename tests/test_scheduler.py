@@ -0,0 +1,163 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# The simulations modules import each other as top-level packages
+sys.path.append(os.path.join(os.path.dirname(__file__), "../stringmethod"))
+
+from simulations import scheduler
+from simulations.gmx_jobs import gmx_jobs
+from simulations.gmx_jobs.executors import AbstractExecutor
+
+
+class RecordingExecutor(AbstractExecutor):
+    """Records the simulations it runs instead of running gmx"""
+
+    def __init__(self, n_cores: int, duration: float = 0.0):
+        super().__init__()
+        self._n_cores = n_cores
+        self.duration = duration
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    @property
+    def n_cores(self) -> int:
+        return self._n_cores
+
+    def run_grompps(self, task_list):
+        self._run(task_list)
+
+    def run_mdruns(self, task_list):
+        self._run(task_list)
+
+    def _run(self, task_list):
+        with self._lock:
+            self.started += [t["name"] for t in task_list]
+            self.running += sum(t.get("n_cores", 1) for t in task_list)
+            self.max_running = max(self.max_running, self.running)
+        for task in task_list:
+            if task.get("fail"):
+                raise IOError("{} failed".format(task["name"]))
+            if task.get("output_file") is not None:
+                open(task["output_file"], "w").close()
+        time.sleep(self.duration)
+        with self._lock:
+            self.running -= sum(t.get("n_cores", 1) for t in task_list)
+
+
+def _create_task(name: str, n_cores: int = 1, **kwargs) -> scheduler.ScheduledTask:
+    return scheduler.ScheduledTask(
+        name=name,
+        tasks=[("mdrun", dict(name=name, n_cores=n_cores))],
+        n_cores=n_cores,
+        **kwargs
+    )
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.executor = RecordingExecutor(n_cores=2, duration=0.1)
+        gmx_jobs.set_executor(self.executor)
+
+    def tearDown(self):
+        gmx_jobs.set_executor(None)
+
+    def test_dependencies(self):
+        pipeline = scheduler.PipelineScheduler(n_cores=4)
+        pipeline.add(_create_task("swarms", dependencies=["restrained"]))
+        pipeline.add(_create_task("restrained", dependencies=["grompp"]))
+        pipeline.add(_create_task("grompp"))
+        # Dependencies which were not scheduled are already done
+        pipeline.add(_create_task("other", dependencies=["previous_iteration"]))
+        pipeline.run()
+        self.assertEqual(4, len(self.executor.started))
+        started = self.executor.started
+        self.assertLess(started.index("grompp"), started.index("restrained"))
+        self.assertLess(started.index("restrained"), started.index("swarms"))
+
+    def test_required_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            confout = os.path.join(tmp_dir, "confout.gro")
+            pipeline = scheduler.PipelineScheduler(n_cores=4)
+            pipeline.add(_create_task("swarms", required_files=[confout]))
+            pipeline.add(
+                scheduler.ScheduledTask(
+                    name="restrained",
+                    tasks=[("mdrun", dict(name="restrained", output_file=confout))],
+                )
+            )
+            pipeline.run()
+            self.assertListEqual(["restrained", "swarms"], self.executor.started)
+            # Tasks whose files never appear cannot be started
+            pipeline = scheduler.PipelineScheduler(n_cores=4)
+            pipeline.add(
+                _create_task(
+                    "swarms", required_files=[os.path.join(tmp_dir, "missing.gro")]
+                )
+            )
+            with self.assertRaises(IOError):
+                pipeline.run()
+
+    def test_prepare(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "swarms.mdp")
+            prepared = []
+
+            def prepare():
+                # The task is not submitted before its input files are written
+                self.assertListEqual([], self.executor.started)
+                open(input_file, "w").close()
+                prepared.append(True)
+
+            pipeline = scheduler.PipelineScheduler(n_cores=1)
+            pipeline.add(_create_task("swarms", prepare=prepare))
+            pipeline.run()
+            self.assertListEqual([True], prepared)
+            self.assertTrue(os.path.isfile(input_file))
+            self.assertListEqual(["swarms"], self.executor.started)
+
+    def test_cores(self):
+        self.assertEqual(2, scheduler.available_cores())
+        pipeline = scheduler.PipelineScheduler(n_cores=scheduler.available_cores())
+        for i in range(4):
+            pipeline.add(_create_task("single{}".format(i)))
+        # A task larger than the scheduler gets all cores
+        pipeline.add(
+            scheduler.ScheduledTask(
+                name="large",
+                tasks=[("mdrun", dict(name="large", n_cores=2))],
+                n_cores=4,
+            )
+        )
+        start_time = time.perf_counter()
+        pipeline.run()
+        self.assertEqual(5, len(self.executor.started))
+        self.assertEqual(2, self.executor.max_running)
+        # Two waves of single core tasks, the large one runs alone
+        self.assertGreater(time.perf_counter() - start_time, 0.25)
+        with self.assertRaises(ValueError):
+            scheduler.PipelineScheduler(n_cores=0)
+
+    def test_failure(self):
+        pipeline = scheduler.PipelineScheduler(n_cores=2)
+        pipeline.add(
+            scheduler.ScheduledTask(
+                name="restrained",
+                tasks=[("mdrun", dict(name="restrained", fail=True))],
+            )
+        )
+        pipeline.add(_create_task("swarms", dependencies=["restrained"]))
+        with self.assertRaisesRegex(IOError, "restrained failed"):
+            pipeline.run()
+        self.assertNotIn("swarms", self.executor.started)
+        with self.assertRaises(ValueError):
+            pipeline.add(_create_task("swarms"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from stringmethod.simulations import stragglers
+
+
+class TestStragglers(unittest.TestCase):
+    def test_stalled(self):
+        detector = stragglers.StragglerDetector(stall_timeout=10, slowdown=None)
+        detector.start("s0", 0, now=0)
+        detector.update("s0", 100, now=5)
+        self.assertFalse(detector.is_straggler("s0", now=14))
+        self.assertTrue(detector.is_straggler("s0", now=16))
+
+    def test_slow(self):
+        detector = stragglers.StragglerDetector(stall_timeout=10, slowdown=3)
+        for i in range(4):
+            detector.start("s{}".format(i), 0, now=0)
+        for i in range(3):
+            detector.update("s{}".format(i), 1000, now=20)
+        detector.finish("s0", now=20)
+        detector.update("s3", 200, now=20)
+        # Too early to tell
+        self.assertFalse(detector.is_slow("s3", now=5))
+        self.assertTrue(detector.is_slow("s3", now=20))
+        self.assertFalse(detector.is_slow("s1", now=20))
+        detector.discard("s1")
+        # Not enough peers left to compare with
+        self.assertFalse(detector.is_slow("s3", now=20))
+
+    def test_progress(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "md.log"), "w") as f:
+                f.write("x" * 10)
+            # The stderr of mdrun does not count as progress
+            with open(os.path.join(tmp_dir, "mdrun.err"), "w") as f:
+                f.write("x" * 100)
+            missing_dir = os.path.join(tmp_dir, "missing")
+            self.assertEqual(10, stragglers.get_progress([tmp_dir, missing_dir]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from stringmethod.utils import string_reparametrization as sr
+
+
+class TestStringReparametrization(unittest.TestCase):
+    def test_equidistant_points_on_straight_line(self):
+        path = np.array([[0, 0], [0.1, 0.1], [0.15, 0.15], [0.9, 0.9], [1, 1]])
+        new_path = sr.reparametrize_path_iter(path)
+        expected = np.array([np.linspace(0, 1, 5), np.linspace(0, 1, 5)]).T
+        self.assertAlmostEqual(abs(expected - new_path).max(), 0, places=10)
+
+    def test_weighted_arc_lengths(self):
+        path = np.linspace(0, 1, 4)[:, np.newaxis] * np.array([[1, 2, 3]])
+        weights = np.array([1, 2, 1])
+        new_path = sr.reparametrize_path_arclength(path, arclength_weight=weights)
+        arc_lengths = sr.compute_arclengths(new_path)
+        self.assertAlmostEqual(
+            abs(arc_lengths / arc_lengths.sum() - weights / weights.sum()).max(),
+            0,
+            places=10,
+        )
+
+    def test_bent_path_keeps_endpoints(self):
+        path = np.array([[0, 0], [0.2, 0], [1, 0], [1, 0.5], [1, 1]])
+        new_path = sr.reparametrize_path_iter(path, convergence=1e-6)
+        self.assertEqual(path.shape, new_path.shape)
+        self.assertAlmostEqual(abs(path[[0, -1]] - new_path[[0, -1]]).max(), 0)
+        arc_lengths = sr.compute_arclengths(new_path)
+        self.assertAlmostEqual(arc_lengths.std() / arc_lengths.mean(), 0, places=4)
+
+    def test_grid_reparametrization_in_chunks(self):
+        path = np.array([[0, 0], [0.1, 0.1], [0.15, 0.15], [0.9, 0.9], [1, 1]])
+        new_path = sr.reparametrize_path_grid(path, resolution=1000)
+        chunked_path = sr.reparametrize_path_grid(
+            path, resolution=1000, max_chunk_values=100
+        )
+        expected = np.array([np.linspace(0, 1, 5), np.linspace(0, 1, 5)]).T
+        self.assertAlmostEqual(abs(expected - new_path).max(), 0, places=2)
+        self.assertAlmostEqual(abs(chunked_path - new_path).max(), 0, places=10)
+
+    def test_one_dimensional_path(self):
+        path = np.linspace(0, 1, 7) ** 2
+        new_path = sr.reparametrize_path_iter(path)
+        self.assertEqual(path.shape, new_path.shape)
+        self.assertAlmostEqual(abs(np.linspace(0, 1, 7) - new_path).max(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
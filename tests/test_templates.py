@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from stringmethod.utils import templates
+
+
+class TestTemplates(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.plumed_file = os.path.join(self.tmp_dir.name, "plumed.dat")
+        with open(self.plumed_file, "w") as f:
+            f.write(
+                "phi: TORSION ATOMS=5,7,9,15\n"
+                "m1: RESTRAINT ARG=phi KAPPA=1000 AT=XXX\n"
+                "m2: RESTRAINT ARG=psi KAPPA=1000 AT=XXX\n"
+                "PRINT FILE=colvar ARG=phi,psi\n"
+            )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_render(self):
+        template = templates.PlumedTemplate(self.plumed_file)
+        self.assertEqual(2, template.n_placeholders)
+        restrained = template.render([1.5, -2])
+        self.assertIn("AT=1.5\n", restrained)
+        self.assertIn("AT=-2\n", restrained)
+        unrestrained = template.render(None)
+        self.assertNotIn("RESTRAINT", unrestrained)
+        self.assertIn("PRINT FILE=colvar", unrestrained)
+        mdp_file = os.path.join(self.tmp_dir.name, "restrained.mdp")
+        with open(mdp_file, "w") as f:
+            f.write("nsteps = 10\n")
+        mdp = templates.MdpTemplate(mdp_file)
+        self.assertEqual("nsteps = 10\n", mdp.render({}))
+        self.assertTrue(mdp.render({"pull-coord1-init": 0.5}).endswith("=0.5\n"))
+
+    def test_mdp_overrides(self):
+        mdp_file = os.path.join(self.tmp_dir.name, "swarms.mdp")
+        with open(mdp_file, "w") as f:
+            f.write("integrator = sd\nld_seed = -1 ; random\nnsteps = 10\n")
+        rendered = templates.MdpTemplate(mdp_file).render({"ld-seed": 42})
+        self.assertIn("; ld_seed = -1", rendered)
+        self.assertIn("\nnsteps = 10\n", rendered)
+        self.assertTrue(rendered.endswith("ld-seed=42\n"))
+
+    def test_cache(self):
+        first = templates.load_template(templates.PlumedTemplate, self.plumed_file)
+        self.assertIs(
+            first, templates.load_template(templates.PlumedTemplate, self.plumed_file)
+        )
+        with open(self.plumed_file, "w") as f:
+            f.write("m1: RESTRAINT ARG=phi KAPPA=500 AT=XXX\n")
+        updated = templates.load_template(templates.PlumedTemplate, self.plumed_file)
+        self.assertIsNot(first, updated)
+        self.assertEqual(1, updated.n_placeholders)
+
+    def test_write_only_changed_files(self):
+        files = {
+            os.path.join(self.tmp_dir.name, "{}.dat".format(i)): "content {}".format(i)
+            for i in range(4)
+        }
+        self.assertEqual(4, templates.write_all(files, n_workers=2))
+        self.assertEqual(0, templates.write_all(files, n_workers=2))
+        files[os.path.join(self.tmp_dir.name, "0.dat")] = "content 10"
+        self.assertEqual(1, templates.write_all(files, n_workers=2))
+        with open(os.path.join(self.tmp_dir.name, "0.dat")) as f:
+            self.assertEqual("content 10", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from stringmethod.postprocessing import UncertaintyEstimator
+
+
+class TestUncertaintyEstimator(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        start = rng.normal(size=(3000, 2))
+        end = 0.5 * start + 0.9 * rng.normal(size=start.shape)
+        self.cv_coordinates = np.stack([start, end], axis=1)
+        self.iteration_numbers = np.repeat(np.arange(1, 31), 100)
+
+    def _estimate(self, **kwargs):
+        ue = UncertaintyEstimator(
+            postprocessing_dir=None,
+            cv_coordinates=self.cv_coordinates,
+            iteration_numbers=self.iteration_numbers,
+            n_grid_points=6,
+            n_resamples=20,
+            seed=1,
+            **kwargs
+        )
+        ue.run()
+        return ue
+
+    def test_bootstrap(self):
+        ue = self._estimate(n_workers=1)
+        reached = np.isfinite(ue.free_energy)
+        self.assertTrue(np.array_equal(reached, np.isfinite(ue.free_energy_mean)))
+        self.assertTrue(np.all(ue.free_energy_std[reached] >= 0))
+        self.assertGreater(np.nanmax(ue.free_energy_std), 0)
+        # The free energy of well sampled bins should be within a few standard deviations of the full estimate
+        well_sampled = reached & (ue.free_energy < 2)
+        self.assertTrue(
+            np.all(
+                abs(ue.free_energy_mean - ue.free_energy)[well_sampled]
+                < 5 * ue.free_energy_std[well_sampled] + 1e-6
+            )
+        )
+
+    def test_parallel_resamples_match_serial(self):
+        serial = self._estimate(n_workers=1, resampling="block")
+        parallel = self._estimate(n_workers=2, resampling="block")
+        self.assertAlmostEqual(
+            np.nanmax(abs(serial.free_energy_mean - parallel.free_energy_mean)),
+            0,
+            places=10,
+        )
+        self.assertAlmostEqual(
+            np.nanmax(abs(serial.free_energy_std - parallel.free_energy_std)),
+            0,
+            places=10,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
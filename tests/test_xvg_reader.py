@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from stringmethod.utils import xvg_reader
+
+
+def write_xvg(file_name, data, extra_lines=()):
+    with open(file_name, "w") as f:
+        f.write("# This file was created by gmx\n")
+        f.write('@    title "Pull COM"\n')
+        for row in data:
+            f.write("\t".join(str(v) for v in row) + "\n")
+        for line in extra_lines:
+            f.write(line)
+
+
+class TestXvgReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.tmp_dir.name, "pullx.xvg")
+        self.data = np.random.rand(500, 4)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_load_xvg(self):
+        write_xvg(self.file_name, self.data)
+        data = xvg_reader.load_xvg(self.file_name)
+        self.assertEqual(self.data.shape, data.shape)
+        self.assertAlmostEqual(abs(self.data - data).max(), 0, places=10)
+
+    def test_load_xvg_skips_broken_lines(self):
+        write_xvg(self.file_name, self.data, extra_lines=["1.0 2.0\n"])
+        data = xvg_reader.load_xvg(self.file_name)
+        self.assertEqual(self.data.shape, data.shape)
+        self.assertAlmostEqual(abs(self.data - data).max(), 0, places=10)
+
+    def test_load_xvg_endpoints(self):
+        write_xvg(self.file_name, self.data, extra_lines=["1.0 2.0"])
+        # Make sure the last line is found across several blocks
+        block_size, xvg_reader._TAIL_BLOCK_SIZE = xvg_reader._TAIL_BLOCK_SIZE, 16
+        try:
+            data = xvg_reader.load_xvg_endpoints(self.file_name)
+        finally:
+            xvg_reader._TAIL_BLOCK_SIZE = block_size
+        self.assertEqual((2, 4), data.shape)
+        self.assertAlmostEqual(abs(self.data[[0, -1]] - data).max(), 0, places=10)
+
+
+if __name__ == "__main__":
+    unittest.main()